@@ -1,4 +1,6 @@
 from asteroid.models import ConvTasNet
+from asteroid.models.base_models import jitable_shape, _unsqueeze_to_3d, _shape_reconstructed
+from asteroid.utils.torch_utils import pad_x_to_y
 import torch
 
 class ConvTasNetNorm(ConvTasNet):
@@ -24,8 +26,6 @@ class ConvTasNetNorm(ConvTasNet):
             sample_rate=8000,
             **fb_kwargs,
         ):
-        self.mean = None
-        self.std = None
         super(ConvTasNetNorm, self).__init__(
             n_src,
             out_chan=out_chan,
@@ -47,20 +47,35 @@ class ConvTasNetNorm(ConvTasNet):
             sample_rate=sample_rate,
             **fb_kwargs,
         )
-    def forward_encoder(self, wav: torch.Tensor) -> torch.Tensor:
-        # pre filter
-        self.mean = torch.mean(wav)
-        self.std = torch.std(wav)
-
-        wav = (wav - self.mean) / (1e-5 + self.std)
-        if torch.cuda.is_available():
-            wav = wav.cuda()
-        return super(ConvTasNetNorm, self).forward_encoder(wav)
+    def forward(self, wav):
+        """ Same as BaseEncoderMaskerDecoder.forward, with the mixture
+        normalized before the encoder and the estimates unnormalized after
+        the decoder. The statistics are passed along instead of being kept
+        in the model, so the same instance can separate several mixtures
+        concurrently (e.g. from a thread pool).
+        """
+        # Remember shape to shape reconstruction
+        shape = jitable_shape(wav)
+        # Reshape to (batch, n_mix, time)
+        wav = _unsqueeze_to_3d(wav)
+        wav, mean, std = self.normalize(wav)
 
-    def forward_decoder(self, masked_tf_rep: torch.Tensor) -> torch.Tensor:
-        waveforms = super(ConvTasNetNorm, self).forward_decoder(masked_tf_rep)
-        waveforms = waveforms * self.std + self.mean
+        tf_rep = self.forward_encoder(wav)
+        est_masks = self.forward_masker(tf_rep)
+        masked_tf_rep = self.apply_masks(tf_rep, est_masks)
+        decoded = self.forward_decoder(masked_tf_rep)
+        decoded = decoded * std + mean
 
-        return waveforms
-        # return super(ConvTasNetNorm, self).forward_decoder(masked_tf_rep)
+        reconstructed = pad_x_to_y(decoded, wav)
+        return _shape_reconstructed(reconstructed, shape)
 
+    def normalize(self, wav):
+        """ Returns the (batch, n_mix, time) wav normalized, each example and
+        channel with its own statistics, on the device of the model, and
+        the mean and standard deviation used.
+        """
+        # pre filter
+        wav = wav.to(next(self.parameters()).device)
+        mean = torch.mean(wav, dim=-1, keepdim=True)
+        std = torch.std(wav, dim=-1, keepdim=True)
+        return (wav - mean) / (1e-5 + std), mean, std
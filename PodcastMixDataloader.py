@@ -1,17 +1,81 @@
 import torch
 from torch.utils.data import Dataset
-import pandas as pd
 import torchaudio
 import os
 import numpy as np
 import random
+import json
+from concurrent.futures import ThreadPoolExecutor
 from utils.resampler import Resampler
+from utils.audio_store import AudioStore
+from utils.audio_cache import AudioLRUCache
+from utils.music_energy import MusicEnergyIndex
+from utils.podcastmix_index import PodcastMixIndex
+from utils.mixing import SourceMixer
+from utils.stage_timer import StageTimer
+
+def pad_segment(audio_signal, seq_duration_samples, padding_offset=None):
+    """ Zero pads audio_signal at a random position (or at padding_offset) if
+    it is shorter than seq_duration_samples.
+    """
+    total_samples = audio_signal.shape[-1]
+    if seq_duration_samples > total_samples:
+        # add zeros at beginning and at with random offset
+        if padding_offset is None:
+            padding_offset = random.randint(0, seq_duration_samples - total_samples)
+        audio_signal = torch.nn.ConstantPad1d(
+            (
+                padding_offset,
+                seq_duration_samples - total_samples - padding_offset
+            ),
+            0
+        )(audio_signal)
+    return audio_signal
+
+
+def build_speech_segment(speech_mix, array_size, other_speech_signal=None,
+                         other_offset=None, shift=None):
+    """ Turns a buffer of concatenated utterances of at least array_size
+    samples into a speech segment of array_size samples.
+    If other_speech_signal is given, it is overlapped in a random position of
+    the buffer (or at other_offset). The buffer is then shifted in a random
+    position (or by shift) to prevent always getting buffers that starts with
+    the beginning of a speech.
+    """
+    if other_speech_signal is not None:
+        other_speech_signal_length = other_speech_signal.shape[-1]
+        if len(speech_mix) < other_speech_signal.shape[-1]:
+            # the second speaker is longer than the original one
+            other_speech_signal_length = len(speech_mix)
+        offset = other_offset
+        if offset is None:
+            offset = random.randint(0, len(speech_mix) - other_speech_signal_length)
+        speech_mix[offset:offset + other_speech_signal_length] += other_speech_signal[:other_speech_signal_length]
+        speech_mix = speech_mix / 2
+
+    # we have a segment with the two speakers, the second in a random start.
+    # now we randomly shift the array to pick the start
+    offset = shift
+    if offset is None:
+        offset = random.randint(0, array_size)
+    zeros_aux = torch.zeros(len(speech_mix))
+    aux = speech_mix[:offset]
+
+    zeros_aux[:len(speech_mix) - offset] = speech_mix[offset:len(speech_mix)]
+    zeros_aux[len(speech_mix) - offset:] = aux
+
+    return zeros_aux[:array_size]
+
 
 class PodcastMixDataloader(Dataset):
     dataset_name = "PodcastMix"
 
     def __init__(self, csv_dir, sample_rate=44100, original_sample_rate= 44100, segment=2,
-                 shuffle_tracks=False, multi_speakers=False):
+                 shuffle_tracks=False, multi_speakers=False,
+                 use_audio_store=False, audio_store_dir=None,
+                 use_energy_index=False, speech_cache_bytes=0,
+                 raw_sources=False, resample_in_batch=False, io_threads=0,
+                 recipe_path=None, profile=False):
         self.csv_dir = csv_dir
         self.segment = segment
         # sample_rate of the original files
@@ -20,6 +84,13 @@ class PodcastMixDataloader(Dataset):
         self.sample_rate = sample_rate
         self.shuffle_tracks = shuffle_tracks
         self.multi_speakers = multi_speakers
+        # return the unmixed sources and the music gain, to mix whole
+        # batches at once (see utils/mixing.py)
+        self.raw_sources = raw_sources
+        self.mixer = SourceMixer()
+        # leave the resampling of the raw sources to the batch stage
+        assert raw_sources or not resample_in_batch
+        self.resample_in_batch = resample_in_batch
 
         if not self.sample_rate == self.original_sample_rate:
             self.resampler = Resampler(
@@ -29,22 +100,13 @@ class PodcastMixDataloader(Dataset):
                 filter='hann'
             )
 
-        # declare dataframes
-        self.speech_csv_path = os.path.join(self.csv_dir, 'speech.csv')
-        self.music_csv_path = os.path.join(self.csv_dir, 'music.csv')
-        self.df_speech = pd.read_csv(self.speech_csv_path, engine='python')
-
-        # dictionary of speakers
-        self.speakers_dict = {}
-        for speaker_id in self.df_speech.speaker_id.unique():
-            self.speakers_dict[speaker_id] = self.df_speech.loc[
-                self.df_speech['speaker_id'] == speaker_id
-            ]
-        self.df_music = pd.read_csv(self.music_csv_path, engine='python')
+        # speaker -> utterances and tracks index built from speech.csv
+        # and music.csv, cached as podcastmix_index.npz in csv_dir
+        self.index = PodcastMixIndex.load(self.csv_dir)
 
         # initialize indexes
-        self.speech_inxs = list(range(len(self.df_speech)))
-        self.music_inxs = list(range(len(self.df_music)))
+        self.speech_inxs = np.arange(len(self.index.row_speaker))
+        self.music_inxs = np.arange(len(self.index.track_paths))
 
         # declare the resolution of the reduction factor.
         # this will create N different gain values max
@@ -58,8 +120,71 @@ class PodcastMixDataloader(Dataset):
         # use soundfile as backend
         torchaudio.set_audio_backend(backend='soundfile')
 
+        # read the pre-decoded audio from memory mapped shards instead
+        # of the flac files (see dataset_creation/create_audio_store.py)
+        self.audio_store = None
+        if use_audio_store:
+            if audio_store_dir is None:
+                audio_store_dir = os.path.join(self.csv_dir, 'audio_store')
+            self.audio_store = AudioStore(audio_store_dir)
+
+        # frame energies of the music tracks, to pick non-silent segments
+        # without retrying (see dataset_creation/create_energy_index.py)
+        self.energy_index = None
+        if use_energy_index:
+            self.energy_index = MusicEnergyIndex(
+                self.csv_dir,
+                self.index.track_paths
+            )
+        # decoded speech utterances, kept by each worker up to
+        # speech_cache_bytes. Its hits, misses and evictions are counted by
+        # the timer
+        self.speech_cache = None
+        if speech_cache_bytes > 0:
+            self.speech_cache = AudioLRUCache(speech_cache_bytes)
+
+        # read the files of each item concurrently with io_threads threads
+        # (soundfile releases the GIL while reading and decoding)
+        self.io_threads = io_threads
+        self._io_pool = None
+        self._io_pool_pid = None
+
+        # replay the mixtures written by dataset_creation/create_mixing_recipe.py
+        # instead of drawing them at random
+        self.recipe = None
+        if recipe_path is not None:
+            with open(recipe_path) as f:
+                recipe = json.load(f)
+            assert recipe['segment'] == self.segment
+            assert recipe['original_sample_rate'] == self.original_sample_rate
+            self.recipe = recipe['items']
+
+        # time spent in each stage, bytes read and silent segments read again
+        # (or avoided with the energy index), see benchmark_dataloader.py
+        self.timer = StageTimer(enabled=profile)
+        self._file_lengths = None
+
+    def __getstate__(self):
+        # the thread pool can not be pickled, each process creates its own
+        state = self.__dict__.copy()
+        state['_io_pool'] = None
+        state['_io_pool_pid'] = None
+        return state
+
+    def io_pool(self):
+        """ Returns the thread pool of the current process. Forked DataLoader
+        workers do not inherit the threads of the parent, so the pool is
+        created again when the pid changes.
+        """
+        if self._io_pool is None or self._io_pool_pid != os.getpid():
+            self._io_pool = ThreadPoolExecutor(max_workers=self.io_threads)
+            self._io_pool_pid = os.getpid()
+        return self._io_pool
+
     def __len__(self):
-        return min([len(self.df_speech), len(self.df_music)])
+        if self.recipe is not None:
+            return len(self.recipe)
+        return min([len(self.speech_inxs), len(self.music_inxs)])
 
     def compute_rand_offset_duration(self, original_num_frames, segment_frames):
         """ Computes a random offset and the number of frames to read from a file
@@ -90,61 +215,145 @@ class PodcastMixDataloader(Dataset):
             offset = int(random.uniform(0, original_num_frames - segment_frames))
 
         return offset, segment_frames
-    
+
+    def load_audio(self, audio_path, frame_offset=0, num_frames=-1):
+        """ Loads the (channels, frames) waveform of audio_path, from the
+        audio store if it is used, or decoding the file otherwise.
+        """
+        with self.timer.stage('decode'):
+            if self.audio_store is not None:
+                audio_signal = self.audio_store.load(audio_path, frame_offset, num_frames)
+            else:
+                audio_signal, _ = torchaudio.load(
+                    audio_path,
+                    frame_offset=frame_offset,
+                    num_frames=num_frames
+                )
+        if self.timer.enabled:
+            self.timer.count('bytes_read', self.bytes_read(audio_path, audio_signal))
+        return audio_signal
+
+    def bytes_read(self, audio_path, audio_signal):
+        """ Number of bytes read from the storage to load audio_signal. For
+        the compressed files, the share of the file size of the frames read.
+        """
+        if self.audio_store is not None:
+            return audio_signal.nelement() * self.audio_store.itemsize(audio_path)
+        if self._file_lengths is None:
+            self._file_lengths = dict(zip(self.index.utterance_paths, self.index.utterance_lengths))
+            self._file_lengths.update(zip(self.index.track_paths, self.index.track_lengths))
+        length = int(self._file_lengths.get(audio_path, audio_signal.shape[-1]))
+        return int(os.path.getsize(audio_path) * audio_signal.shape[-1] / max(length, 1))
+
+    def get_cached_speech(self, audio_path):
+        """ Returns the cached speech of audio_path, or None """
+        speech_signal = self.speech_cache.get(audio_path)
+        self.timer.count('speech_cache_hits' if speech_signal is not None else 'speech_cache_misses', 1)
+        return speech_signal
+
+    def cache_speech(self, audio_path, speech_signal):
+        evictions = self.speech_cache.evictions
+        self.speech_cache.put(audio_path, speech_signal)
+        self.timer.count('speech_cache_evictions', self.speech_cache.evictions - evictions)
+
+    def load_speech(self, audio_path):
+        """ Loads the first channel of a whole speech file, going through the
+        speech cache if it is used. The returned tensor must not be modified
+        in place.
+        """
+        if self.speech_cache is not None:
+            speech_signal = self.get_cached_speech(audio_path)
+            if speech_signal is not None:
+                return speech_signal
+        speech_signal = self.load_audio(audio_path)[0]
+        if self.speech_cache is not None:
+            self.cache_speech(audio_path, speech_signal)
+        return speech_signal
+
     def load_mono_random_segment(self, audio_signal, audio_length, audio_path, max_segment):
+        attempts = 0
         while audio_length - torch.count_nonzero(audio_signal) == audio_length:
+            attempts += 1
             # If there is a seg, start point is set randomly
             offset, duration = self.compute_rand_offset_duration(
                 audio_length,
                 max_segment
             )
-            # load the audio with the computed offsets
-            audio_signal, _ = torchaudio.load(
-                audio_path,
-                frame_offset=offset,
-                num_frames=duration
-            )
+            # load the audio with the computed offsets, the reads after
+            # the first one are retries
+            with self.timer.stage('silence_retries' if attempts > 1 else 'decode'):
+                audio_signal = self.load_audio(
+                    audio_path,
+                    frame_offset=offset,
+                    num_frames=duration
+                )
+        # segments read again because they were silent
+        self.timer.count('silence_retries', attempts - 1)
         # convert to mono
         if len(audio_signal) == 2:
             audio_signal = torch.mean(audio_signal, dim=0).unsqueeze(0)
         return audio_signal
 
-    def load_non_silent_random_music(self, row):
-        """ Randomly selects a non_silent part of the audio given by audio_path
+    def load_indexed_segment(self, track_idx, audio_length, audio_path, max_segment):
+        """ Same as load_mono_random_segment, but the offset is drawn among
+        the ones known to be non-silent from the energy index, so the segment
+        is read only once.
+        """
+        if max_segment >= audio_length:
+            offset, duration = 0, audio_length
+        else:
+            offset, fraction = self.energy_index.sample_offset(track_idx, max_segment)
+            if offset is None:
+                # no frame fits entirely in a segment, search as usual
+                audio_signal = torch.zeros(max_segment)
+                return self.load_mono_random_segment(
+                    audio_signal, audio_length, audio_path, max_segment
+                )
+            duration = max_segment
+            # expected number of silent segments read by the random search
+            self.timer.count('silence_retries_saved', (1 - fraction) / fraction)
+        audio_signal = self.load_audio(
+            audio_path,
+            frame_offset=offset,
+            num_frames=duration
+        )
+        # convert to mono
+        if len(audio_signal) == 2:
+            audio_signal = torch.mean(audio_signal, dim=0).unsqueeze(0)
+        return audio_signal
+
+    def load_non_silent_random_music(self, music_idx):
+        """ Randomly selects a non_silent part of the music track music_idx
 
         Parameters:
-        - audio_path (str) : path to the audio file
+        - music_idx (int) : position of the track in music.csv
 
         Returns:
         - audio_signal (torchaudio) : waveform of the
         """
         # info = torchaudio.info(audio_path)
         # music sample_rate
-        length = int(row['length'])
-        audio_signal = torch.zeros(self.segment * self.original_sample_rate)
-        # iterate until the segment is not silence
-        audio_signal = self.load_mono_random_segment(audio_signal, length, row['music_path'], self.segment * self.original_sample_rate)
+        if self.energy_index is not None:
+            if not self.energy_index.non_silent_tracks[music_idx]:
+                # the whole track is silent, use another one
+                music_idx = random.choice(
+                    np.nonzero(self.energy_index.non_silent_tracks)[0]
+                )
+            audio_signal = self.load_indexed_segment(
+                music_idx,
+                int(self.index.track_lengths[music_idx]),
+                str(self.index.track_paths[music_idx]),
+                self.segment * self.original_sample_rate
+            )
+        else:
+            length = int(self.index.track_lengths[music_idx])
+            audio_path = str(self.index.track_paths[music_idx])
+            audio_signal = torch.zeros(self.segment * self.original_sample_rate)
+            # iterate until the segment is not silence
+            audio_signal = self.load_mono_random_segment(audio_signal, length, audio_path, self.segment * self.original_sample_rate)
 
         # zero pad if the size is smaller than seq_duration
-        seq_duration_samples = int(self.segment * self.original_sample_rate)
-        total_samples = audio_signal.shape[-1]
-        if seq_duration_samples > total_samples:
-            # add zeros at beginning and at with random offset
-            padding_offset = random.randint(0, seq_duration_samples - total_samples)
-            audio_signal = torch.nn.ConstantPad1d(
-                (
-                    padding_offset,
-                    seq_duration_samples - total_samples - padding_offset
-                ),
-                0
-            )(audio_signal)
-
-        return audio_signal
-
-    def rms(self, audio):
-        """ computes the RMS of an audio signal
-        """
-        return torch.sqrt(torch.mean(audio ** 2))
+        return pad_segment(audio_signal, int(self.segment * self.original_sample_rate))
 
     def load_speechs(self, speech_idx):
         """
@@ -158,55 +367,229 @@ class PodcastMixDataloader(Dataset):
         buffers that starts with the beginning of a speech.
         Returns the shifted buffer with a length equal to segment.
         """
-        speaker_csv_id = self.df_speech.iloc[speech_idx].speaker_id
+        speaker = self.index.row_speaker[speech_idx]
         array_size = self.original_sample_rate * self.segment
         speech_mix = torch.zeros(0)
         speech_counter = 0
         while speech_counter < array_size:
             # file is shorter than segment, concatenate with more until
             # is at least the same length
-            row_speech = self.speakers_dict[speaker_csv_id].sample()
-            audio_path = row_speech['speech_path'].values[0]
-            speech_signal, _ = torchaudio.load(
-                audio_path
-            )
+            utterance = self.index.random_utterance(speaker)
+            audio_path = str(self.index.utterance_paths[utterance])
+            speech_signal = self.load_speech(audio_path)
             # add the speech to the buffer
-            speech_mix = torch.cat((speech_mix, speech_signal[0]))
+            with self.timer.stage('speech_concat'):
+                speech_mix = torch.cat((speech_mix, speech_signal))
             speech_counter += speech_signal.shape[-1]
 
         # we have a segment of at least self.segment length speech audio
         # from the same speaker
         if self.multi_speakers and speech_idx % 10 == 0:
             # every 10 iterations overlap another speaker
-            list_of_speakers = list(self.speakers_dict.keys())
-            list_of_speakers.remove(speaker_csv_id)
-            non_speaker_id = random.sample(list_of_speakers, 1)[0]
-            row_speech = self.speakers_dict[non_speaker_id].sample()
-            audio_path = row_speech['speech_path'].values[0]
-            other_speech_signal, _ = torchaudio.load(
-                audio_path
+            non_speaker = self.index.random_other_speaker(speaker)
+            utterance = self.index.random_utterance(non_speaker)
+            audio_path = str(self.index.utterance_paths[utterance])
+            other_speech_signal = self.load_speech(audio_path)
+            with self.timer.stage('speech_concat'):
+                return build_speech_segment(speech_mix, array_size, other_speech_signal)
+
+        with self.timer.stage('speech_concat'):
+            return build_speech_segment(speech_mix, array_size)
+
+    def plan_speechs(self, speech_idx):
+        """ Draws the utterances that load_speechs concatenates for speech_idx,
+        without reading them: the lengths are taken from the index.
+
+        Returns (tuple):
+        - utterances (list) : positions in the index of the utterances of
+        the speaker, in the order they are concatenated
+        - other_utterance (int) : position of the utterance of another
+        speaker to overlap, or None
+        """
+        speaker = self.index.row_speaker[speech_idx]
+        array_size = self.original_sample_rate * self.segment
+        utterances = []
+        speech_counter = 0
+        while speech_counter < array_size:
+            utterance = self.index.random_utterance(speaker)
+            utterances.append(utterance)
+            speech_counter += int(self.index.utterance_lengths[utterance])
+        other_utterance = None
+        if self.multi_speakers and speech_idx % 10 == 0:
+            non_speaker = self.index.random_other_speaker(speaker)
+            other_utterance = self.index.random_utterance(non_speaker)
+        return utterances, other_utterance
+
+    def plan_music(self, music_idx):
+        """ Draws the first segment that load_non_silent_random_music reads for
+        music_idx, without reading it.
+
+        Returns (tuple):
+        - audio_path (str) : path of the track
+        - length (int) : number of frames of the track
+        - offset (int) : first frame of the segment
+        - duration (int) : number of frames of the segment
+        - indexed (bool) : whether the segment comes from the energy index,
+        so that it does not need to be checked for silence
+        """
+        max_segment = self.segment * self.original_sample_rate
+        if self.energy_index is not None and not self.energy_index.non_silent_tracks[music_idx]:
+            # the whole track is silent, use another one
+            music_idx = random.choice(
+                np.nonzero(self.energy_index.non_silent_tracks)[0]
             )
+        length = int(self.index.track_lengths[music_idx])
+        audio_path = str(self.index.track_paths[music_idx])
+        if self.energy_index is not None:
+            if max_segment >= length:
+                return audio_path, length, 0, length, True
+            offset, fraction = self.energy_index.sample_offset(music_idx, max_segment)
+            if offset is not None:
+                self.timer.count('silence_retries_saved', (1 - fraction) / fraction)
+                return audio_path, length, offset, max_segment, True
+        offset, duration = self.compute_rand_offset_duration(length, max_segment)
+        return audio_path, length, offset, duration, False
+
+    def load_sources_concurrently(self, speech_idx, music_idx):
+        """ Same as load_speechs and load_non_silent_random_music, but all the
+        files are planned first and then read at the same time by the thread
+        pool. Only the retries of silent music segments, when the energy index
+        is not used, are read one after the other.
 
-            other_speech_signal_length = other_speech_signal.shape[-1]
-            if len(speech_mix) < other_speech_signal.shape[-1]:
-                # the second speaker is longer than the original one
-                other_speech_signal_length = len(speech_mix)
-            offset = random.randint(0, len(speech_mix) - other_speech_signal_length)
-            speech_mix[offset:offset + other_speech_signal_length] += other_speech_signal[0][:other_speech_signal_length]
-            speech_mix = speech_mix / 2
+        Returns (tuple):
+        - speech_signal (torch.Tensor) : speech segment
+        - music_signal (torch.Tensor) : (1, frames) music segment
+        """
+        utterances, other_utterance = self.plan_speechs(speech_idx)
+        speech_paths = [str(self.index.utterance_paths[u]) for u in utterances]
+        other_path = None
+        if other_utterance is not None:
+            other_path = str(self.index.utterance_paths[other_utterance])
+        audio_path, length, offset, duration, indexed = self.plan_music(music_idx)
+        max_segment = self.segment * self.original_sample_rate
+        pool = self.io_pool()
+        # the stage is opened by this thread, the reads of the pool count
+        # as decode time
+        with self.timer.stage('decode'):
+            music_future = pool.submit(self.load_audio, audio_path, offset, duration)
+
+            # the cache is only used from this thread
+            speech_signals = {}
+            wanted = speech_paths + ([other_path] if other_path is not None else [])
+            if self.speech_cache is not None:
+                for path in wanted:
+                    speech_signal = self.get_cached_speech(path)
+                    if speech_signal is not None:
+                        speech_signals[path] = speech_signal
+            missing = [path for path in dict.fromkeys(wanted) if path not in speech_signals]
+            for path, speech_signal in zip(missing, pool.map(self.load_audio, missing)):
+                speech_signals[path] = speech_signal[0]
+                if self.speech_cache is not None:
+                    self.cache_speech(path, speech_signal[0])
+
+            music_signal = music_future.result()
+        if not indexed and torch.count_nonzero(music_signal) == 0:
+            # the planned segment is silent, search as usual
+            self.timer.count('silence_retries', 1)
+            with self.timer.stage('silence_retries'):
+                music_signal = self.load_mono_random_segment(
+                    torch.zeros(max_segment), length, audio_path, max_segment
+                )
+        elif len(music_signal) == 2:
+            # convert to mono
+            music_signal = torch.mean(music_signal, dim=0).unsqueeze(0)
+        music_signal = pad_segment(music_signal, int(max_segment))
 
-        # we have a segment with the two speakers, the second in a random start.
-        # now we randomly shift the array to pick the start
-        offset = random.randint(0, array_size)
-        zeros_aux = torch.zeros(len(speech_mix))
-        aux = speech_mix[:offset]
-        
-        zeros_aux[:len(speech_mix) - offset] = speech_mix[offset:len(speech_mix)]
-        zeros_aux[len(speech_mix) - offset:] = aux
-            
-        return zeros_aux[:array_size]
+        array_size = self.original_sample_rate * self.segment
+        with self.timer.stage('speech_concat'):
+            speech_mix = torch.cat([speech_signals[path] for path in speech_paths])
+            if other_path is not None:
+                speech_signal = build_speech_segment(
+                    speech_mix, array_size, speech_signals[other_path]
+                )
+            else:
+                speech_signal = build_speech_segment(speech_mix, array_size)
+        return speech_signal, music_signal
+
+    def draw_recipe(self, idx):
+        """ Draws all the random choices of item idx: the utterances and the
+        offsets of the speech segment, a non-silent music segment and the
+        music gain. The music segment is searched here, reading the track if
+        needed, so that replaying the recipe needs no retries.
+
+        Returns:
+        - item (dict) : recipe of the item, see load_recipe_sources
+        """
+        music_idx = self.music_inxs[idx]
+        speech_idx = self.speech_inxs[idx]
+        array_size = self.original_sample_rate * self.segment
+
+        utterances, other_utterance = self.plan_speechs(speech_idx)
+        speech_length = int(sum(self.index.utterance_lengths[u] for u in utterances))
+        item = {
+            'speech': [str(self.index.utterance_paths[u]) for u in utterances],
+            'other_speech': None,
+            'other_offset': None
+        }
+        if other_utterance is not None:
+            other_length = min(int(self.index.utterance_lengths[other_utterance]), speech_length)
+            item['other_speech'] = str(self.index.utterance_paths[other_utterance])
+            item['other_offset'] = random.randint(0, speech_length - other_length)
+        item['speech_shift'] = random.randint(0, array_size)
+
+        audio_path, length, offset, duration, indexed = self.plan_music(music_idx)
+        if not indexed:
+            # iterate until the segment is not silence
+            while torch.count_nonzero(self.load_audio(audio_path, offset, duration)) == 0:
+                offset, duration = self.compute_rand_offset_duration(length, array_size)
+        item['music'] = audio_path
+        item['music_offset'] = offset
+        item['music_frames'] = duration
+        item['music_padding'] = 0
+        if duration < array_size:
+            item['music_padding'] = random.randint(0, array_size - duration)
+
+        if self.shuffle_tracks:
+            item['gain'] = random.uniform(1/self.denominator_gain, 1)
+        else:
+            item['gain'] = float(self.gain_ramp[idx % len(self.gain_ramp)])
+        return item
+
+    def load_recipe_sources(self, item):
+        """ Builds the sources of a recipe item with direct reads at the
+        recorded offsets.
+
+        Returns (tuple):
+        - speech_signal (torch.Tensor) : speech segment
+        - music_signal (torch.Tensor) : (1, frames) music segment
+        """
+        array_size = self.original_sample_rate * self.segment
+        speech_signals = [self.load_speech(path) for path in item['speech']]
+        other_speech_signal = None
+        if item['other_speech'] is not None:
+            other_speech_signal = self.load_speech(item['other_speech'])
+        with self.timer.stage('speech_concat'):
+            speech_signal = build_speech_segment(
+                torch.cat(speech_signals),
+                array_size,
+                other_speech_signal,
+                other_offset=item['other_offset'],
+                shift=item['speech_shift']
+            )
+        music_signal = self.load_audio(
+            item['music'],
+            frame_offset=item['music_offset'],
+            num_frames=item['music_frames']
+        )
+        # convert to mono
+        if len(music_signal) == 2:
+            music_signal = torch.mean(music_signal, dim=0).unsqueeze(0)
+        music_signal = pad_segment(music_signal, array_size, item['music_padding'])
+        return speech_signal, music_signal
 
     def __getitem__(self, idx):
+        if self.recipe is not None:
+            return self.getitem_from_recipe(idx)
         if(idx == 0 and self.shuffle_tracks):
             # shuffle on first epochs of training and validation. Not testing
             random.shuffle(self.music_inxs)
@@ -215,47 +598,46 @@ class PodcastMixDataloader(Dataset):
         music_idx = self.music_inxs[idx]
         speech_idx = self.speech_inxs[idx]
 
-        # Get the row in speech dataframe
-        row_music = self.df_music.iloc[music_idx]
-        sources_list = []
-
         # We want to cleanly separate Speech, so its the first source
-        # in the sources_list
-        speech_signal = self.load_speechs(speech_idx)
-        music_signal = self.load_non_silent_random_music(row_music)
+        if self.io_threads > 0:
+            speech_signal, music_signal = self.load_sources_concurrently(speech_idx, music_idx)
+        else:
+            speech_signal = self.load_speechs(speech_idx)
+            music_signal = self.load_non_silent_random_music(music_idx)
+        sources = torch.stack([speech_signal, music_signal[0]])
 
-        if not self.sample_rate == self.original_sample_rate:
-            speech_signal = self.resampler.forward(speech_signal)
-            music_signal = self.resampler.forward(music_signal)
+        if not (self.sample_rate == self.original_sample_rate or self.resample_in_batch):
+            with self.timer.stage('resampling'):
+                sources = self.resampler.forward(sources)
 
-        # gain based on RMS in order to have RMS(speech_signal) >= RMS(music_singal)
-        reduction_factor = self.rms(speech_signal) / self.rms(music_signal)
-        # now we know that rms(r * music_signal) == rms(speech_signal)
+        # the music is scaled to have rms(music) == gain * rms(speech)
         if self.shuffle_tracks:
             # random gain for training and validation
-            music_gain = random.uniform(1/self.denominator_gain, 1) * reduction_factor
+            gain = random.uniform(1/self.denominator_gain, 1)
         else:
             # fixed gain for testing
-            music_gain = self.gain_ramp[idx % len(self.gain_ramp)] * reduction_factor
-
-        # multiply the music by the gain factor and add to the sources_list
-        music_signal = music_gain * music_signal
-        
-        # append sources:
-        sources_list.append(speech_signal)
-        sources_list.append(music_signal)
+            gain = self.gain_ramp[idx % len(self.gain_ramp)]
+        gain = torch.tensor(gain, dtype=sources.dtype)
 
-        # compute the mixture as the avg of both sources
-        mixture = 0.5 * (sources_list[0] + sources_list[1])
-        mixture = torch.squeeze(mixture)
+        return self.mix_sources(sources, gain)
 
-        # Stack sources
-        sources = np.vstack(sources_list)
+    def getitem_from_recipe(self, idx):
+        speech_signal, music_signal = self.load_recipe_sources(self.recipe[idx])
+        sources = torch.stack([speech_signal, music_signal[0]])
+        if not (self.sample_rate == self.original_sample_rate or self.resample_in_batch):
+            with self.timer.stage('resampling'):
+                sources = self.resampler.forward(sources)
+        gain = torch.tensor(self.recipe[idx]['gain'], dtype=sources.dtype)
+        return self.mix_sources(sources, gain)
 
-        # Convert sources to tensor
-        sources = torch.from_numpy(sources)
+    def mix_sources(self, sources, gain):
+        if self.raw_sources:
+            return sources, gain
 
-        return mixture, sources
+        # compute the mixture as the avg of both sources
+        with self.timer.stage('mixing'):
+            mixture, sources = self.mixer(sources.unsqueeze(0), gain.unsqueeze(0))
+        return mixture[0], sources[0]
 
     def get_infos(self):
         """Get dataset infos (for publishing models).
@@ -0,0 +1,233 @@
+import torch
+from torch.utils.data import IterableDataset, get_worker_info
+import torch.distributed as dist
+import os
+import math
+import numpy as np
+import random
+import warnings
+from utils.resampler import Resampler
+from utils.audio_store import AudioStore
+from utils.podcastmix_index import PodcastMixIndex
+from utils.mixing import SourceMixer
+from PodcastMixDataloader import build_speech_segment, pad_segment
+
+
+def distributed_rank():
+    """ Returns the rank and the world size of the DDP process group, or
+    (0, 1) when training in a single process.
+    """
+    if dist.is_available() and dist.is_initialized():
+        return dist.get_rank(), dist.get_world_size()
+    return 0, 1
+
+
+class PodcastMixStreamingDataloader(IterableDataset):
+    """ Training sibling of PodcastMixDataloader that reads the audio store
+    (see dataset_creation/create_audio_store.py) sequentially.
+
+    The speech and music shards are split in chunks of about chunk_mb MB of
+    consecutive files. The chunks are distributed among the DataLoader
+    workers of all the DDP ranks, and each worker reads its chunks one at a
+    time with a single sequential read, cutting many random segments from
+    each of them in memory. The examples go through a shuffle buffer of
+    shuffle_buffer examples before being yielded.
+    Every rank yields len(self) examples, split among its workers, so that
+    all the ranks run the same number of steps per epoch.
+
+    With multi_speakers, the overlapping speaker is drawn among the speakers
+    of the speech chunk in memory. The items of a chunk with a single speaker
+    are not overlapped, and a warning is given.
+    """
+    dataset_name = "PodcastMix"
+
+    def __init__(self, csv_dir, sample_rate=44100, original_sample_rate=44100, segment=2,
+                 multi_speakers=False, audio_store_dir=None, chunk_mb=256,
+                 shuffle_buffer=1024, raw_sources=False, resample_in_batch=False):
+        self.csv_dir = csv_dir
+        self.segment = segment
+        # sample_rate of the original files
+        self.original_sample_rate = original_sample_rate
+        # destination sample_rate for resample
+        self.sample_rate = sample_rate
+        self.multi_speakers = multi_speakers
+        self.shuffle_buffer = shuffle_buffer
+        self.raw_sources = raw_sources
+        self.mixer = SourceMixer()
+        assert raw_sources or not resample_in_batch
+        self.resample_in_batch = resample_in_batch
+        self.denominator_gain = 20
+
+        if not self.sample_rate == self.original_sample_rate:
+            self.resampler = Resampler(
+                input_sr=self.original_sample_rate,
+                output_sr=self.sample_rate,
+                dtype=torch.float32,
+                filter='hann'
+            )
+
+        self.index = PodcastMixIndex.load(self.csv_dir)
+        if audio_store_dir is None:
+            audio_store_dir = os.path.join(self.csv_dir, 'audio_store')
+        self.audio_store = AudioStore(audio_store_dir)
+
+        # speaker of each stored utterance
+        speakers = np.repeat(
+            np.arange(self.index.num_speakers),
+            np.diff(self.index.speaker_ptr)
+        )
+        speaker_of = dict(zip(self.index.utterance_paths, speakers))
+        self.speaker_of = {
+            path: speaker_of[path] for path in self.audio_store.paths['speech']
+        }
+
+        chunk_bytes = int(chunk_mb * 2 ** 20)
+        self.speech_chunks = self.audio_store.chunks('speech', chunk_bytes)
+        self.music_chunks = self.audio_store.chunks('music', chunk_bytes)
+        self.epoch_items = min([len(self.index.row_speaker), len(self.index.track_paths)])
+
+    def __len__(self):
+        _, world_size = distributed_rank()
+        return self.epoch_items // world_size
+
+    def worker_chunks(self, chunks, global_id, num_global):
+        """ Chunks read by the worker global_id out of num_global. If there are
+        less chunks than workers, some chunks are shared.
+        """
+        return [
+            chunks[i % len(chunks)]
+            for i in range(global_id, max(len(chunks), num_global), num_global)
+        ]
+
+    def read_speech_chunk(self, chunk):
+        speech_signals = [signal[0] for signal in self.audio_store.read_chunk(chunk)]
+        by_speaker = {}
+        for i, path in enumerate(chunk):
+            by_speaker.setdefault(self.speaker_of[path], []).append(i)
+        if self.multi_speakers and len(by_speaker) == 1:
+            warnings.warn(
+                'A speech chunk holds a single speaker, its items are not overlapped '
+                'with another speaker. A larger chunk_mb gives more speakers per chunk.'
+            )
+        return speech_signals, by_speaker
+
+    def read_music_chunk(self, chunk):
+        music_signals = []
+        for signal in self.audio_store.read_chunk(chunk):
+            # convert to mono
+            if len(signal) == 2:
+                signal = torch.mean(signal, dim=0)
+            else:
+                signal = signal[0]
+            if torch.count_nonzero(signal) > 0:
+                music_signals.append(signal)
+        return music_signals
+
+    def speech_segment(self, speech_chunk, item_counter):
+        """ Same as PodcastMixDataloader.load_speechs, picking the utterances
+        among the ones of the chunk in memory.
+        """
+        speech_signals, by_speaker = speech_chunk
+        array_size = self.original_sample_rate * self.segment
+        speakers = list(by_speaker.keys())
+        speaker = random.choice(speakers)
+        speech_mix = torch.zeros(0)
+        while len(speech_mix) < array_size:
+            # concatenate utterances of the same speaker until the buffer
+            # is at least as long as the segment
+            utterance = random.choice(by_speaker[speaker])
+            speech_mix = torch.cat((speech_mix, speech_signals[utterance]))
+
+        if self.multi_speakers and item_counter % 10 == 0 and len(speakers) > 1:
+            # every 10 items overlap another speaker
+            non_speaker = random.choice([s for s in speakers if s != speaker])
+            utterance = random.choice(by_speaker[non_speaker])
+            return build_speech_segment(speech_mix, array_size, speech_signals[utterance])
+        return build_speech_segment(speech_mix, array_size)
+
+    def music_segment(self, music_signals, music_lengths):
+        """ Picks a random non-silent segment of a track of the chunk in
+        memory, with a probability proportional to the track length.
+        """
+        seq_duration_samples = self.segment * self.original_sample_rate
+        while True:
+            track = random.choices(range(len(music_signals)), weights=music_lengths)[0]
+            music_signal = music_signals[track]
+            if len(music_signal) <= seq_duration_samples:
+                return pad_segment(music_signal, seq_duration_samples)
+            for _ in range(10):
+                offset = random.randint(0, len(music_signal) - seq_duration_samples)
+                segment = music_signal[offset:offset + seq_duration_samples]
+                if torch.count_nonzero(segment) > 0:
+                    return segment
+
+    def make_item(self, speech_chunk, music_chunk, item_counter):
+        speech_signal = self.speech_segment(speech_chunk, item_counter)
+        music_signal = self.music_segment(*music_chunk)
+        sources = torch.stack([speech_signal, music_signal])
+
+        if not (self.sample_rate == self.original_sample_rate or self.resample_in_batch):
+            sources = self.resampler.forward(sources)
+
+        gain = torch.tensor(random.uniform(1/self.denominator_gain, 1), dtype=sources.dtype)
+        if self.raw_sources:
+            return sources, gain
+        mixture, sources = self.mixer(sources.unsqueeze(0), gain.unsqueeze(0))
+        return mixture[0], sources[0]
+
+    def __iter__(self):
+        rank, world_size = distributed_rank()
+        worker_info = get_worker_info()
+        worker_id, num_workers = (0, 1)
+        if worker_info is not None:
+            worker_id, num_workers = worker_info.id, worker_info.num_workers
+        global_id = rank * num_workers + worker_id
+        num_global = world_size * num_workers
+        # the len(self) items of the rank are split among its workers
+        rank_items = len(self)
+        num_items = rank_items // num_workers + int(worker_id < rank_items % num_workers)
+
+        music_chunks = self.worker_chunks(self.music_chunks, global_id, num_global)
+        speech_chunks = self.worker_chunks(self.speech_chunks, global_id, num_global)
+        random.shuffle(music_chunks)
+        random.shuffle(speech_chunks)
+        items_per_music_chunk = math.ceil(num_items / len(music_chunks))
+        items_per_speech_chunk = math.ceil(num_items / len(speech_chunks))
+
+        buffer = []
+        item_counter = 0
+        speech_chunk = None
+        while item_counter < num_items:
+            produced = item_counter
+            for chunk in music_chunks:
+                music_signals = self.read_music_chunk(chunk)
+                if not music_signals:
+                    continue
+                music_chunk = (music_signals, [len(signal) for signal in music_signals])
+                for _ in range(min(items_per_music_chunk, num_items - item_counter)):
+                    if item_counter % items_per_speech_chunk == 0 or speech_chunk is None:
+                        chunk_idx = (item_counter // items_per_speech_chunk) % len(speech_chunks)
+                        speech_chunk = self.read_speech_chunk(speech_chunks[chunk_idx])
+                    buffer.append(self.make_item(speech_chunk, music_chunk, item_counter))
+                    item_counter += 1
+                    if len(buffer) >= self.shuffle_buffer:
+                        # swap a random example with the last one and pop it
+                        i = random.randrange(len(buffer))
+                        buffer[i], buffer[-1] = buffer[-1], buffer[i]
+                        yield buffer.pop()
+                if item_counter == num_items:
+                    break
+            if item_counter == produced:
+                raise RuntimeError("All the music chunks of the worker are silent")
+
+        random.shuffle(buffer)
+        yield from buffer
+
+    def get_infos(self):
+        """Get dataset infos (for publishing models).
+        Returns:
+            dict, dataset infos with keys `dataset`, `task` and `licences`.
+        """
+        infos = dict()
+        infos["dataset"] = self.dataset_name
+        return infos
@@ -1,10 +1,77 @@
+import re
 import torch
-from unet_parts import down, up, input_layer, last_layer
+import torch.nn.functional as F
+from unet_parts import down, up, input_layer, last_layer, stft_layer
 from asteroid.models import BaseModel
 
+BRANCHES = ['speech', 'music']
+# output_padding of up_1 to up_5 and of the last layer, as (freq, frames)
+UP_OUTPUT_PADDINGS = [(0, 0), (0, 0), (0, 1), (0, 0), (0, 0)]
+LAST_OUTPUT_PADDING = (0, 0)
+
+
+def split_branch_name(name):
+    """ Returns the fused name and the branch index of the name of a
+    parameter of the separate branches (e.g. ('down_3.conv.0.weight', 1) for
+    'down_music_3.conv.0.weight'), or None if it is not a branch parameter.
+    """
+    match = re.match(r'^(input_layer|last_layer|down|up)_(speech|music)(_\d+)?\.(.+)$', name)
+    if match is None:
+        return None
+    layer, branch, number, param = match.groups()
+    return '{}{}.{}'.format(layer, number or '', param), BRANCHES.index(branch)
+
+
+def branch_name(fused_name, branch):
+    """ Inverse of split_branch_name """
+    match = re.match(r'^(input_layer|last_layer|down|up)(_\d+)?\.(.+)$', fused_name)
+    if match is None:
+        return None
+    layer, number, param = match.groups()
+    return '{}_{}{}.{}'.format(layer, BRANCHES[branch], number or '', param)
+
+
+def fuse_state_dict(state_dict, prefix=''):
+    """ Converts in place the parameters of the separate branches of a UNet
+    into the ones of the fused model: the parameters of both branches are
+    concatenated along the first dimension (the output channels of the
+    convolutions and the input channels of the transposed ones).
+    """
+    for key in list(state_dict.keys()):
+        if not key.startswith(prefix):
+            continue
+        split = split_branch_name(key[len(prefix):])
+        if split is None or split[1] != 0:
+            continue
+        fused = split[0]
+        speech = state_dict.pop(key)
+        music = state_dict.pop(prefix + branch_name(fused, 1))
+        if speech.dim() == 0:
+            # num_batches_tracked of the batch norms
+            state_dict[prefix + fused] = speech
+        else:
+            state_dict[prefix + fused] = torch.cat([speech, music], dim=0)
+
+
+def unfuse_state_dict(state_dict, prefix=''):
+    """ Inverse of fuse_state_dict """
+    for key in list(state_dict.keys()):
+        if not key.startswith(prefix):
+            continue
+        fused = key[len(prefix):]
+        if branch_name(fused, 0) is None:
+            continue
+        value = state_dict.pop(key)
+        for branch in range(len(BRANCHES)):
+            if value.dim() == 0:
+                state_dict[prefix + branch_name(fused, branch)] = value
+            else:
+                state_dict[prefix + branch_name(fused, branch)] = value.chunk(len(BRANCHES), dim=0)[branch]
+
+
 class UNet(BaseModel):
     #def __init__(self, n_channels, n_classes, bilinear=True):
-    def __init__(self, sample_rate, fft_size, hop_size, window_size, kernel_size, stride):
+    def __init__(self, sample_rate, fft_size, hop_size, window_size, kernel_size, stride, fused=False):
         super(UNet, self).__init__(sample_rate=sample_rate)
         # self.save_hyperparameters()
         self.sample_rate = sample_rate
@@ -13,6 +80,30 @@ class UNet(BaseModel):
         self.hop_size = hop_size
         self.kernel_size = kernel_size
         self.stride = stride
+        # run the speech and music branches together with grouped
+        # convolutions. The checkpoints of both modes can be loaded in
+        # the other one (see fuse_state_dict)
+        self.fused = fused
+        self._register_load_state_dict_pre_hook(self._convert_state_dict)
+
+        # spectral front-end and back-end
+        self.stft = stft_layer(self.fft_size, self.hop_size, self.window_size)
+
+        if self.fused:
+            self.input_layer = input_layer(1, groups=2)
+            self.down_1 = down(1, 16, self.kernel_size, self.stride, groups=2)
+            self.down_2 = down(16, 32, self.kernel_size, self.stride, groups=2)
+            self.down_3 = down(32, 64, self.kernel_size, self.stride, groups=2)
+            self.down_4 = down(64, 128, self.kernel_size, self.stride, groups=2)
+            self.down_5 = down(128, 256, self.kernel_size, self.stride, groups=2)
+            self.down_6 = down(256, 512, self.kernel_size, self.stride, groups=2)
+            self.up_1 = up(512, 256, self.kernel_size, self.stride, UP_OUTPUT_PADDINGS[0], 1, groups=2)
+            self.up_2 = up(256, 128, self.kernel_size, self.stride, UP_OUTPUT_PADDINGS[1], 2, groups=2)
+            self.up_3 = up(128, 64, self.kernel_size, self.stride, UP_OUTPUT_PADDINGS[2], 3, groups=2)
+            self.up_4 = up(64, 32, self.kernel_size, self.stride, UP_OUTPUT_PADDINGS[3], 4, groups=2)
+            self.up_5 = up(32, 16, self.kernel_size, self.stride, UP_OUTPUT_PADDINGS[4], 5, groups=2)
+            self.last_layer = last_layer(16, 1, self.kernel_size, self.stride, LAST_OUTPUT_PADDING, groups=2)
+            return
 
         # declare layers
 
@@ -37,22 +128,22 @@ class UNet(BaseModel):
         self.down_music_6 = down(256, 512, self.kernel_size, self.stride)
 
         # up blocks for speech
-        self.up_speech_1 = up(512, 256, self.kernel_size, self.stride, (0,0), 1)
-        self.up_speech_2 = up(256, 128, self.kernel_size, self.stride, (0,0), 2)
-        self.up_speech_3 = up(128, 64, self.kernel_size, self.stride, (0,1), 3)
-        self.up_speech_4 = up(64, 32, self.kernel_size, self.stride, (0,0), 4)
-        self.up_speech_5 = up(32, 16, self.kernel_size, self.stride, (0,0), 5)
+        self.up_speech_1 = up(512, 256, self.kernel_size, self.stride, UP_OUTPUT_PADDINGS[0], 1)
+        self.up_speech_2 = up(256, 128, self.kernel_size, self.stride, UP_OUTPUT_PADDINGS[1], 2)
+        self.up_speech_3 = up(128, 64, self.kernel_size, self.stride, UP_OUTPUT_PADDINGS[2], 3)
+        self.up_speech_4 = up(64, 32, self.kernel_size, self.stride, UP_OUTPUT_PADDINGS[3], 4)
+        self.up_speech_5 = up(32, 16, self.kernel_size, self.stride, UP_OUTPUT_PADDINGS[4], 5)
 
         # up blocks for music
-        self.up_music_1 = up(512, 256, self.kernel_size, self.stride, (0,0), 1)
-        self.up_music_2 = up(256, 128, self.kernel_size, self.stride, (0,0), 2)
-        self.up_music_3 = up(128, 64, self.kernel_size, self.stride, (0,1), 3)
-        self.up_music_4 = up(64, 32, self.kernel_size, self.stride, (0,0), 4)
-        self.up_music_5 = up(32, 16, self.kernel_size, self.stride, (0,0), 5)
+        self.up_music_1 = up(512, 256, self.kernel_size, self.stride, UP_OUTPUT_PADDINGS[0], 1)
+        self.up_music_2 = up(256, 128, self.kernel_size, self.stride, UP_OUTPUT_PADDINGS[1], 2)
+        self.up_music_3 = up(128, 64, self.kernel_size, self.stride, UP_OUTPUT_PADDINGS[2], 3)
+        self.up_music_4 = up(64, 32, self.kernel_size, self.stride, UP_OUTPUT_PADDINGS[3], 4)
+        self.up_music_5 = up(32, 16, self.kernel_size, self.stride, UP_OUTPUT_PADDINGS[4], 5)
 
         # last layer sigmoid
-        self.last_layer_speech = last_layer(16, 1, self.kernel_size, self.stride, (0, 0))
-        self.last_layer_music = last_layer(16, 1, self.kernel_size, self.stride, (0, 0))
+        self.last_layer_speech = last_layer(16, 1, self.kernel_size, self.stride, LAST_OUTPUT_PADDING)
+        self.last_layer_music = last_layer(16, 1, self.kernel_size, self.stride, LAST_OUTPUT_PADDING)
 
         # # cuda config
         # self.device_used='cpu'
@@ -65,30 +156,101 @@ class UNet(BaseModel):
 
 
     def forward(self, x_in):
-        # cuda config
-        self.device_used='cpu'
-        self.has_gpu = torch.cuda.is_available()
-        if self.has_gpu:
-            self.device_used = 'cuda'
-        self.window = torch.hamming_window(self.window_size, device=self.device_used)
-        # normalize audio
-        mean = torch.mean(x_in)
-        std = torch.std(x_in)
+        # the input goes to the device of the model, before computing the
+        # statistics that unnormalize the outputs
+        x_in = x_in.to(self.stft.window.device)
+        # normalize audio, each example of the batch with its own statistics
+        mean = torch.mean(x_in, dim=-1, keepdim=True)
+        std = torch.std(x_in, dim=-1, keepdim=True)
         x_in = (x_in - mean) / (1e-5 + std)
-        if self.has_gpu:
-            x_in = x_in.cuda()
-        
+
         # compute normalized spectrogram
-        X_in = torch.stft(x_in, self.fft_size, self.hop_size, window=self.window, normalized=True)
-        real, imag = X_in.unbind(-1)
-        complex_n = torch.cat((real.unsqueeze(1), imag.unsqueeze(1)), dim=1).permute(0,2,3,1).contiguous()
-        r_i = torch.view_as_complex(complex_n)
-        phase = torch.angle(r_i)
-        X_in = torch.sqrt(real**2 + imag**2)
+        X_complex = self.stft(x_in)
+        X_in = X_complex.abs()
+
+        # pad the spectrogram to a size that the down and up layers give
+        # back unchanged, so that any input length is accepted
+        freqs, frames = X_in.shape[-2:]
+        X = F.pad(X_in, (0, self.valid_size(frames, 1) - frames, 0, self.valid_size(freqs, 0) - freqs))
 
         # add channels dimension
-        X = X_in.unsqueeze(1)
+        X = X.unsqueeze(1)
+
+        if self.fused:
+            X_speech, X_music = self.fused_branches(X)
+        else:
+            X_speech, X_music = self.branches(X)
+        X_speech = X_speech[..., :freqs, :frames]
+        X_music = X_music[..., :freqs, :frames]
+
+        # create the mask, in float32 also under autocast, where the sigmoids
+        # of both branches may round to 0
+        X_speech = X_speech.float()
+        X_music = X_music.float()
+        X_mask_speech = X_speech / (X_speech + X_music).clamp(min=torch.finfo(torch.float32).tiny)
+        # the real masks scale the magnitude and keep the phase of the mix:
+        # apply them to the complex spectrogram and go back to time domain
+        length = x_in.shape[-1]
+        speech_out = self.stft.inverse(X_complex * X_mask_speech, length)
+        music_out = self.stft.inverse(X_complex * (1 - X_mask_speech), length)
+
+        # unnormalize
+        speech_out = speech_out * std + mean
+        music_out = music_out * std + mean
+
+        # add both sources to a tensor to return them
+        T_data = torch.stack([speech_out, music_out], dim=1)
 
+        return T_data
+
+    def valid_size(self, size, dim):
+        """ Returns the smallest size >= size of the dimension dim of the
+        spectrogram (0 for the frequencies, 1 for the frames) for which the
+        up layers give back the sizes of the down layers.
+        """
+        while not self.is_valid_size(size, dim):
+            size += 1
+        return size
+
+    def is_valid_size(self, size, dim):
+        # sizes of the input and of the outputs of the 6 down layers
+        sizes = [size]
+        for _ in range(6):
+            sizes.append((sizes[-1] + 2 * self.stride - self.kernel_size) // self.stride + 1)
+
+        def up_size(size, output_padding):
+            # ConvTranspose2d with padding 2
+            return (size - 1) * self.stride - 4 + self.kernel_size + output_padding[dim]
+
+        for level, output_padding in enumerate(UP_OUTPUT_PADDINGS):
+            if up_size(sizes[6 - level], output_padding) != sizes[5 - level]:
+                return False
+        return up_size(sizes[1], LAST_OUTPUT_PADDING) == sizes[0]
+
+    def fused_branches(self, X):
+        """ Same as branches, with both branches stacked in the channel
+        dimension and run by grouped convolutions.
+        """
+        X = self.input_layer(X.expand(-1, 2, -1, -1))
+        X1 = self.down_1(X)
+        X2 = self.down_2(X1)
+        X3 = self.down_3(X2)
+        X4 = self.down_4(X3)
+        X5 = self.down_5(X4)
+        X6 = self.down_6(X5)
+        X5 = self.up_1(X5, X6)
+        X4 = self.up_2(X4, X5)
+        X3 = self.up_3(X3, X4)
+        X2 = self.up_4(X2, X3)
+        X1 = self.up_5(X1, X2)
+        X = self.last_layer(X1)
+        return X[:, 0], X[:, 1]
+
+    def branches(self, X):
+        """ Runs the speech and the music branches on the (batch, 1, freq,
+        frames) magnitude spectrogram X and returns their (batch, freq,
+        frames) outputs.
+        """
         # input layer
         X_speech = self.input_layer_speech(X)
         X_music = self.input_layer_music(X)
@@ -146,31 +308,14 @@ class UNet(BaseModel):
         # remove channels dimension:
         X_speech = X_speech.squeeze(1)
         X_music = X_music.squeeze(1)
+        return X_speech, X_music
 
-        # create the mask
-        X_mask_speech = X_speech / (X_speech + X_music)
-        # use mask to separate speech from mix
-        speech = X_in * X_mask_speech
-        # and music
-        music = X_in * (1 - X_mask_speech)
-        # istft
-        polar_speech = speech * torch.cos(phase) + speech * torch.sin(phase) * 1j
-        polar_music = music * torch.cos(phase) + music * torch.sin(phase) * 1j
-        speech_out = torch.istft(polar_speech, self.fft_size, hop_length=self.hop_size, window=self.window, return_complex=False, onesided=True, center=True, normalized=True)
-        music_out = torch.istft(polar_music, self.fft_size, hop_length=self.hop_size, window=self.window, return_complex=False, onesided=True, center=True, normalized=True)
-
-        # remove additional dimention
-        speech_out = speech_out.squeeze(1)
-        music_out = music_out.squeeze(1)
-
-        # unnormalize
-        speech_out = speech_out * std + mean
-        music_out = music_out * std + mean
-
-        # add both sources to a tensor to return them
-        T_data = torch.stack([speech_out, music_out], dim=1)
-
-        return T_data
+    def _convert_state_dict(self, state_dict, prefix, *args):
+        # load the checkpoints of the other mode
+        if self.fused:
+            fuse_state_dict(state_dict, prefix)
+        else:
+            unfuse_state_dict(state_dict, prefix)
 
     def get_model_args(self):
         """Arguments needed to re-instantiate the model."""
@@ -179,6 +324,7 @@ class UNet(BaseModel):
             "hop_size": self.hop_size,
             "window_size": self.window_size,
             "kernel_size": self.kernel_size,
-            "stride": self.stride
+            "stride": self.stride,
+            "fused": self.fused
         }
         return model_args
@@ -3,11 +3,42 @@
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+
+class stft_layer(nn.Module):
+    '''
+        Normalized STFT of the mixture and inverse STFT of the masked
+        spectrograms, with a Hamming window kept as a buffer so that it
+        follows the device of the model and is built only once.
+    '''
+    def __init__(self, fft_size, hop_size, window_size):
+        super(stft_layer, self).__init__()
+        self.fft_size = fft_size
+        self.hop_size = hop_size
+        # not persistent: the checkpoints do not contain the window
+        self.register_buffer('window', torch.hamming_window(window_size), persistent=False)
+
+    def forward(self, x):
+        # (batch, time) -> complex (batch, freq, frames), always in float32
+        x = x.float()
+        if x.shape[-1] <= self.fft_size // 2:
+            # the reflection padding of the frames needs a longer input,
+            # the extra samples are removed by inverse(length=...)
+            x = nn.functional.pad(x, (0, self.fft_size // 2 + 1 - x.shape[-1]))
+        return torch.stft(x, self.fft_size, self.hop_size, window=self.window, normalized=True, return_complex=True)
+
+    def inverse(self, X, length=None):
+        # complex (batch, freq, frames) -> (batch, time)
+        return torch.istft(X, self.fft_size, hop_length=self.hop_size, window=self.window, onesided=True, center=True, normalized=True, length=length)
+
+# With groups > 1, each part runs `groups` independent branches at once with
+# grouped convolutions: the channels of branch g are the g-th slice of the
+# channel dimension.
+
 class input_layer(nn.Module):
     '''(conv => BN => LeackyReLU)'''
-    def __init__(self, out_ch):
+    def __init__(self, out_ch, groups=1):
         super(input_layer, self).__init__()
-        self.bn = nn.BatchNorm2d(out_ch)
+        self.bn = nn.BatchNorm2d(out_ch * groups)
 
     def forward(self, x):
         x = self.bn(x)
@@ -15,11 +46,11 @@ class input_layer(nn.Module):
 
 class down(nn.Module):
     '''(conv => BN => LeackyReLU)'''
-    def __init__(self, in_ch, out_ch, kernel_size, stride):
+    def __init__(self, in_ch, out_ch, kernel_size, stride, groups=1):
         super(down, self).__init__()
         self.conv = nn.Sequential(
-            nn.Conv2d(in_ch, out_ch, kernel_size, stride, padding=stride),
-            nn.BatchNorm2d(out_ch),
+            nn.Conv2d(in_ch * groups, out_ch * groups, kernel_size, stride, padding=stride, groups=groups),
+            nn.BatchNorm2d(out_ch * groups),
             nn.LeakyReLU(0.2),
         )
 
@@ -34,20 +65,21 @@ class up(nn.Module):
         as proposed in SINGING VOICE SEPARATION WITH DEEP
         U-NET CONVOLUTIONAL NETWORK
     '''
-    def __init__(self, in_ch, out_ch, kernel_size, stride, output_padding, index):
+    def __init__(self, in_ch, out_ch, kernel_size, stride, output_padding, index, groups=1):
         super(up, self).__init__()
-        self.up_conv = nn.ConvTranspose2d(in_ch, out_ch, kernel_size, stride, output_padding=output_padding, padding=(2,2))
+        self.groups = groups
+        self.up_conv = nn.ConvTranspose2d(in_ch * groups, out_ch * groups, kernel_size, stride, output_padding=output_padding, padding=(2,2), groups=groups)
         if index > 3:
             self.deconv = nn.Sequential(
-                nn.ConvTranspose2d(in_ch, out_ch, 1, 1),
-                nn.BatchNorm2d(out_ch),
+                nn.ConvTranspose2d(in_ch * groups, out_ch * groups, 1, 1, groups=groups),
+                nn.BatchNorm2d(out_ch * groups),
                 nn.ReLU()
             )
         else:
             # 50% dropout for the first 3 layers
             self.deconv = nn.Sequential(
-                nn.ConvTranspose2d(in_ch, out_ch, 1, 1),
-                nn.BatchNorm2d(out_ch),
+                nn.ConvTranspose2d(in_ch * groups, out_ch * groups, 1, 1, groups=groups),
+                nn.BatchNorm2d(out_ch * groups),
                 nn.ReLU(),
                 nn.Dropout(p=0.5)
             )
@@ -56,7 +88,15 @@ class up(nn.Module):
         # print("x2 de up_conv:", x2.shape)
         x2 = self.up_conv(x2)
         # print("x2 y x1 before cat:", x2.shape, x1.shape)
-        x = torch.cat([x2, x1], dim=1)
+        if self.groups > 1:
+            # concatenate branch by branch: [x2_0, x1_0, x2_1, x1_1, ...]
+            n, _, h, w = x2.shape
+            x = torch.stack([
+                x2.view(n, self.groups, -1, h, w),
+                x1.view(n, self.groups, -1, h, w)
+            ], dim=2).view(n, -1, h, w)
+        else:
+            x = torch.cat([x2, x1], dim=1)
         # print("dp de cat", x.shape)
         x = self.deconv(x)
 
@@ -64,11 +104,11 @@ class up(nn.Module):
         return x
 
 class last_layer(nn.Module):
-    def __init__(self, in_ch, out_ch, kernel_size, stride, output_padding):
+    def __init__(self, in_ch, out_ch, kernel_size, stride, output_padding, groups=1):
         super(last_layer, self).__init__()
         self.deconv = nn.Sequential(
-            nn.ConvTranspose2d(in_ch, out_ch, kernel_size, stride, output_padding=output_padding, padding=(2, 2)),
-            nn.BatchNorm2d(out_ch),
+            nn.ConvTranspose2d(in_ch * groups, out_ch * groups, kernel_size, stride, output_padding=output_padding, padding=(2, 2), groups=groups),
+            nn.BatchNorm2d(out_ch * groups),
             nn.Sigmoid()
         )
 
@@ -0,0 +1,230 @@
+import argparse
+import itertools
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import torch
+from torch.utils.data import Dataset, DataLoader, RandomSampler
+from torch.utils.data.dataloader import default_collate
+from utils.mixing import SourceMixer, MixCollate
+from utils.resampler import Resampler
+from utils.audio_store import build_audio_store
+from utils.music_energy import build_energy_index
+from PodcastMixDataloader import PodcastMixDataloader
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dataset_creation'))
+from create_synthetic_dataset import create_synthetic_dataset  # noqa
+
+
+"""
+Measure how fast PodcastMixDataloader produces batches for every combination
+of the given worker counts, segment lengths, multi_speakers and sample rates.
+For each one it reports the items per second (after the first batch, which
+includes the start of the workers), the time per item spent in each stage
+(summed over the workers) and the bytes read from the storage.
+Without --csv_dir, a small synthetic partition is created in a temporary
+directory, so it runs anywhere (with its audio store and energy index when
+they are used).
+"""
+
+STAGES = ['decode', 'silence_retries', 'speech_concat', 'resampling', 'mixing', 'collate']
+
+parser = argparse.ArgumentParser()
+parser.add_argument(
+    "--csv_dir",
+    type=str,
+    default=None,
+    help="Metadata directory of the partition, a synthetic one is used if not given"
+)
+parser.add_argument("--num_batches", type=int, default=50, help="Batches timed per run")
+parser.add_argument("--batch_size", type=int, default=4, help="Batch size")
+parser.add_argument("--workers", type=str, default="0,2,4", help="Comma separated num_workers")
+parser.add_argument("--segments", type=str, default="2", help="Comma separated segment lengths (s)")
+parser.add_argument("--multi_speakers", type=str, default="0,1", help="Comma separated 0/1")
+parser.add_argument(
+    "--sample_rates",
+    type=str,
+    default="44100,16000",
+    help="Comma separated destination sample rates"
+)
+parser.add_argument("--original_sample_rate", type=int, default=44100, help="Sample rate of the files")
+parser.add_argument(
+    "--mix_stage",
+    type=str,
+    default="item",
+    help="item or collate, where the mixtures are built (see train.py)"
+)
+parser.add_argument("--use_audio_store", type=int, default=0, help="Read from the audio store")
+parser.add_argument("--use_energy_index", type=int, default=0, help="Use the music energy index")
+parser.add_argument("--speech_cache_mb", type=float, default=0, help="Speech cache of each worker")
+parser.add_argument("--io_threads", type=int, default=0, help="I/O threads of each worker")
+parser.add_argument("--out_json", type=str, default=None, help="Save the results in this file")
+
+
+def int_list(value):
+    return [int(v) for v in value.split(',')]
+
+
+class ProfiledDataset(Dataset):
+    """ Returns the stage times and counters of the worker along with each
+    item of a PodcastMixDataloader(profile=True).
+    """
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, idx):
+        item = self.dataset[idx]
+        return item, self.dataset.timer.pop()
+
+
+class ProfiledCollate:
+    """ Collates the items of a ProfiledDataset, timing the collate_fn """
+
+    def __init__(self, collate_fn=None):
+        self.collate_fn = collate_fn if collate_fn is not None else default_collate
+
+    def __call__(self, batch):
+        stats = [item_stats for _, item_stats in batch]
+        start = time.perf_counter()
+        collated = self.collate_fn([item for item, _ in batch])
+        stats.append({'times': {'collate': time.perf_counter() - start}, 'counters': {}})
+        return collated, stats
+
+
+def run(csv_dir, num_workers, segment, multi_speakers, sample_rate, conf):
+    resample_in_batch = conf["mix_stage"] == 'collate' and sample_rate != conf["original_sample_rate"]
+    dataset = PodcastMixDataloader(
+        csv_dir=csv_dir,
+        sample_rate=sample_rate,
+        original_sample_rate=conf["original_sample_rate"],
+        segment=segment,
+        shuffle_tracks=True,
+        multi_speakers=multi_speakers,
+        use_audio_store=bool(conf["use_audio_store"]),
+        use_energy_index=bool(conf["use_energy_index"]),
+        speech_cache_bytes=int(conf["speech_cache_mb"] * 2 ** 20),
+        raw_sources=conf["mix_stage"] == 'collate',
+        resample_in_batch=resample_in_batch,
+        io_threads=conf["io_threads"],
+        profile=True
+    )
+    collate_fn = None
+    if conf["mix_stage"] == 'collate':
+        resampler = None
+        if resample_in_batch:
+            resampler = Resampler(
+                input_sr=conf["original_sample_rate"],
+                output_sr=sample_rate,
+                dtype=torch.float32,
+                filter='hann'
+            )
+        collate_fn = MixCollate(SourceMixer(resampler))
+    num_items = (conf["num_batches"] + 1) * conf["batch_size"]
+    loader = DataLoader(
+        ProfiledDataset(dataset),
+        batch_size=conf["batch_size"],
+        sampler=RandomSampler(dataset, replacement=True, num_samples=num_items),
+        num_workers=num_workers,
+        drop_last=True,
+        collate_fn=ProfiledCollate(collate_fn)
+    )
+
+    times = dict.fromkeys(STAGES, 0.0)
+    counters = {
+        'bytes_read': 0,
+        'silence_retries': 0,
+        'silence_retries_saved': 0,
+        'speech_cache_hits': 0,
+        'speech_cache_misses': 0,
+        'speech_cache_evictions': 0
+    }
+    start = time.perf_counter()
+    first_batch = None
+    for _, batch_stats in loader:
+        if first_batch is None:
+            # the first batch includes the start of the workers
+            first_batch = time.perf_counter()
+            continue
+        for stats in batch_stats:
+            for name, value in stats['times'].items():
+                times[name] = times.get(name, 0.0) + value
+            for name, value in stats['counters'].items():
+                counters[name] = counters.get(name, 0) + value
+    end = time.perf_counter()
+
+    timed_items = conf["num_batches"] * conf["batch_size"]
+    return {
+        'num_workers': num_workers,
+        'segment': segment,
+        'multi_speakers': multi_speakers,
+        'sample_rate': sample_rate,
+        'first_batch_s': first_batch - start,
+        'items_per_s': timed_items / (end - first_batch),
+        'ms_per_item': {name: 1000 * value / timed_items for name, value in times.items()},
+        'bytes_read_per_item': counters['bytes_read'] / timed_items,
+        'read_MB_per_s': counters['bytes_read'] / 2 ** 20 / (end - first_batch),
+        'silence_retries_per_item': counters['silence_retries'] / timed_items,
+        'silence_retries_saved_per_item': counters['silence_retries_saved'] / timed_items,
+        'speech_cache_hit_rate': counters['speech_cache_hits'] / max(
+            counters['speech_cache_hits'] + counters['speech_cache_misses'], 1
+        ),
+        'speech_cache_evictions_per_item': counters['speech_cache_evictions'] / timed_items
+    }
+
+
+def print_result(result):
+    print(
+        'workers {num_workers:2d} | segment {segment}s | multi_speakers {multi:d} | '
+        '{sample_rate} Hz | {items_per_s:8.1f} items/s | first batch {first_batch_s:.2f}s | '
+        '{read_MB_per_s:7.1f} MB/s read | {retries:.2f} retries/item ({saved:.2f} saved) | '
+        'speech cache {speech_cache_hit_rate:.0%} hits, {speech_cache_evictions_per_item:.2f} evictions/item'.format(
+            multi=result['multi_speakers'],
+            retries=result['silence_retries_per_item'],
+            saved=result['silence_retries_saved_per_item'],
+            **result
+        )
+    )
+    print('    ms/item: ' + ', '.join(
+        '{} {:.2f}'.format(name, value) for name, value in result['ms_per_item'].items()
+    ))
+
+
+def main(conf):
+    tmp_dir = None
+    csv_dir = conf["csv_dir"]
+    if csv_dir is None:
+        tmp_dir = tempfile.mkdtemp(prefix='podcastmix_benchmark_')
+        csv_dir = create_synthetic_dataset(tmp_dir, sample_rate=conf["original_sample_rate"])
+        if conf["use_audio_store"]:
+            store_dir = os.path.join(csv_dir, 'audio_store')
+            build_audio_store(os.path.join(csv_dir, 'speech.csv'), 'speech_path', store_dir, 'speech', mono='first')
+            build_audio_store(os.path.join(csv_dir, 'music.csv'), 'music_path', store_dir, 'music', mono='mean')
+        if conf["use_energy_index"]:
+            build_energy_index(csv_dir)
+    try:
+        results = []
+        for num_workers, segment, multi_speakers, sample_rate in itertools.product(
+                int_list(conf["workers"]),
+                int_list(conf["segments"]),
+                int_list(conf["multi_speakers"]),
+                int_list(conf["sample_rates"])):
+            result = run(csv_dir, num_workers, segment, bool(multi_speakers), sample_rate, conf)
+            print_result(result)
+            results.append(result)
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir)
+    if conf["out_json"] is not None:
+        with open(conf["out_json"], "w") as f:
+            json.dump(results, f, indent=0)
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    main(dict(vars(args)))
@@ -0,0 +1,186 @@
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+import torch
+import yaml
+from utils.my_import import my_import
+from utils.precision import autocast, PRECISIONS
+from PodcastMixDataloader import PodcastMixDataloader
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dataset_creation'))
+from create_synthetic_dataset import create_synthetic_dataset  # noqa
+
+
+"""
+Compare the separation of a model in float32 and under float16 and bfloat16
+autocast (see utils/precision.py). For each precision it reports the median
+time per batch, the speedup against float32, the SDR of the estimates against
+the true sources and against the float32 estimates, and the SDR difference
+against float32.
+With --exp_dir the trained best_model.pth is used, otherwise a model with
+random weights built from --config (only the timings and the difference
+against float32 are meaningful then). Without --csv_dir the mixtures come from
+a small synthetic partition (see dataset_creation/create_synthetic_dataset.py).
+"""
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--target_model", type=str, required=True, help="UNet or ConvTasNet")
+parser.add_argument("--exp_dir", type=str, default=None, help="Experiment with the trained best_model.pth")
+parser.add_argument(
+    "--config",
+    type=str,
+    default=None,
+    help="Config of the random model when --exp_dir is not given, by default the one of target_model"
+)
+parser.add_argument(
+    "--csv_dir",
+    type=str,
+    default=None,
+    help="Metadata directory of the partition, a synthetic one is used if not given"
+)
+parser.add_argument("--precisions", type=str, default="32,16,bf16", help="Comma separated precisions")
+parser.add_argument("--segment", type=int, default=2, help="Length of the mixtures in seconds")
+parser.add_argument("--batch_size", type=int, default=2, help="Mixtures separated together")
+parser.add_argument("--num_batches", type=int, default=4, help="Batches separated per precision")
+parser.add_argument("--repeats", type=int, default=3, help="Timed runs, the median is reported")
+parser.add_argument("--use_gpu", type=int, default=0, help="Run on the GPU")
+parser.add_argument("--out_json", type=str, default=None, help="Save the results in this file")
+
+
+def load_model(conf):
+    if conf["target_model"] == "UNet":
+        sys.path.append('UNet_model')
+        model_class = my_import("unet_model.UNet")
+    else:
+        sys.path.append('ConvTasNet_model')
+        model_class = my_import("conv_tasnet_norm.ConvTasNetNorm")
+    if conf["exp_dir"] is not None:
+        model_path = os.path.join(conf["exp_dir"], "best_model.pth")
+        with open(os.path.join(conf["exp_dir"], "conf.yml")) as f:
+            train_conf = yaml.safe_load(f)
+        return model_class.from_pretrained(model_path, sample_rate=train_conf["data"]["sample_rate"]), train_conf
+    config = conf["config"]
+    if config is None:
+        config = os.path.join('{}_model'.format(conf["target_model"]), '{}_config.yml'.format(conf["target_model"]))
+    with open(config) as f:
+        train_conf = yaml.safe_load(f)
+    if conf["target_model"] == "UNet":
+        model = model_class(
+            train_conf["data"]["sample_rate"],
+            train_conf["data"]["fft_size"],
+            train_conf["data"]["hop_size"],
+            train_conf["data"]["window_size"],
+            train_conf["convolution"]["kernel_size"],
+            train_conf["convolution"]["stride"]
+        )
+    else:
+        model = model_class(
+            **train_conf["filterbank"],
+            **train_conf["masknet"],
+            n_src=train_conf["data"]["n_src"],
+            sample_rate=train_conf["data"]["sample_rate"]
+        )
+    return model, train_conf
+
+
+def sdr(estimates, references):
+    """ Mean SDR in dB of the (batch, n_src, time) estimates """
+    error = torch.sum((references - estimates) ** 2, dim=-1).clamp(min=1e-20)
+    return torch.mean(10 * torch.log10(torch.sum(references ** 2, dim=-1) / error)).item()
+
+
+def separate(model, batches, precision, device):
+    with autocast(precision, device.type):
+        return [model(mixes).float() for mixes, _ in batches]
+
+
+def median_time(model, batches, precision, device, repeats):
+    times = []
+    for _ in range(repeats):
+        if device.type == 'cuda':
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+        separate(model, batches, precision, device)
+        if device.type == 'cuda':
+            torch.cuda.synchronize()
+        times.append(time.perf_counter() - start)
+    return sorted(times)[len(times) // 2] / len(batches)
+
+
+def main(conf):
+    random.seed(1)
+    np.random.seed(1)
+    torch.manual_seed(1)
+    device = torch.device('cuda' if conf["use_gpu"] else 'cpu')
+    model, train_conf = load_model(conf)
+    model = model.to(device).eval()
+
+    tmp_dir = None
+    csv_dir = conf["csv_dir"]
+    if csv_dir is None:
+        tmp_dir = tempfile.mkdtemp(prefix='podcastmix_benchmark_')
+        csv_dir = create_synthetic_dataset(tmp_dir, sample_rate=train_conf["data"]["original_sample_rate"])
+    try:
+        dataset = PodcastMixDataloader(
+            csv_dir=csv_dir,
+            sample_rate=train_conf["data"]["sample_rate"],
+            original_sample_rate=train_conf["data"]["original_sample_rate"],
+            segment=conf["segment"],
+            shuffle_tracks=False,
+            multi_speakers=False
+        )
+        items = [dataset[idx] for idx in range(conf["num_batches"] * conf["batch_size"])]
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir)
+    batches = [
+        (
+            torch.stack([mix for mix, _ in items[i:i + conf["batch_size"]]]).to(device),
+            torch.stack([sources for _, sources in items[i:i + conf["batch_size"]]]).to(device)
+        )
+        for i in range(0, len(items), conf["batch_size"])
+    ]
+    sources = torch.cat([batch_sources for _, batch_sources in batches])
+
+    torch.no_grad().__enter__()
+    reference = torch.cat(separate(model, batches, '32', device))
+    reference_time = median_time(model, batches, '32', device, conf["repeats"])
+    reference_sdr = sdr(reference, sources)
+    results = []
+    for precision in conf["precisions"].split(','):
+        assert precision in PRECISIONS, precision
+        try:
+            # warm up, and the estimates
+            estimates = torch.cat(separate(model, batches, precision, device))
+        except (ValueError, RuntimeError) as error:
+            print('{:>4s} | not supported: {}'.format(precision, error))
+            continue
+        batch_time = reference_time
+        if precision != '32':
+            batch_time = median_time(model, batches, precision, device, conf["repeats"])
+        result = {
+            'precision': precision,
+            'ms_per_batch': 1000 * batch_time,
+            'speedup': reference_time / batch_time,
+            'sdr': sdr(estimates, sources),
+            'sdr_difference': sdr(estimates, sources) - reference_sdr,
+            'sdr_vs_fp32': sdr(estimates, reference) if precision != '32' else float('inf')
+        }
+        print(
+            '{precision:>4s} | {ms_per_batch:9.2f} ms/batch | speedup {speedup:5.2f} | '
+            'SDR {sdr:7.2f} dB ({sdr_difference:+.3f} dB) | SDR vs fp32 {sdr_vs_fp32:6.1f} dB'.format(**result)
+        )
+        results.append(result)
+    if conf["out_json"] is not None:
+        with open(conf["out_json"], "w") as f:
+            json.dump(results, f, indent=0)
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    main(dict(vars(args)))
@@ -0,0 +1,105 @@
+import argparse
+import json
+import time
+import torch
+from utils.resampler import Resampler
+
+
+"""
+Compare the conv and fft backends of utils.resampler.Resampler for several
+sample rate pairs and signal durations. For each one it reports the time of
+both backends, the backend that 'auto' picks, and the error of the fft
+backend against the conv one (the original kernels), as the maximum
+absolute difference and as a signal to error ratio in dB.
+"""
+
+parser = argparse.ArgumentParser()
+parser.add_argument(
+    "--rates",
+    type=str,
+    default="44100:16000,44100:48000,48000:44100,48000:16000,16000:48000,48000:32000,44100:22050",
+    help="Comma separated input_sr:output_sr pairs"
+)
+parser.add_argument(
+    "--durations",
+    type=str,
+    default="0.1,1,10,60",
+    help="Comma separated signal durations in seconds"
+)
+parser.add_argument("--filter", type=str, default="hann", help="Filter of the resamplers")
+parser.add_argument("--batch_size", type=int, default=2, help="Number of signals resampled together")
+parser.add_argument("--repeats", type=int, default=5, help="Timed runs, the median is reported")
+parser.add_argument("--use_gpu", type=int, default=0, help="Run on the GPU")
+parser.add_argument("--out_json", type=str, default=None, help="Save the results in this file")
+
+
+def median_time(resampler, data, repeats):
+    # warm up, also computes the spectrum of the filter for the fft backend
+    resampler(data)
+    times = []
+    for _ in range(repeats):
+        if data.is_cuda:
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+        resampler(data)
+        if data.is_cuda:
+            torch.cuda.synchronize()
+        times.append(time.perf_counter() - start)
+    return sorted(times)[len(times) // 2]
+
+
+def main(conf):
+    device = 'cuda' if conf["use_gpu"] else 'cpu'
+    results = []
+    for rates in conf["rates"].split(','):
+        input_sr, output_sr = [int(rate) for rate in rates.split(':')]
+        resamplers = {
+            backend: Resampler(
+                input_sr, output_sr, torch.float32,
+                filter=conf["filter"], backend=backend
+            ).to(device)
+            for backend in ['conv', 'fft', 'auto']
+        }
+        for duration in conf["durations"].split(','):
+            seq_len = int(float(duration) * input_sr)
+            data = torch.randn(conf["batch_size"], seq_len, device=device)
+            conv_output = resamplers['conv'](data)
+            fft_output = resamplers['fft'](data)
+            error = (fft_output - conv_output).abs()
+            snr = 10 * torch.log10(
+                torch.sum(conv_output ** 2) / torch.sum(error ** 2).clamp(min=1e-30)
+            )
+            conv_time = median_time(resamplers['conv'], data, conf["repeats"])
+            fft_time = median_time(resamplers['fft'], data, conf["repeats"])
+            auto = resamplers['auto']
+            auto_backend = 'fft' if auto.fft_is_faster(seq_len // auto.input_sr) else 'conv'
+            result = {
+                'input_sr': input_sr,
+                'output_sr': output_sr,
+                'resample_type': auto.resample_type,
+                'kernel_width': auto.kernel_width,
+                'duration': float(duration),
+                'conv_ms': 1000 * conv_time,
+                'fft_ms': 1000 * fft_time,
+                'auto': auto_backend,
+                'auto_is_fastest': (auto_backend == 'fft') == (fft_time < conv_time),
+                'max_abs_error': error.max().item(),
+                'snr_db': snr.item()
+            }
+            print(
+                '{input_sr:6d} -> {output_sr:6d} ({resample_type}, {kernel_width} blocks) '
+                '{duration:6.1f}s | conv {conv_ms:9.2f} ms | fft {fft_ms:9.2f} ms | '
+                'auto {auto:4s} | max error {max_abs_error:.2e} | SNR {snr_db:.1f} dB'.format(**result)
+            )
+            results.append(result)
+    print('auto picked the fastest backend in {} of {} cases'.format(
+        sum(result['auto_is_fastest'] for result in results), len(results)
+    ))
+    if conf["out_json"] is not None:
+        with open(conf["out_json"], "w") as f:
+            json.dump(results, f, indent=0)
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    main(dict(vars(args)))
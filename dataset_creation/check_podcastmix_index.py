@@ -0,0 +1,112 @@
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import numpy as np
+import pandas as pd
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from utils.podcastmix_index import PodcastMixIndex  # noqa
+
+
+"""
+Check that, with the same seeds, PodcastMixIndex draws the same utterances
+and interrupting speakers as the pandas dataframes that PodcastMixDataloader
+used before the index (DataFrame.sample() for the utterances and
+random.sample on the list of speakers for the interrupting speaker), and
+leaves the random generators in the same state. Seeded evaluations then give
+the same mixtures as before.
+Without --csv_dir, a speech.csv with shuffled rows, integer speaker ids and
+a varying number of utterances per speaker is written in a temporary
+directory.
+Exits with 1 if the draws differ.
+"""
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--csv_dir", type=str, default=None, help="Metadata directory with speech.csv and music.csv")
+parser.add_argument("--draws", type=int, default=2000, help="Number of items drawn")
+parser.add_argument("--seed", type=int, default=0, help="Seed of the random generators")
+
+
+def write_shuffled_csvs(csv_dir, speakers=30, seed=0):
+    rng = np.random.RandomState(seed)
+    # the order of the ids as strings is not their order of appearance
+    speaker_ids = rng.permutation(np.arange(1, 3 * speakers))[:speakers] * 7
+    rows = []
+    for speaker_id in speaker_ids:
+        for utterance in range(rng.randint(1, 12)):
+            rows.append({
+                'speaker_id': speaker_id,
+                'speech_path': 'speech/{}_{}.flac'.format(speaker_id, utterance),
+                'length': rng.randint(1000, 50000)
+            })
+    df_speech = pd.DataFrame(rows).sample(frac=1, random_state=rng).reset_index(drop=True)
+    df_speech.to_csv(os.path.join(csv_dir, 'speech.csv'), index=False)
+    pd.DataFrame({
+        'music_path': ['music/{}.flac'.format(i) for i in range(10)],
+        'length': rng.randint(1000, 50000, size=10)
+    }).to_csv(os.path.join(csv_dir, 'music.csv'), index=False)
+
+
+def pandas_draws(csv_dir, draws):
+    """ Utterances drawn as PodcastMixDataloader did with the dataframes """
+    df_speech = pd.read_csv(os.path.join(csv_dir, 'speech.csv'), engine='python')
+    speakers_dict = {}
+    for speaker_id in df_speech.speaker_id.unique():
+        speakers_dict[speaker_id] = df_speech.loc[df_speech['speaker_id'] == speaker_id]
+    paths = []
+    for i in range(draws):
+        speaker_csv_id = df_speech.iloc[i % len(df_speech)].speaker_id
+        paths.append(speakers_dict[speaker_csv_id].sample()['speech_path'].values[0])
+        list_of_speakers = list(speakers_dict.keys())
+        list_of_speakers.remove(speaker_csv_id)
+        non_speaker_id = random.sample(list_of_speakers, 1)[0]
+        paths.append(speakers_dict[non_speaker_id].sample()['speech_path'].values[0])
+    return paths
+
+
+def index_draws(csv_dir, draws):
+    """ Same draws with PodcastMixIndex """
+    index = PodcastMixIndex.from_csv(csv_dir)
+    paths = []
+    for i in range(draws):
+        speaker = index.row_speaker[i % len(index.row_speaker)]
+        paths.append(str(index.utterance_paths[index.random_utterance(speaker)]))
+        non_speaker = index.random_other_speaker(speaker)
+        paths.append(str(index.utterance_paths[index.random_utterance(non_speaker)]))
+    return paths
+
+
+def seeded(draw, csv_dir, draws, seed):
+    """ Returns the draws and the state of the generators after them """
+    random.seed(seed)
+    np.random.seed(seed)
+    paths = draw(csv_dir, draws)
+    return paths, random.random(), np.random.random()
+
+
+def main(conf):
+    tmp_dir = None
+    csv_dir = conf["csv_dir"]
+    if csv_dir is None:
+        tmp_dir = tempfile.mkdtemp(prefix='podcastmix_index_check_')
+        csv_dir = tmp_dir
+        write_shuffled_csvs(csv_dir, seed=conf["seed"])
+    try:
+        expected = seeded(pandas_draws, csv_dir, conf["draws"], conf["seed"])
+        obtained = seeded(index_draws, csv_dir, conf["draws"], conf["seed"])
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir)
+    matching = sum(a == b for a, b in zip(expected[0], obtained[0]))
+    print('{} of {} utterances match, generators in the same state: {}'.format(
+        matching, len(expected[0]), expected[1:] == obtained[1:]
+    ))
+    if expected != obtained:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    main(dict(vars(args)))
@@ -0,0 +1,97 @@
+import argparse
+import os
+import random
+import sys
+import torch
+import torchaudio
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from utils.audio_store import AudioStore, build_audio_store  # noqa
+
+
+"""
+Decode the speech and music files of a PodcastMix partition once and write
+them into memory mapped shards, so that PodcastMixDataloader can slice
+segments out of them (use_audio_store=True) instead of decoding FLAC files
+on every item.
+Run it from the root of the repository, where the paths of the csv files
+are valid.
+"""
+
+parser = argparse.ArgumentParser()
+parser.add_argument(
+    "--csv_dir",
+    type=str,
+    required=True,
+    help="Metadata directory of the partition (with speech.csv and music.csv)"
+)
+parser.add_argument(
+    "--store_dir",
+    type=str,
+    default=None,
+    help="Destination of the store. Defaults to <csv_dir>/audio_store"
+)
+parser.add_argument(
+    "--dtype",
+    type=str,
+    default='float32',
+    choices=['float32', 'int16'],
+    help="float32 is zero-copy and bit-exact, int16 takes half the space"
+)
+parser.add_argument(
+    "--shard_size",
+    type=float,
+    default=2,
+    help="Maximum size of each shard in GB"
+)
+parser.add_argument(
+    "--check",
+    type=int,
+    default=20,
+    help="Number of random files compared against the FLAC decoding"
+)
+
+
+def check_store(store, csv_paths, n_files):
+    """ Compares random segments read from the store with the same segments
+    decoded from the original files.
+    """
+    for audio_path in random.sample(csv_paths, min(n_files, len(csv_paths))):
+        length = store.length(audio_path)
+        offset = random.randint(0, length - 1)
+        stored = store.load(audio_path, frame_offset=offset, num_frames=44100)
+        decoded, _ = torchaudio.load(audio_path, frame_offset=offset, num_frames=44100)
+        if store.entries[audio_path][0] == 'speech':
+            decoded = decoded[0].unsqueeze(0)
+        elif len(decoded) == 2 and len(stored) == 1:
+            decoded = torch.mean(decoded, dim=0).unsqueeze(0)
+        if not torch.equal(stored, decoded):
+            raise RuntimeError("Mismatch between the store and " + audio_path)
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    store_dir = args.store_dir or os.path.join(args.csv_dir, 'audio_store')
+    shard_size = int(args.shard_size * 2 ** 30)
+    speech_index = build_audio_store(
+        os.path.join(args.csv_dir, 'speech.csv'),
+        'speech_path',
+        store_dir,
+        'speech',
+        dtype=args.dtype,
+        mono='first',
+        shard_size=shard_size
+    )
+    music_index = build_audio_store(
+        os.path.join(args.csv_dir, 'music.csv'),
+        'music_path',
+        store_dir,
+        'music',
+        dtype=args.dtype,
+        mono='mean',
+        shard_size=shard_size
+    )
+    print(len(speech_index), 'speech files and', len(music_index), 'music files written to', store_dir)
+    if args.check > 0:
+        store = AudioStore(store_dir)
+        check_store(store, list(speech_index.path) + list(music_index.path), args.check)
+        print('Store matches the original files')
@@ -0,0 +1,44 @@
+import argparse
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from utils.audio_store import AudioStore  # noqa
+from utils.music_energy import build_energy_index  # noqa
+
+
+"""
+Compute the frame energy map of every music track of a PodcastMix partition
+and save it as music_energy.npz next to music.csv. With use_energy_index=True,
+PodcastMixDataloader draws the music offsets only from regions known to be
+non-silent, so each segment is read once.
+Run it from the root of the repository, where the paths of the csv files
+are valid.
+"""
+
+parser = argparse.ArgumentParser()
+parser.add_argument(
+    "--csv_dir",
+    type=str,
+    required=True,
+    help="Metadata directory of the partition (with music.csv)"
+)
+parser.add_argument(
+    "--resolution",
+    type=int,
+    default=11025,
+    help="Number of samples of each energy frame"
+)
+parser.add_argument(
+    "--audio_store_dir",
+    type=str,
+    default=None,
+    help="Read the tracks from this audio store instead of decoding them"
+)
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    audio_store = None
+    if args.audio_store_dir is not None:
+        audio_store = AudioStore(args.audio_store_dir, names=('music',))
+    path = build_energy_index(args.csv_dir, args.resolution, audio_store)
+    print('Energy index written to', path)
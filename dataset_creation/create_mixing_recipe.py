@@ -0,0 +1,96 @@
+import argparse
+import json
+import os
+import random
+import sys
+import numpy as np
+from tqdm import tqdm
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from PodcastMixDataloader import PodcastMixDataloader  # noqa
+
+
+"""
+Draw once the mixtures of a PodcastMix partition (usually test) and save them
+as a recipe: for each index, the speech files, the offset of the second
+speaker, the shift of the speech, the music offset and padding and the gain.
+PodcastMixDataloader(recipe_path=...) replays them with direct reads, so the
+evaluation gives the same mixtures in any process and can be split in shards
+(see test.py --recipe).
+Run it from the root of the repository, where the paths of the csv files
+are valid.
+"""
+
+parser = argparse.ArgumentParser()
+parser.add_argument(
+    "--csv_dir",
+    type=str,
+    required=True,
+    help="Metadata directory of the partition (with speech.csv and music.csv)"
+)
+parser.add_argument(
+    "--out_path",
+    type=str,
+    default=None,
+    help="Recipe file, by default recipe.json in csv_dir"
+)
+parser.add_argument(
+    "--segment",
+    type=int,
+    default=2,
+    help="Length of the mixtures in seconds"
+)
+parser.add_argument(
+    "--original_sample_rate",
+    type=int,
+    default=44100,
+    help="Sample rate of the audio files"
+)
+parser.add_argument(
+    "--multi_speakers",
+    type=int,
+    default=1,
+    help="Overlap a second speaker every 10 mixtures"
+)
+parser.add_argument(
+    "--seed",
+    type=int,
+    default=1,
+    help="Seed of the random choices"
+)
+parser.add_argument(
+    "--use_energy_index",
+    type=int,
+    default=0,
+    help="Draw the music offsets from music_energy.npz"
+)
+parser.add_argument(
+    "--use_audio_store",
+    type=int,
+    default=0,
+    help="Read the silent segment checks from the audio store"
+)
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    random.seed(args.seed)
+    np.random.seed(args.seed)
+    dataset = PodcastMixDataloader(
+        csv_dir=args.csv_dir,
+        original_sample_rate=args.original_sample_rate,
+        segment=args.segment,
+        shuffle_tracks=False,
+        multi_speakers=bool(args.multi_speakers),
+        use_audio_store=bool(args.use_audio_store),
+        use_energy_index=bool(args.use_energy_index)
+    )
+    recipe = {
+        'segment': args.segment,
+        'original_sample_rate': args.original_sample_rate,
+        'items': [dataset.draw_recipe(idx) for idx in tqdm(range(len(dataset)))]
+    }
+    out_path = args.out_path
+    if out_path is None:
+        out_path = os.path.join(args.csv_dir, 'recipe.json')
+    with open(out_path, 'w') as f:
+        json.dump(recipe, f, indent=0)
+    print('Recipe of', len(recipe['items']), 'mixtures written to', out_path)
@@ -0,0 +1,114 @@
+import argparse
+import csv
+import os
+import numpy as np
+import soundfile as sf
+
+
+"""
+Create a small fake PodcastMix partition: white noise flac files for the
+speech and the music and the speech.csv and music.csv files describing them,
+with the same columns as the real ones. One every three tracks starts with a
+silent half, as the real music tracks may do. It is used by
+benchmark_dataloader.py to run without the real dataset.
+"""
+
+parser = argparse.ArgumentParser()
+parser.add_argument(
+    "--out_dir",
+    type=str,
+    required=True,
+    help="Directory where the audio files and the metadata are created"
+)
+parser.add_argument("--speakers", type=int, default=8, help="Number of speakers")
+parser.add_argument("--utterances", type=int, default=10, help="Utterances per speaker")
+parser.add_argument("--tracks", type=int, default=40, help="Number of music tracks")
+parser.add_argument("--sample_rate", type=int, default=44100, help="Sample rate of the files")
+parser.add_argument("--seed", type=int, default=0, help="Seed of the random signals")
+
+speech_headers = [
+    "speech_ID",
+    "speaker_id",
+    "speaker_age",
+    "speaker_gender",
+    "speaker_accent",
+    "speech_path",
+    "length"
+]
+
+music_headers = [
+    "music_ID",
+    "jamendo_id",
+    "name",
+    "artist_name",
+    "artist_id",
+    "album_name",
+    "license_ccurl",
+    "releasedate",
+    "image",
+    "vocalinstrumental",
+    "lang",
+    "gender",
+    "acousticelectric",
+    "speed",
+    "tags",
+    "music_path",
+    "length"
+]
+
+
+def create_synthetic_dataset(out_dir, speakers=8, utterances=10, tracks=40,
+                             sample_rate=44100, seed=0):
+    """ Writes the fake partition in out_dir.
+
+    Returns:
+    - csv_dir (str) : directory with speech.csv and music.csv
+    """
+    rng = np.random.RandomState(seed)
+    csv_dir = os.path.join(out_dir, 'metadata')
+    for directory in ['metadata', 'speech', 'music']:
+        os.makedirs(os.path.join(out_dir, directory), exist_ok=True)
+
+    with open(os.path.join(csv_dir, 'speech.csv'), 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(speech_headers)
+        for speaker in range(speakers):
+            for utterance in range(utterances):
+                # utterances from 1 to 4 seconds
+                length = rng.randint(sample_rate, 4 * sample_rate)
+                audio = np.clip(0.1 * rng.randn(length), -1, 1)
+                speech_id = 'p{}_{:03d}'.format(speaker, utterance)
+                path = os.path.join(out_dir, 'speech', speech_id + '.flac')
+                sf.write(path, audio, sample_rate, subtype='PCM_16')
+                writer.writerow([speech_id, 'p{}'.format(speaker), 20, 'F', 'English', path, length])
+
+    with open(os.path.join(csv_dir, 'music.csv'), 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(music_headers)
+        for track in range(tracks):
+            # stereo tracks from 5 to 30 seconds
+            length = rng.randint(5 * sample_rate, 30 * sample_rate)
+            audio = np.clip(0.2 * rng.randn(length, 2), -1, 1)
+            if track % 3 == 0:
+                audio[:length // 2] = 0
+            path = os.path.join(out_dir, 'music', '{}.flac'.format(track))
+            sf.write(path, audio, sample_rate, subtype='PCM_16')
+            writer.writerow([
+                track, track, 'track {}'.format(track), 'artist', 0, 'album',
+                'http://creativecommons.org/licenses/by/3.0/', '2012-01-01',
+                '', 'instrumental', '', '', '', '', '["synthetic"]', path, length
+            ])
+    return csv_dir
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    csv_dir = create_synthetic_dataset(
+        args.out_dir,
+        speakers=args.speakers,
+        utterances=args.utterances,
+        tracks=args.tracks,
+        sample_rate=args.sample_rate,
+        seed=args.seed
+    )
+    print('Synthetic partition written to', csv_dir)
@@ -10,6 +10,20 @@ import numpy as np
 from tqdm import tqdm
 import torchaudio
 from utils.my_import import my_import
+from utils.precision import autocast
+from utils.chunked_separation import ChunkedSeparator, read_blocks, copy_scaled
+from utils.pipeline import background
+
+
+def podcast_sort_key(path):
+    """ Sorts the podcasts with numeric names (1.wav, 2.wav, ..., 10.wav) by
+    their number, before the others sorted by name.
+    """
+    name = os.path.splitext(os.path.basename(path))[0]
+    if name.isdigit():
+        return (0, int(name), name)
+    return (1, 0, name)
+
 
 class PodcastLoader(Dataset):
     dataset_name = "PodcastMix"
@@ -17,7 +31,7 @@ class PodcastLoader(Dataset):
         self.segment = segment
         self.sample_rate = sample_rate
         self.paths = [os.path.join(csv_dir, f) for f in os.listdir(csv_dir) if (os.path.isfile(os.path.join(csv_dir, f)) and '.wav' in f)]
-        self.paths = sorted(self.paths, key=lambda i: int(os.path.splitext(os.path.basename(i))[0]))
+        self.paths = sorted(self.paths, key=podcast_sort_key)
         torchaudio.set_audio_backend(backend='soundfile')
 
     def __len__(self):
@@ -82,6 +96,54 @@ parser.add_argument(
     required=True,
     help="Sample rate",
 )
+parser.add_argument(
+    "--batch_size",
+    type=int,
+    default=1,
+    help="Number of podcasts, or of chunks with --chunked 1, separated together"
+)
+parser.add_argument(
+    "--precision",
+    type=str,
+    default="32",
+    help="32, 16 (float16) or bf16 (bfloat16) autocast of the model"
+)
+parser.add_argument(
+    "--chunked",
+    type=int,
+    default=0,
+    help="Separate the whole podcasts by overlapping chunks instead of their first segment"
+)
+parser.add_argument(
+    "--chunk_seconds",
+    type=float,
+    default=18,
+    help="Length of the chunks in seconds (with --chunked 1)"
+)
+parser.add_argument(
+    "--overlap_seconds",
+    type=float,
+    default=1,
+    help="Overlap of consecutive chunks in seconds, cross-faded (with --chunked 1)"
+)
+parser.add_argument(
+    "--pipelined",
+    type=int,
+    default=0,
+    help="With --chunked 1, read, separate and write the audio concurrently in three threads"
+)
+parser.add_argument(
+    "--queue_blocks",
+    type=int,
+    default=4,
+    help="Blocks of audio queued between the stages with --pipelined 1"
+)
+parser.add_argument(
+    "--fused_unet",
+    type=int,
+    default=None,
+    help="1 to run the UNet branches fused, 0 to run them separately (default: as trained)"
+)
 
 def main(conf):
     model_path = os.path.join(conf["exp_dir"], "best_model.pth")
@@ -91,8 +153,15 @@ def main(conf):
     else:
         sys.path.append('ConvTasNet_model')
         AsteroidModelModule = my_import("conv_tasnet_norm.ConvTasNetNorm")
-    model = AsteroidModelModule.from_pretrained(model_path, sample_rate=conf["sample_rate"])
+    model_kwargs = {}
+    if conf["target_model"] == "UNet" and conf["fused_unet"] is not None:
+        # run the branches with grouped convolutions (any checkpoint)
+        model_kwargs["fused"] = bool(conf["fused_unet"])
+    model = AsteroidModelModule.from_pretrained(model_path, sample_rate=conf["sample_rate"], **model_kwargs)
 
+    # dropout off and batch norms with their running statistics, so that
+    # the estimates do not depend on the other mixtures of the batch
+    model.eval()
     if conf["use_gpu"]:
         model.cuda()
     model_device = next(model.parameters()).device
@@ -104,33 +173,112 @@ def main(conf):
     eval_save_dir = os.path.join(conf["exp_dir"], conf["out_dir"])
     ex_save_dir = os.path.join(eval_save_dir, "examples_podcast/")
     torch.no_grad().__enter__()
-    for idx in tqdm(range(len(test_set))):
-        # Forward the network on the mixture.
-        mix = test_set[idx]
-        mix = tensors_to_device(mix, device=model_device)
-        if conf["target_model"] == "UNet":
-            est_sources = model(mix.unsqueeze(0)).squeeze(0)
-        else:
-            est_sources = model(mix)
-        mix_np = mix.cpu().data.numpy()
-        est_sources_np = est_sources.squeeze(0).cpu().data.numpy()
-
-        # Save some examples in a folder. Wav files and metrics as text.
-        local_save_dir = os.path.join(ex_save_dir, "ex_{}/".format(idx + 1))
-        os.makedirs(local_save_dir, exist_ok=True)
+    if conf["chunked"]:
+        separator = ChunkedSeparator(
+            model,
+            chunk_size=int(conf["chunk_seconds"] * conf["sample_rate"]),
+            overlap=int(conf["overlap_seconds"] * conf["sample_rate"]),
+            batch_size=conf["batch_size"],
+            precision=conf["precision"]
+        )
+        for idx, podcast_path in enumerate(tqdm(test_set.paths)):
+            local_save_dir = os.path.join(ex_save_dir, "ex_{}/".format(idx + 1))
+            save_chunked_estimates(podcast_path, local_save_dir, separator, conf)
+        return
+    for start in tqdm(range(0, len(test_set), conf["batch_size"])):
+        idxs = range(start, min(start + conf["batch_size"], len(test_set)))
+        # the podcasts shorter than the segment are separated apart from
+        # the others, with a batch per length. The models normalize each
+        # podcast of the batch on its own
+        mixes_by_length = {}
+        for idx in idxs:
+            mix = test_set[idx]
+            mixes_by_length.setdefault(mix.shape[-1], []).append((idx, mix))
+        for items in mixes_by_length.values():
+            # Forward the network on the mixtures.
+            mixes = tensors_to_device(torch.stack([mix for _, mix in items]), device=model_device)
+            with autocast(conf["precision"], model_device.type):
+                batch_est_sources = model(mixes)
+            for (idx, _), mix, est_sources in zip(items, mixes, batch_est_sources):
+                save_estimates(idx, mix, est_sources, ex_save_dir, conf)
+
+
+def save_estimates(idx, mix, est_sources, ex_save_dir, conf):
+    """ Saves the mixture and the estimated sources of the podcast idx """
+    mix_np = mix.cpu().data.numpy()
+    est_sources_np = est_sources.float().cpu().data.numpy()
+
+    # Save some examples in a folder. Wav files and metrics as text.
+    local_save_dir = os.path.join(ex_save_dir, "ex_{}/".format(idx + 1))
+    os.makedirs(local_save_dir, exist_ok=True)
+    sf.write(
+        local_save_dir + "mixture.wav",
+        mix_np,
+        conf["sample_rate"]
+    )
+    # Loop over the estimates sources
+    for src_idx, est_src in enumerate(est_sources_np):
+        est_src *= np.max(np.abs(mix_np)) / np.max(np.abs(est_src))
         sf.write(
-            local_save_dir + "mixture.wav",
-            mix_np,
-            conf["sample_rate"]
+            local_save_dir + "s{}_estimate.wav".format(src_idx),
+            est_src,
+            conf["sample_rate"],
         )
-        # Loop over the estimates sources
-        for src_idx, est_src in enumerate(est_sources_np):
-            est_src *= np.max(np.abs(mix_np)) / np.max(np.abs(est_src))
-            sf.write(
-                local_save_dir + "s{}_estimate.wav".format(src_idx),
-                est_src,
-                conf["sample_rate"],
-            )
+
+def save_chunked_estimates(podcast_path, local_save_dir, separator, conf):
+    """ Separates the whole podcast by chunks and saves the mixture and the
+    estimated sources in local_save_dir as they are produced. The estimates
+    are written in float first, and rescaled to the peak of the mixture at
+    the end, as in save_estimates. A podcast at another sample rate than
+    conf["sample_rate"] raises a ValueError, and if the separation fails no
+    output is left behind.
+
+    Returns:
+    - frames (int) : length of the podcast
+    """
+    outputs = []
+    mix_peak = 0
+    est_peaks = []
+    frames = 0
+    blocks = read_blocks(podcast_path, separator.chunk_size, conf["sample_rate"])
+    if conf["pipelined"]:
+        # decoding and separation run in their own threads, the estimates
+        # are written in this one
+        separated = background(separator.separate_blocks(background(blocks, conf["queue_blocks"])), conf["queue_blocks"])
+    else:
+        separated = separator.separate_blocks(blocks)
+    try:
+        for mix, est_sources in separated:
+            if not outputs:
+                # the outputs are created once the first block is decoded
+                os.makedirs(local_save_dir, exist_ok=True)
+                outputs.append(sf.SoundFile(os.path.join(local_save_dir, "mixture.wav"), 'w', conf["sample_rate"], 1, subtype='PCM_16'))
+                for src_idx in range(est_sources.shape[0]):
+                    outputs.append(sf.SoundFile(os.path.join(local_save_dir, "s{}_estimate.float.wav".format(src_idx)), 'w', conf["sample_rate"], 1, subtype='FLOAT'))
+                est_peaks = [0] * est_sources.shape[0]
+            mix_file, est_files = outputs[0], outputs[1:]
+            mix_file.write(mix.numpy())
+            frames += mix.shape[0]
+            mix_peak = max(mix_peak, mix.abs().max().item())
+            for src_idx, est_src in enumerate(est_sources):
+                est_files[src_idx].write(est_src.numpy())
+                est_peaks[src_idx] = max(est_peaks[src_idx], est_src.abs().max().item())
+    except BaseException:
+        for output in outputs:
+            output.close()
+            os.remove(output.name)
+        raise
+    for output in outputs:
+        output.close()
+    for src_idx, est_file in enumerate(outputs[1:]):
+        copy_scaled(
+            est_file.name,
+            os.path.join(local_save_dir, "s{}_estimate.wav".format(src_idx)),
+            mix_peak / max(est_peaks[src_idx], 1e-12)
+        )
+        os.remove(est_file.name)
+    return frames
+
 
 if __name__ == "__main__":
     args = parser.parse_args()
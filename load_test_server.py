@@ -0,0 +1,137 @@
+import argparse
+import io
+import json
+import threading
+import time
+import urllib.request
+import numpy as np
+import soundfile as sf
+
+
+"""
+Load test of separation_server.py: --concurrency clients post --requests
+files in total to the server and read the separated sources. It reports the
+p50 and p99 of the latency (until the last byte) and of the time to the first
+byte, the throughput in requests and in seconds of audio per second, and the
+mean number of chunks per forward pass of the server during the test.
+The files are --audio, or white noise of --seconds seconds.
+"""
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--url", type=str, default="http://127.0.0.1:8000", help="Address of the server")
+parser.add_argument("--audio", type=str, default=None, help="File to post, at the sample rate of the model")
+parser.add_argument("--seconds", type=float, default=20, help="Length of the noise posted without --audio")
+parser.add_argument("--sample_rate", type=int, default=44100, help="Sample rate of the noise")
+parser.add_argument("--concurrency", type=int, default=4, help="Clients posting at the same time")
+parser.add_argument("--requests", type=int, default=32, help="Requests posted in total")
+parser.add_argument("--out_json", type=str, default=None, help="Save the results in this file")
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if values else float('nan')
+
+
+def get_stats(url):
+    with urllib.request.urlopen(url + '/stats') as response:
+        return json.loads(response.read())
+
+
+def post(url, body):
+    """ Returns the time to the first byte, the latency and the separated
+    sources (frames, n_src) of the file body.
+    """
+    request = urllib.request.Request(
+        url + '/separate',
+        data=body,
+        headers={'Content-Type': 'application/octet-stream'}
+    )
+    start = time.perf_counter()
+    with urllib.request.urlopen(request) as response:
+        first = response.read(1)
+        first_byte = time.perf_counter() - start
+        data = first + response.read()
+        latency = time.perf_counter() - start
+        n_src = int(response.headers['X-Sources'])
+        if len(data) != int(response.headers['X-Frames']) * n_src * 4:
+            # the server closes the connection if the separation fails
+            raise IOError('Truncated answer, the separation failed')
+    return first_byte, latency, np.frombuffer(data, dtype='<f4').reshape(-1, n_src)
+
+
+def main(conf):
+    if conf["audio"] is not None:
+        with open(conf["audio"], 'rb') as f:
+            body = f.read()
+        info = sf.info(conf["audio"])
+        seconds = info.frames / info.samplerate
+    else:
+        buffer = io.BytesIO()
+        noise = 0.1 * np.random.RandomState(0).randn(int(conf["seconds"] * conf["sample_rate"]))
+        sf.write(buffer, noise.astype('float32'), conf["sample_rate"], format='WAV', subtype='FLOAT')
+        body = buffer.getvalue()
+        seconds = conf["seconds"]
+
+    lock = threading.Lock()
+    remaining = [conf["requests"]]
+    first_bytes = []
+    latencies = []
+    errors = []
+
+    def client():
+        while True:
+            with lock:
+                if remaining[0] == 0:
+                    return
+                remaining[0] -= 1
+            try:
+                first_byte, latency, _ = post(conf["url"], body)
+            except Exception as error:
+                with lock:
+                    errors.append(repr(error))
+                continue
+            with lock:
+                first_bytes.append(first_byte)
+                latencies.append(latency)
+
+    stats_before = get_stats(conf["url"])
+    start = time.perf_counter()
+    clients = [threading.Thread(target=client) for _ in range(conf["concurrency"])]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    duration = time.perf_counter() - start
+    stats_after = get_stats(conf["url"])
+
+    batches = stats_after['batches'] - stats_before['batches']
+    chunks = stats_after['chunks'] - stats_before['chunks']
+    results = {
+        'concurrency': conf["concurrency"],
+        'requests': len(latencies),
+        'errors': len(errors),
+        'audio_seconds': seconds,
+        'p50_latency_s': percentile(latencies, 50),
+        'p99_latency_s': percentile(latencies, 99),
+        'p50_first_byte_s': percentile(first_bytes, 50),
+        'p99_first_byte_s': percentile(first_bytes, 99),
+        'requests_per_s': len(latencies) / duration,
+        'audio_seconds_per_s': len(latencies) * seconds / duration,
+        'mean_batch_size': chunks / max(batches, 1)
+    }
+    print(
+        '{requests} requests ({errors} errors) of {audio_seconds:.1f}s, concurrency {concurrency} | '
+        'latency p50 {p50_latency_s:.3f}s p99 {p99_latency_s:.3f}s | '
+        'first byte p50 {p50_first_byte_s:.3f}s p99 {p99_first_byte_s:.3f}s | '
+        '{requests_per_s:.2f} requests/s | {audio_seconds_per_s:.1f} s of audio/s | '
+        '{mean_batch_size:.2f} chunks per forward pass'.format(**results)
+    )
+    for error in errors[:5]:
+        print('Error:', error)
+    if conf["out_json"] is not None:
+        with open(conf["out_json"], "w") as f:
+            json.dump(results, f, indent=0)
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    main(dict(vars(args)))
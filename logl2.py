@@ -9,8 +9,12 @@ class LogL2Time(_Loss):
                 f"Inputs must be of shape [batch, *], got {targets.size()} and {est_targets.size()} instead"
             )
         _, number_of_sources, length_of_sources = est_targets.shape
+        # in float32 also under autocast: the sums over the segment overflow
+        # in float16, and the log10 of 0 is -inf
+        est_targets = est_targets.float()
+        targets = targets.float()
         squared_abs_dif = torch.abs((est_targets - targets) ** 2)
-        sum_of_squared_abs_dif = torch.sum(squared_abs_dif, dim=2)
+        sum_of_squared_abs_dif = torch.sum(squared_abs_dif, dim=2).clamp(min=torch.finfo(torch.float32).tiny)
         sum_of_log = torch.sum(torch.log10(sum_of_squared_abs_dif), dim=1)
         loss = 10 / (number_of_sources * length_of_sources) * sum_of_log
         loss = loss.mean(dim=0)
@@ -0,0 +1,196 @@
+import argparse
+import fcntl
+import json
+import multiprocessing
+import os
+import time
+import traceback
+import torch
+import yaml
+from utils.job_ledger import JobLedger
+from utils.chunked_separation import ChunkedSeparator
+
+
+"""
+Separates every audio file of --in_dir (recursively) with a pool of --workers
+processes, each one with its own copy of the model and --threads_per_worker
+torch threads. The whole files are separated by chunks as with
+forward_podcast.py --chunked 1, and the estimates of <in_dir>/a/b.wav are
+saved in the directory <out_dir>/a/b.wav/. The files must be at the sample
+rate of the model, the other ones fail.
+
+The files and their state are kept in a sqlite ledger (<out_dir>/jobs.sqlite
+by default). A file is done once all its estimates are written, so the runner
+can be stopped at any time and started again with the same arguments: the
+done files are skipped, and the files being separated when it stopped are
+separated again. The files that failed are retried up to --retries times over
+the runs. A lock on the ledger keeps other runners from using it at the same
+time.
+
+The progress, in files/hour and hours of audio/hour of this run, is printed
+every --report_seconds and saved in <out_dir>/progress.json.
+"""
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--in_dir", type=str, required=True, help="Directory with the podcasts to separate")
+parser.add_argument("--out_dir", type=str, required=True, help="Directory where the estimates are saved")
+parser.add_argument("--target_model", type=str, required=True, help="UNet or ConvTasNet")
+parser.add_argument("--exp_dir", type=str, required=True, help="Experiment with best_model.pth and conf.yml")
+parser.add_argument("--workers", type=int, default=2, help="Worker processes, each with its own model")
+parser.add_argument("--threads_per_worker", type=int, default=1, help="torch threads of each worker")
+parser.add_argument("--use_gpu", type=int, default=0, help="Whether to use the GPUs, assigned to the workers in turn")
+parser.add_argument("--precision", type=str, default="32", help="32, 16 (float16) or bf16 (bfloat16) autocast of the model")
+parser.add_argument("--chunk_seconds", type=float, default=18, help="Length of the chunks in seconds")
+parser.add_argument("--overlap_seconds", type=float, default=1, help="Overlap of consecutive chunks in seconds")
+parser.add_argument("--batch_size", type=int, default=1, help="Chunks separated together")
+parser.add_argument("--pipelined", type=int, default=1, help="Read, separate and write each file concurrently")
+parser.add_argument("--queue_blocks", type=int, default=4, help="Blocks of audio queued between the stages with --pipelined 1")
+parser.add_argument("--ledger", type=str, default=None, help="sqlite file of the jobs (default: <out_dir>/jobs.sqlite)")
+parser.add_argument("--retries", type=int, default=3, help="Attempts per file before giving up on it")
+parser.add_argument("--report_seconds", type=float, default=30, help="Seconds between progress reports")
+parser.add_argument("--extensions", type=str, default=".wav,.flac", help="Comma separated extensions of the files to separate")
+parser.add_argument(
+    "--fused_unet",
+    type=int,
+    default=None,
+    help="1 to run the UNet branches fused, 0 to run them separately (default: as trained)"
+)
+
+
+def find_files(in_dir, extensions):
+    """ Returns the paths of the files of in_dir with one of the extensions,
+    relative to in_dir and sorted.
+    """
+    paths = []
+    for root, _, files in os.walk(in_dir):
+        for name in files:
+            if os.path.splitext(name)[1].lower() in extensions:
+                paths.append(os.path.relpath(os.path.join(root, name), in_dir))
+    return sorted(paths)
+
+
+def worker(worker_idx, conf):
+    """ Separates the files claimed in the ledger until there are none left """
+    # the modules of the models and forward_podcast.py are imported here, in
+    # the spawned process
+    from forward_podcast import save_chunked_estimates
+    from separation_server import load_model
+
+    torch.set_num_threads(conf["threads_per_worker"])
+    if conf["use_gpu"]:
+        torch.cuda.set_device(worker_idx % torch.cuda.device_count())
+    model = load_model(conf)
+    separator = ChunkedSeparator(
+        model,
+        chunk_size=int(conf["chunk_seconds"] * conf["sample_rate"]),
+        overlap=int(conf["overlap_seconds"] * conf["sample_rate"]),
+        batch_size=conf["batch_size"],
+        precision=conf["precision"]
+    )
+    ledger = JobLedger(conf["ledger"])
+    try:
+        with torch.no_grad():
+            while True:
+                path = ledger.claim(worker_idx)
+                if path is None:
+                    return
+                # named after the whole file name, so that a.wav and a.flac
+                # do not share their outputs
+                local_save_dir = os.path.join(conf["out_dir"], path)
+                try:
+                    frames = save_chunked_estimates(os.path.join(conf["in_dir"], path), local_save_dir, separator, conf)
+                except Exception:
+                    ledger.fail(path, traceback.format_exc())
+                    continue
+                ledger.finish(path, frames, conf["sample_rate"])
+    finally:
+        ledger.close()
+
+
+def report(ledger, start, conf):
+    """ Prints the progress of the run started at start and saves it in
+    <out_dir>/progress.json
+    """
+    counts = ledger.counts()
+    files, audio_seconds = ledger.done_since(start)
+    hours = max(time.time() - start, 1e-9) / 3600
+    files_per_hour = files / hours
+    remaining = counts['pending'] + counts['running']
+    progress = dict(
+        counts,
+        total=sum(counts.values()),
+        hours=hours,
+        files_this_run=files,
+        audio_hours_this_run=audio_seconds / 3600,
+        files_per_hour=files_per_hour,
+        audio_hours_per_hour=audio_seconds / 3600 / hours,
+        eta_hours=remaining / files_per_hour if files else None
+    )
+    print(
+        '{done}/{total} done, {failed} failed, {running} running | '
+        '{files_per_hour:.1f} files/h | {audio_hours_per_hour:.2f} h of audio/h | ETA {eta}'.format(
+            eta='-' if progress['eta_hours'] is None else '{:.1f}h'.format(progress['eta_hours']),
+            **progress
+        ),
+        flush=True
+    )
+    with open(os.path.join(conf["out_dir"], "progress.json"), "w") as f:
+        json.dump(progress, f, indent=0)
+
+
+def main(conf):
+    os.makedirs(conf["out_dir"], exist_ok=True)
+    if conf["ledger"] is None:
+        conf["ledger"] = os.path.join(conf["out_dir"], "jobs.sqlite")
+    # held until this process exits
+    lock_file = open(conf["ledger"] + ".lock", "w")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        raise RuntimeError('Another runner is using the ledger {}'.format(conf["ledger"]))
+    ledger = JobLedger(conf["ledger"])
+    # the jobs left running by an interrupted run are separated again
+    ledger.reset(conf["retries"])
+    extensions = [extension.strip().lower() for extension in conf["extensions"].split(",")]
+    new_jobs = ledger.add(find_files(conf["in_dir"], extensions))
+    counts = ledger.counts()
+    print('{} new files, {} to separate, {} already done'.format(new_jobs, counts['pending'], counts['done']))
+
+    start = time.time()
+    # spawn, so that the workers do not inherit the threads of torch
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(target=worker, args=(worker_idx, conf))
+        for worker_idx in range(min(conf["workers"], counts['pending']))
+    ]
+    for process in processes:
+        process.start()
+    try:
+        while any(process.is_alive() for process in processes):
+            for process in processes:
+                process.join(conf["report_seconds"] / len(processes))
+            report(ledger, start, conf)
+    except KeyboardInterrupt:
+        print('Interrupted, run again to resume')
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
+    finally:
+        if not processes:
+            report(ledger, start, conf)
+        for path, error in ledger.failures():
+            print('Failed:', path, error.strip().splitlines()[-1])
+        ledger.close()
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    arg_dic = dict(vars(args))
+    # Load training config
+    conf_path = os.path.join(args.exp_dir, "conf.yml")
+    with open(conf_path) as f:
+        train_conf = yaml.safe_load(f)
+    arg_dic["sample_rate"] = train_conf["data"]["sample_rate"]
+
+    main(arg_dic)
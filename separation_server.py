@@ -0,0 +1,191 @@
+import argparse
+import io
+import json
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import soundfile as sf
+import torch
+import yaml
+from utils.my_import import my_import
+from utils.dynamic_batching import DynamicBatcher, BatchedSeparator
+
+
+"""
+Local HTTP service that loads a trained UNet or ConvTasNet once and separates
+the audio files posted to it. The files are cut in overlapping chunks (see
+utils/chunked_separation.py), and the chunks of all the concurrent requests
+are separated together, up to --max_batch_size chunks per forward pass and
+waiting at most --max_wait_ms for other requests (see
+utils/dynamic_batching.py).
+
+POST /separate with any file that soundfile can read (at the sample rate of
+the model) as the body answers with the estimated sources, streamed as they
+are separated: raw little-endian float32 samples, interleaved with one channel
+per source. The headers X-Sample-Rate, X-Sources and X-Frames describe them.
+A failure before the first estimates is answered with a 500. A failure after
+them closes the connection, so a body shorter than its Content-Length means
+that the separation failed.
+GET /stats returns the number of requests, forward passes and chunks as json.
+See load_test_server.py for a client.
+"""
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--target_model", type=str, required=True, help="UNet or ConvTasNet")
+parser.add_argument("--exp_dir", type=str, required=True, help="Experiment with best_model.pth and conf.yml")
+parser.add_argument("--host", type=str, default="127.0.0.1", help="Address to listen on")
+parser.add_argument("--port", type=int, default=8000, help="Port to listen on")
+parser.add_argument("--use_gpu", type=int, default=0, help="Whether to use the GPU for model execution")
+parser.add_argument("--precision", type=str, default="32", help="32, 16 (float16) or bf16 (bfloat16) autocast of the model")
+parser.add_argument("--chunk_seconds", type=float, default=18, help="Length of the chunks in seconds")
+parser.add_argument("--overlap_seconds", type=float, default=1, help="Overlap of consecutive chunks in seconds")
+parser.add_argument("--max_batch_size", type=int, default=8, help="Chunks separated in each forward pass")
+parser.add_argument("--max_wait_ms", type=float, default=20, help="Time a chunk may wait for the chunks of other requests")
+parser.add_argument("--num_threads", type=int, default=None, help="torch threads of the forward passes")
+parser.add_argument(
+    "--fused_unet",
+    type=int,
+    default=None,
+    help="1 to run the UNet branches fused, 0 to run them separately (default: as trained)"
+)
+parser.add_argument("--log_requests", type=int, default=0, help="Print a line per request")
+
+
+def load_model(conf):
+    model_path = os.path.join(conf["exp_dir"], "best_model.pth")
+    if conf["target_model"] == "UNet":
+        sys.path.append('UNet_model')
+        AsteroidModelModule = my_import("unet_model.UNet")
+    else:
+        sys.path.append('ConvTasNet_model')
+        AsteroidModelModule = my_import("conv_tasnet_norm.ConvTasNetNorm")
+    model_kwargs = {}
+    if conf["target_model"] == "UNet" and conf["fused_unet"] is not None:
+        model_kwargs["fused"] = bool(conf["fused_unet"])
+    model = AsteroidModelModule.from_pretrained(model_path, sample_rate=conf["sample_rate"], **model_kwargs)
+    model.eval()
+    if conf["use_gpu"]:
+        model.cuda()
+    return model
+
+
+class SeparationHandler(BaseHTTPRequestHandler):
+    """ Handles the requests of a server with the attributes separator
+    (BatchedSeparator), conf, and requests (counter) with its lock.
+    """
+
+    def do_GET(self):
+        if self.path != '/stats':
+            self.send_error(404)
+            return
+        stats = dict(self.server.separator.batcher.stats(), requests=self.server.requests)
+        body = json.dumps(stats).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        if self.path != '/separate':
+            self.send_error(404)
+            return
+        conf = self.server.conf
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            audio, sample_rate = sf.read(io.BytesIO(self.rfile.read(length)), dtype='float32', always_2d=True)
+        except RuntimeError as error:
+            self.send_error(400, 'Could not decode the audio: {}'.format(error))
+            return
+        if sample_rate != conf["sample_rate"]:
+            self.send_error(400, 'The sample rate must be {}, got {}'.format(conf["sample_rate"], sample_rate))
+            return
+        with self.server.lock:
+            self.server.requests += 1
+        mix = torch.from_numpy(audio.mean(axis=1))
+        separator = self.server.separator
+
+        # the mixture is given by chunks, so that the estimates are sent as
+        # soon as the chunks covering them are separated. The first ones are
+        # separated before the headers, so that an error of the model is
+        # answered with a 500
+        blocks = mix.split(separator.chunk_size)
+        separated = separator.separate_blocks(blocks)
+        try:
+            first = next(separated, None)
+        except Exception as error:
+            self.log_error('Separation failed: %r', error)
+            self.send_error(500, 'Separation failed: {}'.format(error))
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('X-Sample-Rate', str(sample_rate))
+        self.send_header('X-Sources', str(conf["n_src"]))
+        self.send_header('X-Frames', str(mix.shape[0]))
+        self.send_header('Content-Length', str(mix.shape[0] * conf["n_src"] * 4))
+        self.end_headers()
+        sent = 0
+        try:
+            if first is not None:
+                self.wfile.write(first[1].t().numpy().astype('<f4').tobytes())
+                sent += first[1].shape[-1]
+            for _, estimates in separated:
+                self.wfile.write(estimates.t().numpy().astype('<f4').tobytes())
+                sent += estimates.shape[-1]
+        except Exception as error:
+            # the status is already sent: the body is cut short of its
+            # Content-Length and the connection is closed
+            self.log_error('Separation failed after %d of %d frames: %r', sent, mix.shape[0], error)
+            self.close_connection = True
+
+    def log_message(self, format, *args):
+        if self.server.conf["log_requests"]:
+            super().log_message(format, *args)
+
+    def log_error(self, format, *args):
+        # the errors are logged also without --log_requests
+        super().log_message(format, *args)
+
+
+def main(conf):
+    if conf["num_threads"] is not None:
+        torch.set_num_threads(conf["num_threads"])
+    model = load_model(conf)
+    batcher = DynamicBatcher(
+        model,
+        max_batch_size=conf["max_batch_size"],
+        max_wait=conf["max_wait_ms"] / 1000,
+        precision=conf["precision"]
+    )
+    server = ThreadingHTTPServer((conf["host"], conf["port"]), SeparationHandler)
+    server.daemon_threads = True
+    server.conf = conf
+    server.requests = 0
+    server.lock = threading.Lock()
+    server.separator = BatchedSeparator(
+        batcher,
+        chunk_size=int(conf["chunk_seconds"] * conf["sample_rate"]),
+        overlap=int(conf["overlap_seconds"] * conf["sample_rate"])
+    )
+    print('Separating with {} on http://{}:{}/separate'.format(conf["target_model"], conf["host"], conf["port"]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    arg_dic = dict(vars(args))
+    # Load training config
+    conf_path = os.path.join(args.exp_dir, "conf.yml")
+    with open(conf_path) as f:
+        train_conf = yaml.safe_load(f)
+    arg_dic["sample_rate"] = train_conf["data"]["sample_rate"]
+    arg_dic["n_src"] = train_conf["data"]["n_src"]
+
+    main(arg_dic)
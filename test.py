@@ -1,4 +1,5 @@
 import os
+import hashlib
 import random
 import soundfile as sf
 import torch
@@ -8,8 +9,10 @@ import argparse
 import numpy as np
 import pandas as pd
 from tqdm import tqdm
+from torch.utils.data import DataLoader, Subset
 import sys
 from utils.my_import import my_import
+from utils.precision import autocast
 
 from asteroid.metrics import get_metrics
 from pytorch_lightning import seed_everything
@@ -61,9 +64,115 @@ parser.add_argument(
     default=0,
     help="Compute WER using ESPNet's pretrained model"
 )
+parser.add_argument(
+    "--recipe",
+    type=str,
+    default=None,
+    help="Mixing recipe to replay (see dataset_creation/create_mixing_recipe.py)"
+)
+parser.add_argument(
+    "--num_shards",
+    type=int,
+    default=1,
+    help="Split the evaluation in num_shards processes"
+)
+parser.add_argument(
+    "--shard_id",
+    type=int,
+    default=0,
+    help="Shard evaluated by this process, from 0 to num_shards - 1"
+)
+parser.add_argument(
+    "--batch_size",
+    type=int,
+    default=1,
+    help="Number of mixtures separated together"
+)
+parser.add_argument(
+    "--precision",
+    type=str,
+    default="32",
+    help="32, 16 (float16) or bf16 (bfloat16) autocast of the model"
+)
+parser.add_argument(
+    "--fused_unet",
+    type=int,
+    default=None,
+    help="1 to run the UNet branches fused, 0 to run them separately (default: as trained)"
+)
 
 COMPUTE_METRICS = ["si_sdr", "sdr", "sir", "sar", "stoi"]
 
+def evaluate_item(idx, mix, sources, est_sources, save_idx, series_list, eval_save_dir, ex_save_dir, conf):
+    """ Computes the metrics of the mixture idx and saves it as an example
+    if it is in save_idx.
+    """
+    mix_np = mix.cpu().data.numpy()
+    sources_np = sources.cpu().data.numpy()
+    est_sources_np = est_sources.float().cpu().data.numpy()
+
+    try:
+        utt_metrics = get_metrics(
+            mix_np,
+            sources_np,
+            est_sources_np,
+            sample_rate=conf["sample_rate"],
+            metrics_list=COMPUTE_METRICS,
+            average=False
+        )
+        series_list.append(pd.Series(utt_metrics, name=idx))
+        # Write local metrics to the example folder.
+        with open(eval_save_dir + "metrics.json", "w") as f:
+            json.dump({k:v.tolist() for k,v in utt_metrics.items()}, f, indent=0)
+    except:
+        print("Error. Index", idx)
+        print(mix_np)
+        print(sources_np)
+        print(est_sources_np)
+
+    # Save some examples in a folder. Wav files and metrics as text.
+    if idx in save_idx:
+        local_save_dir = os.path.join(ex_save_dir, "ex_{}/".format(idx + 1))
+        os.makedirs(local_save_dir, exist_ok=True)
+        print(mix_np.shape)
+        sf.write(
+            local_save_dir + "mixture.wav",
+            mix_np,
+            conf["sample_rate"]
+        )
+        # Loop over the sources and estimates
+        for src_idx, src in enumerate(sources_np):
+            sf.write(
+                local_save_dir + "s{}.wav".format(src_idx),
+                src,
+                conf["sample_rate"]
+            )
+        for src_idx, est_src in enumerate(est_sources_np):
+            # est_src *= np.max(np.abs(mix_np)) / np.max(np.abs(est_src))
+            sf.write(
+                local_save_dir + "s{}_estimate.wav".format(src_idx),
+                est_src,
+                conf["sample_rate"],
+            )
+
+
+def run_id(conf):
+    """ Returns a hash of the recipe, the model and the settings of the
+    evaluation, the same for all the shards of a run.
+    """
+    run_hash = hashlib.sha1()
+    for path in [conf["recipe"], os.path.join(conf["exp_dir"], "best_model.pth")]:
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                run_hash.update(block)
+    settings = {
+        key: conf[key]
+        for key in ["test_dir", "target_model", "sample_rate", "segment", "multi_speakers", "precision", "fused_unet"]
+    }
+    run_hash.update(json.dumps(settings, sort_keys=True).encode())
+    return run_hash.hexdigest()[:12]
+
+
 def main(conf):
     compute_metrics = COMPUTE_METRICS
     wer_tracker = (
@@ -76,9 +185,16 @@ def main(conf):
     else:
         sys.path.append('ConvTasNet_model')
         AsteroidModelModule = my_import("conv_tasnet_norm.ConvTasNetNorm")
-    model = AsteroidModelModule.from_pretrained(model_path, sample_rate=conf["sample_rate"])
+    model_kwargs = {}
+    if conf["target_model"] == "UNet" and conf["fused_unet"] is not None:
+        # run the branches with grouped convolutions (any checkpoint)
+        model_kwargs["fused"] = bool(conf["fused_unet"])
+    model = AsteroidModelModule.from_pretrained(model_path, sample_rate=conf["sample_rate"], **model_kwargs)
     # model = ConvTasNet
     # Handle device placement
+    # dropout off and batch norms with their running statistics, so that
+    # the estimates do not depend on the other mixtures of the batch
+    model.eval()
     if conf["use_gpu"]:
         model.cuda()
     test_set = PodcastMixDataloader(
@@ -87,7 +203,8 @@ def main(conf):
         original_sample_rate=conf["original_sample_rate"],
         segment=conf["segment"],
         shuffle_tracks=False,
-        multi_speakers=conf["multi_speakers"]
+        multi_speakers=conf["multi_speakers"],
+        recipe_path=conf["recipe"]
     )
     # Used to reorder sources only
 
@@ -99,71 +216,52 @@ def main(conf):
     save_idx = random.sample(range(len(test_set)), conf["n_save_ex"])
     # pdb.set_trace()
     series_list = []
+    # each shard evaluates one every num_shards mixtures. The mixtures only
+    # depend on their index when a recipe is replayed
+    assert conf["recipe"] is not None or conf["num_shards"] == 1
+    shard_idxs = range(conf["shard_id"], len(test_set), conf["num_shards"])
 
-    torch.no_grad().__enter__()
-    for idx in tqdm(range(len(test_set))):
-        # Forward the network on the mixture.
-        mix, sources = test_set[idx]
+    # the mixtures are drawn in the same order as one by one, and the models
+    # normalize each mixture of the batch on its own, so the batch size does
+    # not change the results
+    test_loader = DataLoader(
+        Subset(test_set, shard_idxs),
+        batch_size=conf["batch_size"],
+        shuffle=False
+    )
+    batch_idxs = [shard_idxs[i:i + conf["batch_size"]] for i in range(0, len(shard_idxs), conf["batch_size"])]
 
-        if conf["target_model"] == "UNet":
-            mix = mix.unsqueeze(0)
+    torch.no_grad().__enter__()
+    for idxs, (mixes, batch_sources) in tqdm(zip(batch_idxs, test_loader), total=len(test_loader)):
+        # Forward the network on the mixtures.
         # get audio representations, pass the mix to the unet, it will normalize
         # it, create the masks, pass them to audio, unnormalize them and return
-        est_sources = model(mix)
-
-        mix_np = mix.cpu().data.numpy()
-        if conf["target_model"] == "UNet":
-            mix_np = mix_np.squeeze(0)
-
-        sources_np = sources.cpu().data.numpy()
-        est_sources_np = est_sources.squeeze(0).cpu().data.numpy()
-
-        try:
-            utt_metrics = get_metrics(
-                mix_np,
-                sources_np,
-                est_sources_np,
-                sample_rate=conf["sample_rate"],
-                metrics_list=COMPUTE_METRICS,
-                average=False
-            )
-            series_list.append(pd.Series(utt_metrics))
-        except:
-            print("Error. Index", idx)
-            print(mix_np)
-            print(sources_np)
-            print(est_sources_np)
-
-        # Save some examples in a folder. Wav files and metrics as text.
-        if idx in save_idx:
-            local_save_dir = os.path.join(ex_save_dir, "ex_{}/".format(idx + 1))
-            os.makedirs(local_save_dir, exist_ok=True)
-            print(mix_np.shape)
-            sf.write(
-                local_save_dir + "mixture.wav",
-                mix_np,
-                conf["sample_rate"]
-            )
-            # Loop over the sources and estimates
-            for src_idx, src in enumerate(sources_np):
-                sf.write(
-                    local_save_dir + "s{}.wav".format(src_idx),
-                    src,
-                    conf["sample_rate"]
-                )
-            for src_idx, est_src in enumerate(est_sources_np):
-                # est_src *= np.max(np.abs(mix_np)) / np.max(np.abs(est_src))
-                sf.write(
-                    local_save_dir + "s{}_estimate.wav".format(src_idx),
-                    est_src,
-                    conf["sample_rate"],
-                )
-        # Write local metrics to the example folder.
-        with open(eval_save_dir + "metrics.json", "w") as f:
-            json.dump({k:v.tolist() for k,v in utt_metrics.items()}, f, indent=0)
+        with autocast(conf["precision"], next(model.parameters()).device.type):
+            batch_est_sources = model(mixes)
+        for idx, mix, sources, est_sources in zip(idxs, mixes, batch_sources, batch_est_sources):
+            evaluate_item(idx, mix, sources, est_sources, save_idx, series_list, eval_save_dir, ex_save_dir, conf)
 
     # Save all metrics to the experiment folder.
     all_metrics_df = pd.DataFrame(series_list)
+    if conf["num_shards"] > 1:
+        # the shard files are named after the run, so that the shards of an
+        # earlier run with another recipe, model or settings are not merged
+        shard_paths = [
+            os.path.join(eval_save_dir, "all_metrics_{}_{}of{}.csv".format(run_id(conf), shard_id, conf["num_shards"]))
+            for shard_id in range(conf["num_shards"])
+        ]
+        # written under another name and renamed, so that the other shards
+        # never read a partly written file
+        shard_path = shard_paths[conf["shard_id"]]
+        all_metrics_df.to_csv(shard_path + ".tmp")
+        os.replace(shard_path + ".tmp", shard_path)
+        if not all(os.path.isfile(path) for path in shard_paths):
+            print("Shard", conf["shard_id"], "done, waiting for the other shards")
+            return
+        # the last shard to finish summarizes all of them
+        all_metrics_df = pd.concat(
+            [pd.read_csv(path, index_col=0) for path in shard_paths]
+        ).sort_index()
     all_metrics_df.to_csv(os.path.join(eval_save_dir, "all_metrics.csv"))
 
     # Print and save summary metrics
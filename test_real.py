@@ -123,6 +123,9 @@ def main(conf):
     print("model_path", model_path)
     # model = ConvTasNet
     # Handle device placement
+    # dropout off and batch norms with their running statistics, so that
+    # the estimates do not depend on the other mixtures of the batch
+    model.eval()
     if conf["use_gpu"]:
         model.cuda()
     test_set = PodcastLoader(
@@ -12,9 +12,14 @@ from pytorch_lightning.plugins import DDPPlugin
 import sys
 
 from PodcastMixDataloader import PodcastMixDataloader
+from PodcastMixStreamingDataloader import PodcastMixStreamingDataloader
 from asteroid.engine.optimizers import make_optimizer
 from asteroid.engine.system import System
 from logl2 import LogL2Time
+from utils.mixing import SourceMixer, MixCollate
+from utils.resampler import Resampler
+from utils.checkpointing import enable_checkpointing, PeakMemoryCallback
+from utils.precision import autocast
 
 seed_everything(1, workers=True)
 
@@ -31,30 +36,93 @@ parser.add_argument(
     help="Full path to save best validation model"
 )
 
+
+class PodcastMixSystem(System):
+    """ System that builds the mixtures of the raw (sources, gains) batches
+    on the training device when mixer is given, and runs the model and the
+    loss under autocast with autocast_precision ('32' to disable it).
+    """
+
+    def __init__(self, *args, mixer=None, autocast_precision='32', **kwargs):
+        super().__init__(*args, **kwargs)
+        self.mixer = mixer
+        self.autocast_precision = autocast_precision
+
+    def common_step(self, batch, batch_nb, train=True):
+        if self.mixer is not None:
+            batch = self.mixer(*batch)
+        with autocast(self.autocast_precision, self.device.type):
+            return super().common_step(batch, batch_nb, train=train)
+
+
 def main(conf):
-    train_set = PodcastMixDataloader(
-        csv_dir=conf["data"]["train_dir"],
-        sample_rate=conf["data"]["sample_rate"],
-        original_sample_rate=conf["data"]["original_sample_rate"],
-        segment=conf["data"]["segment"],
-        shuffle_tracks=True,
-        multi_speakers=conf["training"]["multi_speakers"]
-    )
+    # where the mixtures are built: in each item, in the collate_fn of the
+    # dataloaders, or in the training device for the whole batch. Outside
+    # the items, the resampling is also done once per batch.
+    mix_stage = conf["data"]["mix_stage"]
+    assert mix_stage in ['item', 'collate', 'device']
+    batch_resampler = None
+    if mix_stage != 'item' and conf["data"]["sample_rate"] != conf["data"]["original_sample_rate"]:
+        batch_resampler = Resampler(
+            input_sr=conf["data"]["original_sample_rate"],
+            output_sr=conf["data"]["sample_rate"],
+            dtype=torch.float32,
+            filter='hann'
+        )
+    if conf["training"]["streaming"]:
+        # sequential reads of the audio store, sharded among workers and ranks
+        train_set = PodcastMixStreamingDataloader(
+            csv_dir=conf["data"]["train_dir"],
+            sample_rate=conf["data"]["sample_rate"],
+            original_sample_rate=conf["data"]["original_sample_rate"],
+            segment=conf["data"]["segment"],
+            multi_speakers=conf["training"]["multi_speakers"],
+            chunk_mb=conf["training"]["stream_chunk_mb"],
+            shuffle_buffer=conf["training"]["stream_shuffle_buffer"],
+            raw_sources=mix_stage != 'item',
+            resample_in_batch=batch_resampler is not None
+        )
+    else:
+        train_set = PodcastMixDataloader(
+            csv_dir=conf["data"]["train_dir"],
+            sample_rate=conf["data"]["sample_rate"],
+            original_sample_rate=conf["data"]["original_sample_rate"],
+            segment=conf["data"]["segment"],
+            shuffle_tracks=True,
+            multi_speakers=conf["training"]["multi_speakers"],
+            use_audio_store=conf["data"]["use_audio_store"],
+            use_energy_index=conf["data"]["use_energy_index"],
+            speech_cache_bytes=int(conf["data"]["speech_cache_mb"] * 2 ** 20),
+            io_threads=conf["data"]["io_threads"],
+            raw_sources=mix_stage != 'item',
+            resample_in_batch=batch_resampler is not None
+        )
     val_set = PodcastMixDataloader(
         csv_dir=conf["data"]["valid_dir"],
         sample_rate=conf["data"]["sample_rate"],
         original_sample_rate=conf["data"]["original_sample_rate"],
         segment=conf["data"]["segment"],
         shuffle_tracks=True,
-        multi_speakers=conf["training"]["multi_speakers"]
+        multi_speakers=conf["training"]["multi_speakers"],
+        use_audio_store=conf["data"]["use_audio_store"],
+        use_energy_index=conf["data"]["use_energy_index"],
+        speech_cache_bytes=int(conf["data"]["speech_cache_mb"] * 2 ** 20),
+        io_threads=conf["data"]["io_threads"],
+        raw_sources=mix_stage != 'item',
+        resample_in_batch=batch_resampler is not None
     )
+    collate_fn = None
+    if mix_stage == 'collate':
+        collate_fn = MixCollate(SourceMixer(batch_resampler))
     train_loader = DataLoader(
         train_set,
-        shuffle=True,
+        # the streaming dataset shuffles its examples itself
+        shuffle=not conf["training"]["streaming"],
         batch_size=conf["training"]["batch_size"],
         num_workers=conf["training"]["num_workers"],
         drop_last=True,
-        pin_memory=True
+        pin_memory=True,
+        collate_fn=collate_fn
     )
     val_loader = DataLoader(
         val_set,
@@ -62,7 +130,8 @@ def main(conf):
         batch_size=conf["training"]["batch_size"],
         num_workers=conf["training"]["num_workers"],
         drop_last=True,
-        pin_memory=True
+        pin_memory=True,
+        collate_fn=collate_fn
     )
     
     if(conf["model"]["name"] == "ConvTasNet"):
@@ -76,6 +145,9 @@ def main(conf):
         )
         loss_func = LogL2Time()
         plugins = None
+        if conf["training"]["checkpointing"]:
+            # recompute the activations of the TCN blocks in the backward pass
+            enable_checkpointing(model.masker.TCN)
     elif(conf["model"]["name"] == "UNet"):
         # UNet with logl2 time loss and normalization inside model
         sys.path.append('UNet_model')
@@ -86,10 +158,18 @@ def main(conf):
             conf["data"]["hop_size"],
             conf["data"]["window_size"],
             conf["convolution"]["kernel_size"],
-            conf["convolution"]["stride"]
+            conf["convolution"]["stride"],
+            fused=conf["convolution"]["fused"]
         )
         loss_func = LogL2Time()
         plugins = DDPPlugin(find_unused_parameters=False)
+        if conf["training"]["checkpointing"]:
+            # recompute the activations of the down and up stages in the
+            # backward pass
+            enable_checkpointing(
+                module for name, module in model.named_children()
+                if name.startswith(('down_', 'up_'))
+            )
     optimizer = make_optimizer(model.parameters(), **conf["optim"])
     if conf["training"]["half_lr"]:
         scheduler = ReduceLROnPlateau(
@@ -98,6 +178,12 @@ def main(conf):
             patience=5
         )
 
+    # float16 is handled by the Trainer, with loss scaling. bfloat16 needs
+    # no loss scaling and is not supported by this version of lightning, the
+    # system runs it with autocast
+    precision = str(conf["training"]["precision"])
+    autocast(precision, 'cuda' if torch.cuda.is_available() else 'cpu')  # fails early if not supported
+
     # Just after instantiating, save the args. Easy loading in the future.
     exp_dir = conf["model"]["name"] + "_model/" + conf["main_args"]["exp_dir"]
     os.makedirs(exp_dir, exist_ok=True)
@@ -105,14 +191,16 @@ def main(conf):
     with open(conf_path, "w") as outfile:
         yaml.safe_dump(conf, outfile)
 
-    system = System(
+    system = PodcastMixSystem(
         model=model,
         loss_func=loss_func,
         optimizer=optimizer,
         train_loader=train_loader,
         val_loader=val_loader,
         scheduler=scheduler,
-        config=conf
+        config=conf,
+        mixer=SourceMixer(batch_resampler) if mix_stage == 'device' else None,
+        autocast_precision='bf16' if precision == 'bf16' else '32'
     )
 
     # Define callbacks
@@ -126,6 +214,7 @@ def main(conf):
         verbose=True
     )
     callbacks.append(checkpoint)
+    callbacks.append(PeakMemoryCallback())
     if conf["training"]["early_stop"]:
         callbacks.append(EarlyStopping(
             monitor="val_loss",
@@ -145,7 +234,7 @@ def main(conf):
         distributed_backend=distributed_backend,
         gradient_clip_val=5.0,
         resume_from_checkpoint=conf["main_args"]["resume_from"],
-        precision=32,
+        precision=16 if precision == '16' else 32,
         plugins=plugins
     )
     trainer.fit(system)
@@ -0,0 +1,72 @@
+from collections import OrderedDict
+
+
+class AudioLRUCache:
+    """ Least recently used cache of decoded waveforms, bounded by the number
+    of bytes of the cached tensors.
+
+    The cache is a plain attribute of the dataset, so each DataLoader worker
+    gets its own copy and fills it independently. The cached tensors are
+    returned as they are: callers must not modify them in place.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.evicted_bytes = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key):
+        """ Returns the cached tensor for key, or None if it is not cached
+        """
+        tensor = self.entries.get(key)
+        if tensor is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return tensor
+
+    def put(self, key, tensor):
+        """ Adds tensor to the cache, evicting the least recently used entries
+        until it fits. Tensors bigger than the whole budget are not cached.
+        """
+        size = tensor.element_size() * tensor.nelement()
+        if size > self.max_bytes:
+            return
+        if key in self.entries:
+            previous = self.entries.pop(key)
+            self.bytes -= previous.element_size() * previous.nelement()
+        while self.bytes + size > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            evicted_size = evicted.element_size() * evicted.nelement()
+            self.bytes -= evicted_size
+            self.evictions += 1
+            self.evicted_bytes += evicted_size
+        self.entries[key] = tensor
+        self.bytes += size
+
+    def hit_rate(self):
+        requests = self.hits + self.misses
+        return self.hits / requests if requests else 0.0
+
+    def stats(self):
+        return {
+            'entries': len(self.entries),
+            'bytes': self.bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hit_rate(),
+            'evictions': self.evictions,
+            'evicted_bytes': self.evicted_bytes
+        }
@@ -0,0 +1,226 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import torch
+import torchaudio
+
+
+STORE_DTYPES = {'float32': np.float32, 'int16': np.int16}
+
+
+def store_paths(store_dir, name):
+    """ Returns the paths of the metadata and index files of the `name`
+    partition (speech or music) of an audio store.
+    """
+    return (
+        os.path.join(store_dir, name + '.json'),
+        os.path.join(store_dir, name + '_index.csv')
+    )
+
+
+def build_audio_store(csv_path, path_column, store_dir, name,
+                      dtype='float32', mono='first',
+                      shard_size=2 ** 31):
+    """ Decodes every file listed in `csv_path` once and appends it to a
+    sequence of flat binary shards that can be memory mapped later on.
+
+    With dtype='float32' the stored signal is the mono waveform exactly as
+    PodcastMixDataloader computes it from the FLAC file (channel 0 for speech,
+    mean of the channels for music), so reading from the store is bit-exact
+    and needs no conversion. With dtype='int16' the original PCM samples of
+    the channels used by the dataloader are kept (half the size), and the
+    conversion to float happens when the segment is read.
+
+    Parameters:
+    - csv_path (str) : speech.csv or music.csv of a partition
+    - path_column (str) : column of the csv holding the audio paths
+    - store_dir (str) : directory where the shards are written
+    - name (str) : name of the partition inside the store (speech or music)
+    - dtype (str) : 'float32' or 'int16'
+    - mono (str) : 'first' to keep channel 0, 'mean' to average the channels
+    - shard_size (int) : maximum size in bytes of each shard
+
+    Returns:
+    - index (pd.DataFrame) : path, shard, offset, length and channels of every
+    stored file. Offsets are in samples inside the shard.
+    """
+    assert dtype in STORE_DTYPES
+    assert mono in ['first', 'mean']
+    np_dtype = STORE_DTYPES[dtype]
+    os.makedirs(store_dir, exist_ok=True)
+    torchaudio.set_audio_backend(backend='soundfile')
+    df = pd.read_csv(csv_path, engine='python')
+
+    shards = []
+    rows = []
+    shard_file = None
+    shard_offset = 0
+    for audio_path in df[path_column]:
+        if dtype == 'float32':
+            audio, _ = torchaudio.load(audio_path)
+            if mono == 'first':
+                audio = audio[0].unsqueeze(0)
+            elif len(audio) == 2:
+                # same reduction as load_mono_random_segment
+                audio = torch.mean(audio, dim=0).unsqueeze(0)
+            samples = audio.numpy()
+        else:
+            audio, _ = torchaudio.load(audio_path, normalize=False)
+            if mono == 'first':
+                audio = audio[0].unsqueeze(0)
+            samples = audio.numpy()
+            if samples.dtype != np.int16:
+                raise ValueError(
+                    "{} is not 16 bit PCM, use dtype='float32'".format(audio_path)
+                )
+        channels, length = samples.shape
+        # interleave the channels: (length, channels)
+        data = np.ascontiguousarray(samples.T, dtype=np_dtype)
+
+        if shard_file is None or (shard_offset + data.size) * data.itemsize > shard_size:
+            if shard_file is not None:
+                shard_file.close()
+            shards.append('{}_{:03d}.bin'.format(name, len(shards)))
+            shard_file = open(os.path.join(store_dir, shards[-1]), 'wb')
+            shard_offset = 0
+        shard_file.write(data.tobytes())
+        rows.append([audio_path, len(shards) - 1, shard_offset, length, channels])
+        shard_offset += data.size
+    if shard_file is not None:
+        shard_file.close()
+
+    meta_path, index_path = store_paths(store_dir, name)
+    index = pd.DataFrame(rows, columns=['path', 'shard', 'offset', 'length', 'channels'])
+    index.to_csv(index_path, index=False)
+    with open(meta_path, 'w') as f:
+        json.dump({'dtype': dtype, 'mono': mono, 'shards': shards}, f, indent=0)
+    return index
+
+
+class AudioStore:
+    """ Read-only access to the partitions written by `build_audio_store`.
+
+    Segments are sliced directly out of memory mapped shards: no decoding is
+    done, and with a float32 store the returned tensor shares memory with the
+    mapping (no copy). Shards are opened lazily so that each DataLoader worker
+    maps them on its own.
+    """
+
+    def __init__(self, store_dir, names=('speech', 'music')):
+        self.store_dir = store_dir
+        self.partitions = {}
+        self.entries = {}
+        # stored paths of each partition, in the order of the shards
+        self.paths = {}
+        for name in names:
+            meta_path, index_path = store_paths(store_dir, name)
+            with open(meta_path) as f:
+                self.partitions[name] = json.load(f)
+            index = pd.read_csv(index_path)
+            self.paths[name] = list(index.path)
+            for path, shard, offset, length, channels in zip(
+                    index.path, index.shard, index.offset,
+                    index.length, index.channels):
+                self.entries[path] = (name, int(shard), int(offset), int(length), int(channels))
+        self._shards = {}
+
+    def __getstate__(self):
+        # never pickle the mappings, each process opens its own
+        state = self.__dict__.copy()
+        state['_shards'] = {}
+        return state
+
+    def __contains__(self, audio_path):
+        return audio_path in self.entries
+
+    def shard(self, name, shard):
+        key = (name, shard)
+        if key not in self._shards:
+            partition = self.partitions[name]
+            # copy-on-write mapping: the file is never modified but the
+            # resulting tensors are writable, as torchaudio.load ones
+            self._shards[key] = np.memmap(
+                os.path.join(self.store_dir, partition['shards'][shard]),
+                dtype=STORE_DTYPES[partition['dtype']],
+                mode='c'
+            )
+        return self._shards[key]
+
+    def length(self, audio_path):
+        return self.entries[audio_path][3]
+
+    def itemsize(self, audio_path):
+        """ Number of bytes of each stored sample of audio_path """
+        name = self.entries[audio_path][0]
+        return np.dtype(STORE_DTYPES[self.partitions[name]['dtype']]).itemsize
+
+    def load(self, audio_path, frame_offset=0, num_frames=-1):
+        """ Equivalent of torchaudio.load(audio_path, frame_offset, num_frames)
+        for a stored file.
+
+        Returns:
+        - audio_signal (torch.Tensor) : (channels, frames) float32 waveform
+        """
+        name, shard, offset, length, channels = self.entries[audio_path]
+        frame_offset = min(frame_offset, length)
+        if num_frames < 0:
+            num_frames = length - frame_offset
+        num_frames = min(num_frames, length - frame_offset)
+        start = offset + frame_offset * channels
+        data = self.shard(name, shard)[start:start + num_frames * channels]
+        if channels == 1:
+            data = data[None]
+        else:
+            data = data.reshape(num_frames, channels).T
+        if data.dtype == np.int16:
+            # same scaling as the normalized torchaudio.load
+            return torch.from_numpy(data.astype(np.float32) / 32768)
+        return torch.from_numpy(data)
+
+    def chunks(self, name, chunk_bytes):
+        """ Splits the files of a partition into groups of consecutive files
+        of the same shard, of about chunk_bytes each, so that every group can
+        be read with a single sequential read.
+
+        Returns:
+        - chunks (list) : list of lists of paths
+        """
+        itemsize = np.dtype(STORE_DTYPES[self.partitions[name]['dtype']]).itemsize
+        chunks = []
+        chunk_shard = None
+        chunk_size = 0
+        for path in self.paths[name]:
+            _, shard, _, length, channels = self.entries[path]
+            size = length * channels * itemsize
+            if shard != chunk_shard or chunk_size + size > chunk_bytes:
+                chunks.append([])
+                chunk_shard = shard
+                chunk_size = 0
+            chunks[-1].append(path)
+            chunk_size += size
+        return chunks
+
+    def read_chunk(self, paths):
+        """ Reads the files of a chunk returned by `chunks` with one
+        sequential read of the shard into memory.
+
+        Returns:
+        - audio_signals (list) : (channels, frames) float32 waveform of each
+        file, as returned by `load`
+        """
+        name, shard, first_offset, _, _ = self.entries[paths[0]]
+        _, _, last_offset, length, channels = self.entries[paths[-1]]
+        data = np.array(self.shard(name, shard)[first_offset:last_offset + length * channels])
+        if data.dtype == np.int16:
+            data = data.astype(np.float32) / 32768
+        data = torch.from_numpy(data)
+        audio_signals = []
+        for path in paths:
+            _, _, offset, length, channels = self.entries[path]
+            start = offset - first_offset
+            audio_signals.append(
+                data[start:start + length * channels].view(length, channels).t()
+            )
+        return audio_signals
@@ -0,0 +1,80 @@
+import types
+from contextlib import contextmanager
+import torch
+from torch.utils.checkpoint import checkpoint
+from pytorch_lightning.callbacks import Callback
+
+
+def enable_checkpointing(modules):
+    """ Makes each module of modules recompute its activations in the
+    backward pass instead of keeping them in memory while training
+    (activation checkpointing). The modules and their state dicts are not
+    changed, only the forward of each instance. In eval mode or without
+    gradients they run as usual.
+
+    Args:
+        modules (iterable of nn.Module): blocks to checkpoint, e.g. the TCN
+            blocks of the ConvTasNet masker or the down and up stages of the
+            UNet.
+    """
+    for module in modules:
+        module.forward = types.MethodType(_checkpointed_forward, module)
+
+
+def _checkpointed_forward(module, *inputs):
+    forward = type(module).forward
+    if not module.training or not torch.is_grad_enabled():
+        return forward(module, *inputs)
+
+    def run(*inputs):
+        # the first forward runs without gradients, the second one is the
+        # recomputation of the backward pass
+        if torch.is_grad_enabled():
+            with frozen_batchnorm_stats(module):
+                return forward(module, *inputs)
+        return forward(module, *inputs)
+
+    # the random state is restored for the recomputation, so that the
+    # dropout masks are the same
+    return checkpoint(run, *inputs)
+
+
+@contextmanager
+def frozen_batchnorm_stats(module):
+    """ Keeps the running statistics of the batch normalization layers of
+    module unchanged, so that the recomputation does not update them twice.
+    """
+    norms = [m for m in module.modules() if isinstance(m, torch.nn.modules.batchnorm._BatchNorm)]
+    saved = [(norm.momentum, norm.num_batches_tracked.clone()) for norm in norms]
+    # a momentum of 0 leaves the running mean and var as they are
+    for norm in norms:
+        norm.momentum = 0.0
+    try:
+        yield
+    finally:
+        for norm, (momentum, num_batches_tracked) in zip(norms, saved):
+            norm.momentum = momentum
+            norm.num_batches_tracked.copy_(num_batches_tracked)
+
+
+class PeakMemoryCallback(Callback):
+    """ Prints and logs the peak GPU memory allocated during each training
+    epoch, to compare runs with and without activation checkpointing.
+    """
+
+    def on_train_epoch_start(self, trainer, pl_module):
+        if torch.cuda.is_available():
+            torch.cuda.reset_peak_memory_stats(pl_module.device)
+
+    def on_train_epoch_end(self, trainer, pl_module, unused=None):
+        if not torch.cuda.is_available():
+            return
+        peak_mb = torch.cuda.max_memory_allocated(pl_module.device) / 2 ** 20
+        print('Rank {} peak GPU memory in epoch {}: {:.0f} MB'.format(
+            trainer.global_rank, trainer.current_epoch, peak_mb
+        ))
+        if trainer.logger is not None:
+            trainer.logger.log_metrics(
+                {'peak_memory_mb_rank{}'.format(trainer.global_rank): peak_mb},
+                step=trainer.global_step
+            )
@@ -0,0 +1,134 @@
+import math
+import numpy as np
+import soundfile as sf
+import torch
+from utils.precision import autocast
+
+
+def read_blocks(audio_path, block_size, sample_rate=None):
+    """ Reads audio_path by blocks of block_size frames. If sample_rate is
+    given, a file at another sample rate raises a ValueError.
+
+    Returns:
+    - generator of 1D float32 tensors, the mean of the channels of each block
+    """
+    with sf.SoundFile(audio_path) as f:
+        if sample_rate is not None and f.samplerate != sample_rate:
+            raise ValueError('{} is sampled at {} Hz, the model at {} Hz'.format(audio_path, f.samplerate, sample_rate))
+        for block in f.blocks(blocksize=block_size, dtype='float32', always_2d=True):
+            yield torch.from_numpy(block.mean(axis=1))
+
+
+class ChunkedSeparator:
+    """ Separates signals of any length with a model trained on short
+    segments: the signal is split in chunks of chunk_size samples that
+    overlap by overlap samples, the chunks are separated batch_size at a
+    time, and the estimates are cross-faded with overlap-add.
+
+    The signal is consumed and the estimates are produced block by block
+    (see separate_blocks), so the memory used does not depend on the length
+    of the signal.
+
+    Parameters:
+    - model (nn.Module) : UNet or ConvTasNetNorm, (batch, time) ->
+        (batch, n_src, time)
+    - chunk_size (int) : samples of each chunk
+    - overlap (int) : samples shared by consecutive chunks, at most half of
+        chunk_size
+    - batch_size (int) : chunks separated together
+    - precision (str) : autocast of the model, see utils.precision
+    """
+
+    def __init__(self, model, chunk_size, overlap, batch_size=1, precision='32'):
+        if chunk_size <= 0 or overlap < 0 or 2 * overlap > chunk_size:
+            raise ValueError('overlap must be between 0 and chunk_size / 2, got {} and {}'.format(overlap, chunk_size))
+        self.model = model
+        self.chunk_size = chunk_size
+        self.overlap = overlap
+        self.hop = chunk_size - overlap
+        self.batch_size = batch_size
+        self.precision = precision
+        self.device = next(model.parameters()).device
+        # raised cosine fades, the fade out of a chunk and the fade in of
+        # the next one add up to 1 and never reach 0
+        fade_in = torch.sin(math.pi / 2 * (torch.arange(overlap) + 0.5) / overlap) ** 2
+        self.window = torch.ones(chunk_size)
+        self.window[:overlap] = fade_in
+        self.window[chunk_size - overlap:] = fade_in.flip(0)
+
+    def separate(self, mix):
+        """ Separates the 1D mix.
+
+        Returns:
+        - estimates (torch.Tensor) : (n_src, len(mix))
+        """
+        return torch.cat([estimates for _, estimates in self.separate_blocks([mix])], dim=1)
+
+    def separate_blocks(self, blocks):
+        """ Separates the signal given as consecutive 1D blocks of any size.
+
+        Returns:
+        - generator of (mix, estimates): consecutive blocks of the signal
+            and the (n_src, len(mix)) estimates of their sources, which are
+            yielded as soon as all the chunks covering them are separated
+        """
+        state = {'tail': None, 'tail_weight': torch.zeros(self.overlap)}
+        buffer = torch.zeros(0)
+        batch = []
+        for block in blocks:
+            buffer = torch.cat([buffer, block.float().cpu()])
+            while buffer.shape[0] >= self.chunk_size:
+                batch.append(buffer[:self.chunk_size])
+                buffer = buffer[self.hop:]
+                if len(batch) == self.batch_size:
+                    yield from self.overlap_add(batch, state)
+                    batch = []
+        if batch:
+            yield from self.overlap_add(batch, state)
+
+        # the end of the signal: buffer starts with the overlap of the last
+        # chunk, whose estimates are in the tail
+        remaining = buffer.shape[0]
+        if remaining > self.overlap or (state['tail'] is None and remaining > 0):
+            padded = torch.cat([buffer, torch.zeros(self.chunk_size - remaining)])
+            yield from self.overlap_add([padded], state, keep=remaining)
+        elif remaining > 0:
+            yield buffer, state['tail'][:, :remaining] / state['tail_weight'][:remaining]
+
+    def run_model(self, chunks):
+        """ Separates the (batch, chunk_size) chunks.
+
+        Returns:
+        - estimates (torch.Tensor) : (batch, n_src, chunk_size), float32 on
+            the CPU
+        """
+        with torch.no_grad(), autocast(self.precision, self.device.type):
+            estimates = self.model(chunks.to(self.device))
+        return estimates.float().cpu()
+
+    def overlap_add(self, chunks, state, keep=None):
+        """ Separates the chunks and yields the samples of each one that no
+        later chunk overlaps, or its first keep samples for the last one.
+        """
+        batch_estimates = self.run_model(torch.stack(chunks))
+        for mix, estimates in zip(chunks, batch_estimates):
+            if state['tail'] is None:
+                state['tail'] = torch.zeros(estimates.shape[0], self.overlap)
+            estimates = estimates * self.window
+            weight = self.window.clone()
+            estimates[:, :self.overlap] += state['tail']
+            weight[:self.overlap] += state['tail_weight']
+            end = self.hop if keep is None else keep
+            yield mix[:end], estimates[:, :end] / weight[:end]
+            state['tail'] = estimates[:, self.hop:]
+            state['tail_weight'] = weight[self.hop:]
+
+
+def copy_scaled(src_path, dst_path, factor, block_size=2 ** 18):
+    """ Writes the samples of src_path multiplied by factor in the wav file
+    dst_path (16 bits PCM), by blocks.
+    """
+    with sf.SoundFile(src_path) as src, \
+            sf.SoundFile(dst_path, 'w', src.samplerate, src.channels, format='WAV', subtype='PCM_16') as dst:
+        for block in src.blocks(blocksize=block_size, dtype='float32', always_2d=True):
+            dst.write(block * np.float32(factor))
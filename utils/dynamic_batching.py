@@ -0,0 +1,130 @@
+import queue
+import threading
+import time
+import torch
+from utils.chunked_separation import ChunkedSeparator
+from utils.precision import autocast
+
+
+class _Request:
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.estimates = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class DynamicBatcher:
+    """ Separates the chunks submitted by several threads in shared forward
+    passes of the model. A thread running in the background waits for the
+    first submission, gathers the other ones that arrive within max_wait
+    seconds, up to max_batch_size chunks, and runs the model on all of them
+    at once.
+
+    Parameters:
+    - model (nn.Module) : UNet or ConvTasNetNorm, in eval mode
+    - max_batch_size (int) : chunks separated in each forward pass
+    - max_wait (float) : seconds that a submission may wait for others
+    - precision (str) : autocast of the model, see utils.precision
+    """
+
+    def __init__(self, model, max_batch_size=8, max_wait=0.02, precision='32'):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.precision = precision
+        self.device = next(model.parameters()).device
+        self.requests = queue.Queue()
+        self.stats_lock = threading.Lock()
+        self.batches = 0
+        self.chunks = 0
+        thread = threading.Thread(target=self.run, daemon=True)
+        thread.start()
+
+    def separate(self, chunks):
+        """ Separates the (n, chunk_size) chunks with the chunks of the other
+        threads. Blocks until they are done.
+
+        Returns:
+        - estimates (torch.Tensor) : (n, n_src, chunk_size), float32 on the
+            CPU
+        """
+        request = _Request(chunks)
+        self.requests.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.estimates
+
+    def stats(self):
+        """ Returns the number of forward passes and of chunks separated """
+        with self.stats_lock:
+            return {
+                'batches': self.batches,
+                'chunks': self.chunks,
+                'mean_batch_size': self.chunks / max(self.batches, 1)
+            }
+
+    def run(self):
+        while True:
+            batch = [self.requests.get()]
+            size = batch[0].chunks.shape[0]
+            deadline = time.monotonic() + self.max_wait
+            while size < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    request = self.requests.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                batch.append(request)
+                size += request.chunks.shape[0]
+            self.run_batch(batch)
+
+    def run_batch(self, batch):
+        # chunks of different lengths are separated apart
+        by_length = {}
+        for request in batch:
+            by_length.setdefault(request.chunks.shape[-1], []).append(request)
+        for requests in by_length.values():
+            try:
+                chunks = torch.cat([request.chunks for request in requests])
+                estimates = []
+                for start in range(0, chunks.shape[0], self.max_batch_size):
+                    with torch.no_grad(), autocast(self.precision, self.device.type):
+                        batch_estimates = self.model(chunks[start:start + self.max_batch_size].to(self.device))
+                    estimates.append(batch_estimates.float().cpu())
+                    with self.stats_lock:
+                        self.batches += 1
+                        self.chunks += batch_estimates.shape[0]
+                estimates = torch.cat(estimates)
+                start = 0
+                for request in requests:
+                    request.estimates = estimates[start:start + request.chunks.shape[0]]
+                    start += request.chunks.shape[0]
+            except Exception as error:
+                for request in requests:
+                    request.error = error
+            for request in requests:
+                request.done.set()
+
+
+class BatchedSeparator(ChunkedSeparator):
+    """ ChunkedSeparator whose chunks are separated by a DynamicBatcher,
+    shared with the separators of other threads. It keeps no state between
+    calls, so one instance may also be used by several threads.
+    """
+
+    def __init__(self, batcher, chunk_size, overlap):
+        super().__init__(
+            batcher.model,
+            chunk_size,
+            overlap,
+            batch_size=batcher.max_batch_size,
+            precision=batcher.precision
+        )
+        self.batcher = batcher
+
+    def run_model(self, chunks):
+        return self.batcher.separate(chunks)
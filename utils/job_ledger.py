@@ -0,0 +1,137 @@
+import sqlite3
+import time
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class JobLedger:
+    """ Persistent list of the files to process and of their state, in a
+    sqlite database shared by the processes of a job runner. Each process
+    opens its own JobLedger on the same path.
+
+    A job goes from pending to running when a worker claims it, and then to
+    done or failed. The jobs still running when the runner was interrupted
+    go back to pending with reset, so the runner can be resumed any time.
+
+    Parameters:
+    - path (str) : sqlite file, created if needed
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # autocommit, the transactions are explicit
+        self.connection = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.connection.execute(
+            '''CREATE TABLE IF NOT EXISTS jobs (
+                path TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                worker INTEGER,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                frames INTEGER,
+                sample_rate INTEGER,
+                started REAL,
+                finished REAL,
+                error TEXT
+            )'''
+        )
+        self.connection.execute('CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status)')
+
+    def close(self):
+        self.connection.close()
+
+    def add(self, paths):
+        """ Adds the paths as pending jobs, skipping the ones already in the
+        ledger. Returns the number of new jobs.
+        """
+        before = self.connection.total_changes
+        with self.transaction():
+            self.connection.executemany(
+                'INSERT OR IGNORE INTO jobs (path, status) VALUES (?, ?)',
+                ((path, PENDING) for path in paths)
+            )
+        return self.connection.total_changes - before
+
+    def reset(self, max_attempts):
+        """ Makes pending again the jobs left running by an interrupted run
+        and the failed jobs tried less than max_attempts times.
+        """
+        with self.transaction():
+            self.connection.execute(
+                'UPDATE jobs SET status = ?, worker = NULL WHERE status = ? OR (status = ? AND attempts < ?)',
+                (PENDING, RUNNING, FAILED, max_attempts)
+            )
+
+    def claim(self, worker):
+        """ Marks the next pending job as running by worker and returns its
+        path, or None if there are no pending jobs left.
+        """
+        with self.transaction():
+            row = self.connection.execute(
+                'SELECT path FROM jobs WHERE status = ? ORDER BY path LIMIT 1', (PENDING,)
+            ).fetchone()
+            if row is None:
+                return None
+            self.connection.execute(
+                'UPDATE jobs SET status = ?, worker = ?, attempts = attempts + 1, started = ?, error = NULL '
+                'WHERE path = ?',
+                (RUNNING, worker, time.time(), row[0])
+            )
+        return row[0]
+
+    def finish(self, path, frames, sample_rate):
+        """ Marks the job of path as done, with the length of its audio """
+        with self.transaction():
+            self.connection.execute(
+                'UPDATE jobs SET status = ?, frames = ?, sample_rate = ?, finished = ? WHERE path = ?',
+                (DONE, frames, sample_rate, time.time(), path)
+            )
+
+    def fail(self, path, error):
+        """ Marks the job of path as failed with the error message """
+        with self.transaction():
+            self.connection.execute(
+                'UPDATE jobs SET status = ?, finished = ?, error = ? WHERE path = ?',
+                (FAILED, time.time(), error, path)
+            )
+
+    def counts(self):
+        """ Returns the number of jobs of each status """
+        counts = dict.fromkeys([PENDING, RUNNING, DONE, FAILED], 0)
+        counts.update(self.connection.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+        return counts
+
+    def done_since(self, start):
+        """ Returns the number of jobs finished since the time start and the
+        seconds of audio they had.
+        """
+        files, seconds = self.connection.execute(
+            'SELECT COUNT(*), COALESCE(SUM(CAST(frames AS REAL) / sample_rate), 0) '
+            'FROM jobs WHERE status = ? AND finished >= ?',
+            (DONE, start)
+        ).fetchone()
+        return files, seconds
+
+    def failures(self, limit=10):
+        """ Returns (path, error) of up to limit failed jobs """
+        return self.connection.execute(
+            'SELECT path, error FROM jobs WHERE status = ? LIMIT ?', (FAILED, limit)
+        ).fetchall()
+
+    def transaction(self):
+        return _Transaction(self.connection)
+
+
+class _Transaction:
+    # BEGIN IMMEDIATE takes the write lock at once, so two workers never
+    # claim the same job
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        self.connection.execute('BEGIN IMMEDIATE')
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.connection.execute('COMMIT' if exc_type is None else 'ROLLBACK')
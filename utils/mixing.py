@@ -0,0 +1,64 @@
+import torch
+from torch.utils.data.dataloader import default_collate
+
+
+def rms(audio):
+    """ computes the RMS of each signal of a (..., time) tensor
+    """
+    return torch.sqrt(torch.mean(audio ** 2, dim=-1))
+
+
+class SourceMixer:
+    """ Builds the PodcastMix mixtures of a whole batch.
+
+    The music of each example is scaled so that its RMS is `gain` times the
+    RMS of the speech, and the mixture is the average of both sources, as done
+    item by item in PodcastMixDataloader.
+
+    If a Resampler is given, the sources are first resampled all together,
+    as a single (batch * 2, time) minibatch.
+    """
+
+    def __init__(self, resampler=None):
+        self.resampler = resampler
+
+    def __call__(self, sources, gains):
+        """
+        Args:
+          sources: (batch, 2, time) tensor with the speech and the music
+            before the gain is applied
+          gains: (batch,) tensor with the music gain of each example,
+            relative to the speech RMS
+
+        Return: the (batch, time) mixtures and the (batch, 2, time) sources
+          with the music scaled.
+        """
+        if self.resampler is not None:
+            batch_size, n_src, _ = sources.shape
+            # no-op once the weights are on the device of the sources
+            self.resampler.to(sources.device)
+            sources = self.resampler.forward(
+                sources.reshape(batch_size * n_src, -1)
+            ).reshape(batch_size, n_src, -1)
+        speech = sources[:, 0]
+        music = sources[:, 1]
+        # gain based on RMS in order to have RMS(speech) >= RMS(music)
+        reduction_factor = rms(speech) / rms(music)
+        music_gain = gains.to(sources.dtype) * reduction_factor
+        music = music_gain.unsqueeze(-1) * music
+        # compute the mixture as the avg of both sources
+        mixture = 0.5 * (speech + music)
+        return mixture, torch.stack([speech, music], dim=1)
+
+
+class MixCollate:
+    """ collate_fn mixing the (sources, gain) examples returned by
+    PodcastMixDataloader(raw_sources=True) once per batch.
+    """
+
+    def __init__(self, mixer):
+        self.mixer = mixer
+
+    def __call__(self, batch):
+        sources, gains = default_collate(batch)
+        return self.mixer(sources, gains)
@@ -0,0 +1,159 @@
+import os
+import random
+
+import numpy as np
+import pandas as pd
+import torch
+import torchaudio
+
+
+def energy_index_path(csv_dir):
+    return os.path.join(csv_dir, 'music_energy.npz')
+
+
+def frame_energy(audio_signal, resolution):
+    """ Computes the RMS of consecutive frames of `resolution` samples of a
+    mono signal. The last frame may be shorter than the others.
+    """
+    audio_signal = np.asarray(audio_signal, dtype=np.float64)
+    num_frames = int(np.ceil(len(audio_signal) / resolution))
+    padded = np.zeros(num_frames * resolution)
+    padded[:len(audio_signal)] = audio_signal ** 2
+    frame_lengths = np.full(num_frames, resolution)
+    frame_lengths[-1] = len(audio_signal) - (num_frames - 1) * resolution
+    return np.sqrt(padded.reshape(num_frames, resolution).sum(axis=1) / frame_lengths)
+
+
+def build_energy_index(csv_dir, resolution=11025, audio_store=None):
+    """ Computes the frame energy map of every track in music.csv and saves
+    them in music_energy.npz, next to the csv.
+
+    Parameters:
+    - csv_dir (str) : metadata directory of the partition
+    - resolution (int) : number of samples of each energy frame
+    - audio_store (AudioStore) : optional store to read the tracks from
+    instead of decoding them
+
+    Returns:
+    - path (str) : path of the written index
+    """
+    torchaudio.set_audio_backend(backend='soundfile')
+    df_music = pd.read_csv(os.path.join(csv_dir, 'music.csv'), engine='python')
+    energies = []
+    frame_ptr = [0]
+    for music_path in df_music['music_path']:
+        if audio_store is not None:
+            audio_signal = audio_store.load(music_path)
+        else:
+            audio_signal, _ = torchaudio.load(music_path)
+        # same mono reduction as the dataloader
+        if len(audio_signal) == 2:
+            audio_signal = torch.mean(audio_signal, dim=0)
+        else:
+            audio_signal = audio_signal[0]
+        energy = frame_energy(audio_signal.numpy(), resolution)
+        energies.append(energy.astype(np.float32))
+        frame_ptr.append(frame_ptr[-1] + len(energy))
+
+    path = energy_index_path(csv_dir)
+    np.savez(
+        path,
+        resolution=np.int64(resolution),
+        paths=np.array(df_music['music_path'].tolist(), dtype=str),
+        lengths=df_music['length'].values.astype(np.int64),
+        frame_ptr=np.array(frame_ptr, dtype=np.int64),
+        energy=np.concatenate(energies) if energies else np.zeros(0, np.float32)
+    )
+    return path
+
+
+def merge_intervals(low, high):
+    """ Merges the closed intervals [low, high] (sorted by low and high),
+    dropping the empty ones. Returns a (num_intervals, 2) array.
+    """
+    merged = []
+    for lo, hi in zip(low, high):
+        if lo > hi:
+            continue
+        if merged and lo <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], hi)
+        else:
+            merged.append([lo, hi])
+    return np.array(merged, dtype=np.int64).reshape(-1, 2)
+
+
+class MusicEnergyIndex:
+    """ Non-silent regions of the music tracks, computed from the frame
+    energies written by `build_energy_index`.
+
+    A segment is known to be non-silent when it fully covers at least one
+    frame with an energy above `threshold`, so offsets can be drawn directly
+    among those positions instead of reading random segments until one is
+    not silent.
+    """
+
+    def __init__(self, csv_dir, music_paths, threshold=0.0):
+        data = np.load(energy_index_path(csv_dir))
+        if not np.array_equal(data['paths'], np.array(list(music_paths), dtype=str)):
+            raise ValueError(
+                "music_energy.npz does not match music.csv, build it again"
+            )
+        self.resolution = int(data['resolution'])
+        self.lengths = data['lengths']
+        self.frame_ptr = data['frame_ptr']
+        self.energy = data['energy']
+        self.threshold = threshold
+        self.non_silent_tracks = np.array([
+            bool(np.any(self.track_energy(i) > threshold))
+            for i in range(len(self.lengths))
+        ])
+        # valid offsets of each track, computed on first use
+        self._runs = {}
+
+    def track_energy(self, track_idx):
+        return self.energy[self.frame_ptr[track_idx]:self.frame_ptr[track_idx + 1]]
+
+    def runs(self, track_idx, segment_frames):
+        """ Returns the merged intervals [start, end] of the offsets that give
+        a non-silent segment, the cumulative number of offsets in them, and the
+        fraction of all the offsets whose segment is not silent.
+        """
+        key = (track_idx, segment_frames)
+        if key not in self._runs:
+            length = int(self.lengths[track_idx])
+            max_offset = length - segment_frames
+            frames = np.nonzero(self.track_energy(track_idx) > self.threshold)[0]
+            starts = frames * self.resolution
+            ends = np.minimum(starts + self.resolution, length)
+            # offsets s such that [s, s + segment_frames) covers the frame
+            runs = merge_intervals(
+                np.maximum(ends - segment_frames, 0),
+                np.minimum(starts, max_offset)
+            )
+            # offsets s such that [s, s + segment_frames) overlaps the frame,
+            # which is what the random search would accept (up to the
+            # silent samples inside the frame)
+            overlaps = merge_intervals(
+                np.maximum(starts - segment_frames + 1, 0),
+                np.minimum(ends - 1, max_offset)
+            )
+            fraction = np.sum(overlaps[:, 1] - overlaps[:, 0] + 1) / max(max_offset + 1, 1)
+            self._runs[key] = (runs, np.cumsum(runs[:, 1] - runs[:, 0] + 1), fraction)
+        return self._runs[key]
+
+    def sample_offset(self, track_idx, segment_frames):
+        """ Draws a random offset that gives a non-silent segment.
+
+        Returns (tuple):
+        - offset (int) : offset in frames, None if the track is shorter than
+        the segment or if no offset is guaranteed to be non-silent
+        - fraction (float) : estimated fraction of the offsets of the track
+        that give a non-silent segment
+        """
+        runs, counts, fraction = self.runs(track_idx, segment_frames)
+        if len(runs) == 0:
+            return None, fraction
+        choice = random.randrange(int(counts[-1]))
+        run = int(np.searchsorted(counts, choice, side='right'))
+        previous = int(counts[run - 1]) if run > 0 else 0
+        return int(runs[run, 0]) + choice - previous, fraction
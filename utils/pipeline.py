@@ -0,0 +1,57 @@
+import queue
+import threading
+
+_END = object()
+
+
+class _Error:
+    def __init__(self, error):
+        self.error = error
+
+
+def background(iterable, max_queued=4):
+    """ Iterates over iterable in a thread, at most max_queued items ahead
+    of the consumer, so that producing and consuming the items overlap with
+    a bounded memory. Chaining them gives a pipeline whose stages run
+    concurrently, e.g. decoding, separation and encoding of the audio.
+
+    The thread starts with the iteration. An exception of the iterable is
+    raised in the consumer, and the thread stops if the consumer stops
+    iterating.
+
+    Returns:
+    - generator of the items of iterable
+    """
+    items = queue.Queue(max_queued)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+            put(_END)
+        except BaseException as error:
+            put(_Error(error))
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = items.get()
+            if item is _END:
+                return
+            if isinstance(item, _Error):
+                raise item.error
+            yield item
+    finally:
+        stop.set()
@@ -0,0 +1,121 @@
+import os
+import random
+
+import numpy as np
+import pandas as pd
+
+
+INDEX_VERSION = 2
+
+
+def csv_signature(csv_path):
+    """ Size and modification time of a csv, to detect stale indexes """
+    stat = os.stat(csv_path)
+    return np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+
+class PodcastMixIndex:
+    """ Compact columnar view of speech.csv and music.csv.
+
+    The utterances are grouped by speaker in CSR layout: the utterances of
+    speaker s are utterance_paths[speaker_ptr[s]:speaker_ptr[s + 1]], in the
+    order of the csv. speaker_order lists the speakers in order of first
+    appearance in the csv.
+    Every column is a flat NumPy array (the paths are fixed width unicode
+    arrays, not Python objects), so the pages of the index are shared
+    copy-on-write by forked DataLoader workers instead of being touched by
+    reference counting.
+    """
+
+    columns = [
+        'speaker_ids', 'speaker_ptr', 'speaker_order', 'utterance_paths',
+        'utterance_lengths', 'row_speaker', 'track_paths', 'track_lengths'
+    ]
+
+    def __init__(self, speaker_ids, speaker_ptr, speaker_order, utterance_paths,
+                 utterance_lengths, row_speaker, track_paths, track_lengths):
+        self.speaker_ids = speaker_ids
+        self.speaker_ptr = speaker_ptr
+        self.speaker_order = speaker_order
+        # position of each speaker in speaker_order
+        self.speaker_position = np.argsort(speaker_order)
+        self.utterance_paths = utterance_paths
+        self.utterance_lengths = utterance_lengths
+        self.row_speaker = row_speaker
+        self.track_paths = track_paths
+        self.track_lengths = track_lengths
+
+    @classmethod
+    def from_csv(cls, csv_dir):
+        df_speech = pd.read_csv(os.path.join(csv_dir, 'speech.csv'))
+        df_music = pd.read_csv(os.path.join(csv_dir, 'music.csv'))
+
+        speaker_ids, first_rows, row_speaker = np.unique(
+            df_speech['speaker_id'].astype(str).values, return_index=True, return_inverse=True
+        )
+        # stable sort keeps the csv order of the utterances of each speaker
+        order = np.argsort(row_speaker, kind='stable')
+        speaker_ptr = np.zeros(len(speaker_ids) + 1, dtype=np.int64)
+        speaker_ptr[1:] = np.cumsum(np.bincount(row_speaker, minlength=len(speaker_ids)))
+        speech_paths = np.array(df_speech['speech_path'].tolist(), dtype=str)
+        speech_lengths = df_speech['length'].values.astype(np.int64)
+        return cls(
+            speaker_ids=np.array(speaker_ids, dtype=str),
+            speaker_ptr=speaker_ptr,
+            speaker_order=np.argsort(first_rows, kind='stable'),
+            utterance_paths=speech_paths[order],
+            utterance_lengths=speech_lengths[order],
+            row_speaker=row_speaker.astype(np.int32),
+            track_paths=np.array(df_music['music_path'].tolist(), dtype=str),
+            track_lengths=df_music['length'].values.astype(np.int64)
+        )
+
+    @classmethod
+    def load(cls, csv_dir, cache_name='podcastmix_index.npz'):
+        """ Loads the index cached in csv_dir, building it (and trying to
+        cache it) when it is missing or older than the csv files.
+        """
+        cache_path = os.path.join(csv_dir, cache_name)
+        signature = np.concatenate([
+            [INDEX_VERSION],
+            csv_signature(os.path.join(csv_dir, 'speech.csv')),
+            csv_signature(os.path.join(csv_dir, 'music.csv'))
+        ])
+        if os.path.isfile(cache_path):
+            data = np.load(cache_path)
+            if np.array_equal(data['signature'], signature):
+                return cls(**{column: data[column] for column in cls.columns})
+        index = cls.from_csv(csv_dir)
+        try:
+            tmp_path = cache_path + '.{}.tmp.npz'.format(os.getpid())
+            np.savez(tmp_path, signature=signature, **{
+                column: getattr(index, column) for column in cls.columns
+            })
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            # read-only dataset directory, the index is just not cached
+            pass
+        return index
+
+    @property
+    def num_speakers(self):
+        return len(self.speaker_ids)
+
+    def random_utterance(self, speaker):
+        """ Returns the position of a random utterance of speaker. The draw is
+        the one of DataFrame.sample() on the rows of the speaker, from the
+        global numpy random generator, so seeded runs pick the same
+        utterances as with the pandas dataframes.
+        """
+        start = int(self.speaker_ptr[speaker])
+        count = int(self.speaker_ptr[speaker + 1]) - start
+        return start + int(np.random.choice(count, size=1, replace=False)[0])
+
+    def random_other_speaker(self, speaker):
+        """ Returns a random speaker different from speaker. The draw is the
+        one of random.sample(list_of_speakers, 1) on the other speakers in
+        order of first appearance, as with the pandas dataframes.
+        """
+        position = int(self.speaker_position[speaker])
+        other = random.sample(range(self.num_speakers - 1), 1)[0]
+        return int(self.speaker_order[other + 1 if other >= position else other])
@@ -0,0 +1,32 @@
+from contextlib import nullcontext
+import torch
+
+PRECISIONS = ['32', '16', 'bf16']
+
+
+def autocast(precision, device_type='cuda'):
+    """ Context manager running the operations of the models in reduced
+    precision, where it is safe (see torch autocast).
+
+    Parameters:
+    - precision (str) : '32' (no autocast), '16' (float16) or 'bf16'
+        (bfloat16)
+    - device_type (str) : 'cuda' or 'cpu'
+
+    Returns:
+    - context manager
+
+    torch < 1.10 only has float16 autocast on the GPU, ValueError is raised
+    for the other combinations.
+    """
+    precision = str(precision)
+    if precision not in PRECISIONS:
+        raise ValueError('precision must be one of {}, got {}'.format(PRECISIONS, precision))
+    if precision == '32':
+        return nullcontext()
+    dtype = torch.float16 if precision == '16' else torch.bfloat16
+    if hasattr(torch, 'autocast'):
+        return torch.autocast(device_type, dtype=dtype)
+    if device_type != 'cuda' or dtype != torch.float16:
+        raise ValueError('{} autocast on {} needs torch >= 1.10'.format(precision, device_type))
+    return torch.cuda.amp.autocast()
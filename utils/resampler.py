@@ -1,8 +1,175 @@
+import math
+import os
 import torch
+import torch.fft
 import numpy as np
 from scipy import special
 
 
+def compute_kernel(input_sr, output_sr, np_dtype, num_zeros, cutoff_ratio,
+                   filter, beta):
+    """
+    Computes the (output_sr, input_sr, kernel_width) weights of a Resampler
+    with the 'general' layout, for input_sr and output_sr without common
+    factors. See Resampler.__init__ for the meaning of the arguments.
+    """
+    # Define one 'block' of samples `input_sr` input samples
+    # and `output_sr` output samples.  We can divide up
+    # the samples into these blocks and have the blocks be
+    # in correspondence.
+
+    # The sinc function will have, on average, `zeros_per_block`
+    # zeros per block.
+    zeros_per_block = min(input_sr, output_sr) * cutoff_ratio
+
+    # The convolutional kernel size will be n = (blocks_per_side*2 + 1),
+    # i.e. we add that many blocks on each side of the central block.  The
+    # window radius (defined as distance from center to edge)
+    # is `blocks_per_side` blocks.  This ensures that each sample in the
+    # central block can "see" all the samples in its window.
+    #
+    # Assuming the following division is not exact, adding 1
+    # will have the same effect as rounding up.
+    # blocks_per_side = 1 + int(num_zeros / zeros_per_block)
+    blocks_per_side = int(np.ceil(num_zeros / zeros_per_block))
+
+    kernel_width = 2*blocks_per_side + 1
+
+    # We want the weights as used by torch's conv1d code; format is
+    #  (out_channels, in_channels, kernel_width)
+    # https://pytorch.org/docs/stable/nn.functional.html
+
+    # Computations involving time will be in units of 1 block.
+    # Actually this is the same as the `canonical` time axis
+    # since each block has input_sr
+    # input samples, so it would be one of whatever time unit we are using
+    window_radius_in_blocks = blocks_per_side
+
+    # The `times` below will end up being the args to the sinc
+    #  function.
+    # For the shapes of the things below, look at the args to
+    # `view`.  The terms
+    # below will get expanded to shape (output_sr, input_sr,
+    # kernel_width) through broadcasting
+    # We want it so that, assuming input_sr == output_sr,
+    # along the diagonal of the central block we have t == 0.
+    # The signs of the output_sr and input_sr terms need to be
+    # opposite.  The
+    # sign that the kernel_width term needs to be will depend
+    # on whether it's
+    # convolution or correlation, and the logic is tricky.. I
+    # will just find
+    # which sign works.
+
+    times = (
+        np.arange(output_sr, dtype=np_dtype).reshape(
+            (output_sr, 1, 1)
+        ) / output_sr -
+        np.arange(input_sr, dtype=np_dtype).reshape(
+            (1, input_sr, 1)
+        ) / input_sr -
+        (np.arange(kernel_width, dtype=np_dtype).reshape(
+            (1, 1, kernel_width)
+        ) - blocks_per_side))
+
+    def hann_window(a):
+        """
+        hann_window returns the Hann window on [-1,1], which is zero
+        if a < -1 or a > 1, and otherwise 0.5 + 0.5 cos(a*pi).
+        This is applied elementwise to a, which should be a NumPy array.
+
+        The heaviside function returns (a > 0 ? 1 : 0).
+        """
+        return np.heaviside(
+            1 - np.abs(a),
+            0.0
+        ) * (0.5 + 0.5 * np.cos(a * np.pi))
+
+    def kaiser_window(a, beta):
+        w = special.i0(beta * np.sqrt(
+            np.clip(1 - ((a - 0.0) / 1.0) ** 2.0, 0.0, 1.0)
+        )) / special.i0(beta)
+        return np.heaviside(1 - np.abs(a), 0.0) * w
+
+    # The weights below are a sinc function times a Hann-window function.
+    # Multiplication by zeros_per_block normalizes the sinc function
+    # (to compensate for scaling on the x-axis), so that the integral is 1.
+    # Division by input_sr normalizes the input function. Think of the
+    # input
+    # as a stream of dirac deltas passing through a low pass filter:
+    # in order to have the same magnitude as the original input function,
+    # we need to divide by the number of those deltas per unit time.
+    if filter == 'hann':
+        weights = (np.sinc(times * zeros_per_block)
+                   * hann_window(times / window_radius_in_blocks)
+                   * zeros_per_block / input_sr)
+    else:
+        weights = (np.sinc(times * zeros_per_block)
+                   * kaiser_window(times / window_radius_in_blocks, beta)
+                   * zeros_per_block / input_sr)
+
+    return weights
+
+
+def kernel_cache_dir():
+    """
+    Directory of the on-disk cache of the kernels, from the
+    RESAMPLER_CACHE_DIR environment variable (~/.cache/podcastmix/resampler
+    by default). An empty value disables the on-disk cache.
+    """
+    return os.environ.get(
+        'RESAMPLER_CACHE_DIR',
+        os.path.join(os.path.expanduser('~'), '.cache', 'podcastmix', 'resampler')
+    )
+
+
+# kernels already computed or loaded by this process
+_kernel_cache = {}
+
+
+def load_kernel(input_sr, output_sr, np_dtype, num_zeros, cutoff_ratio,
+                filter, beta):
+    """
+    Same as compute_kernel, but the kernels are memoized in the process and
+    in kernel_cache_dir(), so that other Resampler instances, DataLoader
+    workers and scripts reuse them. The returned array must not be modified.
+    """
+    key = (input_sr, output_sr, filter, num_zeros, float(cutoff_ratio),
+           float(beta), np.dtype(np_dtype).name)
+    if key in _kernel_cache:
+        return _kernel_cache[key]
+    cache_dir = kernel_cache_dir()
+    cache_path = None
+    if cache_dir:
+        cache_path = os.path.join(
+            cache_dir,
+            '{}_{}_{}_{}_{!r}_{!r}_{}.npy'.format(*key)
+        )
+    weights = None
+    if cache_path is not None and os.path.isfile(cache_path):
+        try:
+            weights = np.load(cache_path)
+        except (OSError, ValueError):
+            # truncated or unreadable file, computed again below
+            weights = None
+    if weights is None:
+        weights = compute_kernel(input_sr, output_sr, np_dtype, num_zeros,
+                                 cutoff_ratio, filter, beta)
+        if cache_path is not None:
+            try:
+                os.makedirs(cache_dir, exist_ok=True)
+                # written under a temporary name and renamed, so that other
+                # processes never read a partial file
+                tmp_path = cache_path + '.{}.tmp.npy'.format(os.getpid())
+                np.save(tmp_path, weights)
+                os.replace(tmp_path, cache_path)
+            except OSError:
+                # read-only cache directory, the kernel is just not cached
+                pass
+    _kernel_cache[key] = weights
+    return weights
+
+
 class Resampler(torch.nn.Module):
     """
     Efficiently resample audio signals
@@ -16,12 +183,23 @@ class Resampler(torch.nn.Module):
     parameters that align with the librosa api
     """
 
+    # measured slowness of each path per multiplication, relative to the
+    # conv1d of the 'general' type: the strided single channel convolutions
+    # of the integer types are much slower (see benchmark_resampler.py)
+    fft_cost_factor = 2.0
+    conv_cost_factors = {
+        'general': 1.0,
+        'integer_downsample': 20.0,
+        'integer_upsample': 20.0
+    }
+
     def __init__(self,
                  input_sr, output_sr, dtype,
                  num_zeros=64,
                  cutoff_ratio=0.95,
                  filter='kaiser',
-                 beta=14.0):
+                 beta=14.0,
+                 backend='auto'):
         super().__init__()  # init the base class
         """
         This creates an object that can apply a symmetric FIR filter
@@ -44,6 +222,11 @@ class Resampler(torch.nn.Module):
              Nyquist frequency.
           filter: one of ['kaiser', 'kaiser_best', 'kaiser_fast', 'hann']
           beta: parameter for 'kaiser' filter
+          backend: one of ['auto', 'conv', 'fft']. 'conv' applies the
+             filter with conv1d, 'fft' multiplies the spectra of the blocks
+             and of the filter (overlap-save along the blocks). Both give
+             the same output up to rounding errors. 'auto' picks the
+             cheapest one for each call, see fft_is_faster.
 
         You can think of this algorithm as dividing up the signals
         (input,output) into blocks where there are `input_sr` input
@@ -53,6 +236,8 @@ class Resampler(torch.nn.Module):
 
         """
         assert isinstance(input_sr, int) and isinstance(output_sr, int)
+        assert backend in ['auto', 'conv', 'fft']
+        self.backend = backend
         if input_sr == output_sr:
             self.resample_type = 'trivial'
             return
@@ -85,108 +270,16 @@ class Resampler(torch.nn.Module):
             cutoff_ratio = 0.85
             filter = 'kaiser'
 
-        # Define one 'block' of samples `input_sr` input samples
-        # and `output_sr` output samples.  We can divide up
-        # the samples into these blocks and have the blocks be
-        # in correspondence.
-
-        # The sinc function will have, on average, `zeros_per_block`
-        # zeros per block.
-        zeros_per_block = min(input_sr, output_sr) * cutoff_ratio
-
-        # The convolutional kernel size will be n = (blocks_per_side*2 + 1),
-        # i.e. we add that many blocks on each side of the central block.  The
-        # window radius (defined as distance from center to edge)
-        # is `blocks_per_side` blocks.  This ensures that each sample in the
-        # central block can "see" all the samples in its window.
-        #
-        # Assuming the following division is not exact, adding 1
-        # will have the same effect as rounding up.
-        # blocks_per_side = 1 + int(num_zeros / zeros_per_block)
-        blocks_per_side = int(np.ceil(num_zeros / zeros_per_block))
-
-        kernel_width = 2*blocks_per_side + 1
-
-        # We want the weights as used by torch's conv1d code; format is
-        #  (out_channels, in_channels, kernel_width)
-        # https://pytorch.org/docs/stable/nn.functional.html
-        weights = torch.tensor((
-            output_sr,
-            input_sr,
-            kernel_width
-        ), dtype=dtype)
-
-        # Computations involving time will be in units of 1 block.
-        # Actually this is the same as the `canonical` time axis
-        # since each block has input_sr
-        # input samples, so it would be one of whatever time unit we are using
-        window_radius_in_blocks = blocks_per_side
-
-        # The `times` below will end up being the args to the sinc
-        #  function.
-        # For the shapes of the things below, look at the args to
-        # `view`.  The terms
-        # below will get expanded to shape (output_sr, input_sr,
-        # kernel_width) through broadcasting
-        # We want it so that, assuming input_sr == output_sr,
-        # along the diagonal of the central block we have t == 0.
-        # The signs of the output_sr and input_sr terms need to be
-        # opposite.  The
-        # sign that the kernel_width term needs to be will depend
-        # on whether it's
-        # convolution or correlation, and the logic is tricky.. I
-        # will just find
-        # which sign works.
-
-        times = (
-            np.arange(output_sr, dtype=np_dtype).reshape(
-                (output_sr, 1, 1)
-            ) / output_sr -
-            np.arange(input_sr, dtype=np_dtype).reshape(
-                (1, input_sr, 1)
-            ) / input_sr -
-            (np.arange(kernel_width, dtype=np_dtype).reshape(
-                (1, 1, kernel_width)
-            ) - blocks_per_side))
-
-        def hann_window(a):
-            """
-            hann_window returns the Hann window on [-1,1], which is zero
-            if a < -1 or a > 1, and otherwise 0.5 + 0.5 cos(a*pi).
-            This is applied elementwise to a, which should be a NumPy array.
-
-            The heaviside function returns (a > 0 ? 1 : 0).
-            """
-            return np.heaviside(
-                1 - np.abs(a),
-                0.0
-            ) * (0.5 + 0.5 * np.cos(a * np.pi))
-
-        def kaiser_window(a, beta):
-            w = special.i0(beta * np.sqrt(
-                np.clip(1 - ((a - 0.0) / 1.0) ** 2.0, 0.0, 1.0)
-            )) / special.i0(beta)
-            return np.heaviside(1 - np.abs(a), 0.0) * w
-
-        # The weights below are a sinc function times a Hann-window function.
-        # Multiplication by zeros_per_block normalizes the sinc function
-        # (to compensate for scaling on the x-axis), so that the integral is 1.
-        # Division by input_sr normalizes the input function. Think of the
-        # input
-        # as a stream of dirac deltas passing through a low pass filter:
-        # in order to have the same magnitude as the original input function,
-        # we need to divide by the number of those deltas per unit time.
-        if filter == 'hann':
-            weights = (np.sinc(times * zeros_per_block)
-                       * hann_window(times / window_radius_in_blocks)
-                       * zeros_per_block / input_sr)
-        else:
-            weights = (np.sinc(times * zeros_per_block)
-                       * kaiser_window(times / window_radius_in_blocks, beta)
-                       * zeros_per_block / input_sr)
+        weights = load_kernel(input_sr, output_sr, np_dtype, num_zeros,
+                              cutoff_ratio, filter, beta)
+        kernel_width = weights.shape[2]
+        blocks_per_side = (kernel_width - 1) // 2
 
         self.input_sr = input_sr
         self.output_sr = output_sr
+        # each block of output depends on the input blocks that are up to
+        # blocks_per_side blocks away, see StreamingResampler
+        self.blocks_per_side = blocks_per_side
 
         # weights has dim (output_sr, input_sr, kernel_width).
         # If output_sr == 1, we can fold the input_sr into the
@@ -227,6 +320,118 @@ class Resampler(torch.nn.Module):
             self.weights,
             requires_grad=False)
 
+        # largest FFT size of the overlap-save along the blocks: each FFT
+        # gives nfft - kernel_width + 1 output blocks
+        self.kernel_width = kernel_width
+        self.nfft = max(64, 2 ** int(np.ceil(np.log2(8 * (kernel_width - 1)))))
+        # spectra of the filter, by (nfft, device, dtype)
+        self._weights_fft = {}
+
+    def fft_size(self, num_blocks):
+        """ FFT size for a signal of num_blocks blocks: short signals are
+        done with a single FFT as small as possible.
+        """
+        needed = 2 ** int(np.ceil(np.log2(num_blocks + self.kernel_width - 1)))
+        return min(self.nfft, needed)
+
+    def general_weights(self):
+        """
+        Returns the filter as the (output_sr, input_sr, kernel_width) weights
+        of the 'general' conv1d, whatever the resample_type: output block j
+        is the correlation of these weights with the input blocks j -
+        blocks_per_side to j + blocks_per_side.
+        """
+        if self.resample_type == 'integer_downsample':
+            return self.weights.view(
+                self.kernel_width, self.input_sr
+            ).t().unsqueeze(0)
+        elif self.resample_type == 'integer_upsample':
+            return self.weights.view(
+                self.kernel_width, self.output_sr
+            ).flip(0).t().unsqueeze(1)
+        return self.weights
+
+    def fft_is_faster(self, num_blocks):
+        """
+        Cost model of both backends for signals of num_blocks blocks, in
+        real multiplications per signal. The FFTs are counted as
+        2.5 * n * log2(n) and the complex products as 4 real ones, and both
+        costs are scaled by the measured efficiency of each path.
+        """
+        conv_cost = self.conv_cost_factors[self.resample_type] * (
+            self.output_sr * self.input_sr * self.kernel_width * num_blocks
+        )
+        nfft = self.fft_size(max(num_blocks, 1))
+        segment = nfft - self.kernel_width + 1
+        num_segments = math.ceil(num_blocks / segment)
+        fft_cost = num_segments * (
+            (self.input_sr + self.output_sr) * 2.5 * nfft * math.log2(nfft)
+            + 4 * self.output_sr * self.input_sr * (nfft // 2 + 1)
+        )
+        return self.fft_cost_factor * fft_cost < conv_cost
+
+    def _correlate_fft(self, blocks):
+        """
+        Correlates (minibatch_size, input_sr, num_blocks) blocks with the
+        general_weights using overlap-save FFTs along the blocks, with the
+        same zero padding as the conv1d of the 'general' type.
+        Returns the (minibatch_size, output_sr, num_blocks) output blocks.
+        """
+        minibatch_size, _, num_blocks = blocks.shape
+        kernel_width = self.kernel_width
+        nfft = self.fft_size(num_blocks)
+        segment = nfft - kernel_width + 1
+        num_segments = math.ceil(num_blocks / segment)
+        key = (nfft, blocks.device, blocks.dtype)
+        if key not in self._weights_fft:
+            # correlation is the convolution with the flipped filter
+            self._weights_fft[key] = torch.fft.rfft(
+                self.general_weights().flip(2).to(blocks.device), n=nfft
+            )
+        weights_fft = self._weights_fft[key]
+        # left zero padding of the convolution, and right one up to a
+        # whole number of segments
+        blocks = torch.nn.functional.pad(blocks, (
+            self.blocks_per_side,
+            num_segments * segment + kernel_width - 1 - num_blocks - self.blocks_per_side
+        ))
+        frames = blocks.unfold(2, nfft, segment)
+        frames_fft = torch.fft.rfft(frames, n=nfft)
+        output = torch.fft.irfft(
+            torch.einsum('bisf,oif->bosf', frames_fft, weights_fft),
+            n=nfft
+        )
+        # the first kernel_width - 1 samples of each frame wrap around
+        output = output[..., kernel_width - 1:].reshape(
+            minibatch_size, self.output_sr, num_segments * segment
+        )
+        return output[..., :num_blocks]
+
+    def _forward_fft(self, data):
+        """ Same as forward, computed with _correlate_fft """
+        (minibatch_size, seq_len) = data.shape
+        if self.resample_type == 'general':
+            num_blocks = seq_len // self.input_sr
+            if num_blocks == 0:
+                raise RuntimeError("Signal is too short to resample")
+            num_outputs = num_blocks
+            data = data[:, 0:(num_blocks*self.input_sr)]
+        else:
+            # the strided convolutions see the last incomplete block too,
+            # but do not produce an output for it
+            num_blocks = -(-seq_len // self.input_sr)
+            num_outputs = seq_len // self.input_sr
+            data = torch.nn.functional.pad(
+                data, (0, num_blocks * self.input_sr - seq_len)
+            )
+        blocks = data.reshape(
+            minibatch_size, num_blocks, self.input_sr
+        ).transpose(1, 2)
+        output = self._correlate_fft(blocks)[..., :num_outputs]
+        return output.transpose(1, 2).reshape(
+            minibatch_size, num_outputs * self.output_sr
+        )
+
     @torch.no_grad()
     def forward(self, data):
         """
@@ -246,7 +451,11 @@ class Resampler(torch.nn.Module):
         """
         if self.resample_type == 'trivial':
             return data
-        elif self.resample_type == 'integer_downsample':
+        if self.backend == 'fft' or (
+                self.backend == 'auto' and
+                self.fft_is_faster(data.shape[1] // self.input_sr)):
+            return self._forward_fft(data)
+        if self.resample_type == 'integer_downsample':
             (minibatch_size, seq_len) = data.shape
             # will be shape (minibatch_size, in_channels, seq_len) 
             # with in_channels == 1
@@ -294,3 +503,143 @@ class Resampler(torch.nn.Module):
             return data.transpose(1, 2).contiguous().view(
                 minibatch_size, num_blocks * self.output_sr
             )
+
+
+    def output_length(self, seq_len):
+        """
+        Number of output samples of forward_batch for a signal of seq_len
+        samples: ceil(seq_len * output_sr / input_sr).
+        """
+        if self.resample_type == 'trivial':
+            return seq_len
+        return -(-seq_len * self.output_sr // self.input_sr)
+
+    @torch.no_grad()
+    def forward_batch(self, signals, lengths=None):
+        """
+        Resample signals of different lengths with a single forward.
+
+        Each signal is zero padded up to a whole number of blocks, so its
+        last samples are resampled instead of dropped, and signals shorter
+        than a block are accepted.
+
+        Args:
+         signals: a list of 1-D torch.Tensor, or a (minibatch_size, seq_len)
+           torch.Tensor where signal i is signals[i, :lengths[i]].
+         lengths: the length of each signal of a padded tensor, all of them
+           are seq_len if not given.
+
+        Return: a (minibatch_size, max(output_lengths)) torch.Tensor, zero
+         padded after the end of each output, and the output_lengths as a
+         (minibatch_size,) int64 torch.Tensor.
+        """
+        if isinstance(signals, (list, tuple)):
+            lengths = torch.tensor([signal.shape[-1] for signal in signals])
+            signals = torch.nn.utils.rnn.pad_sequence(signals, batch_first=True)
+        else:
+            if lengths is None:
+                lengths = torch.full((signals.shape[0],), signals.shape[1], dtype=torch.int64)
+            lengths = torch.as_tensor(lengths, dtype=torch.int64)
+            # the padding of the tensor may hold anything
+            mask = torch.arange(signals.shape[1]) < lengths.unsqueeze(1)
+            signals = signals * mask.to(signals.device, signals.dtype)
+        if self.resample_type == 'trivial':
+            return signals, lengths
+        seq_len = signals.shape[1]
+        num_blocks = max(1, -(-seq_len // self.input_sr))
+        signals = torch.nn.functional.pad(
+            signals, (0, num_blocks * self.input_sr - seq_len)
+        )
+        output = self.forward(signals)
+        output_lengths = (lengths * self.output_sr + self.input_sr - 1) // self.input_sr
+        output = output[:, :int(output_lengths.max())]
+        # the filter spreads the end of each signal over the padding
+        mask = torch.arange(output.shape[1]) < output_lengths.unsqueeze(1)
+        return output * mask.to(output.device, output.dtype), output_lengths
+
+class StreamingResampler:
+    """
+    Resamples a signal that comes in chunks of any length with a Resampler.
+
+    The output blocks are produced as soon as all the input blocks they
+    depend on (blocks_per_side blocks on each side) have been seen. Between
+    calls, only those input blocks and the samples that do not fill a block
+    yet are kept, so the memory used does not depend on the length of the
+    signal. The concatenation of the outputs of forward and flush is the
+    same as resampler.forward on the whole signal (up to the rounding errors
+    of the convolutions).
+    """
+
+    def __init__(self, resampler):
+        self.resampler = resampler
+        self.reset()
+
+    def reset(self):
+        """ Forgets the current signal to start a new one """
+        # input blocks from blocks_per_side blocks before the next output
+        # block, followed by the samples that do not fill a block
+        self.buffer = None
+
+    def _start(self, chunk):
+        padding = self.resampler.blocks_per_side * self.resampler.input_sr
+        # the left padding of the one shot convolution
+        self.buffer = chunk.new_zeros((chunk.shape[0], padding))
+
+    @torch.no_grad()
+    def forward(self, chunk):
+        """
+        Args:
+         chunk: a (minibatch_size, chunk_length) torch.Tensor, the next
+           samples of the signals. chunk_length may be any value.
+
+        Return: a (minibatch_size, n) torch.Tensor with the next n samples of
+         the resampled signals, n may be 0.
+        """
+        if self.resampler.resample_type == 'trivial':
+            self.buffer = chunk[:, :0]
+            return chunk
+        if self.buffer is None:
+            self._start(chunk)
+        input_sr = self.resampler.input_sr
+        output_sr = self.resampler.output_sr
+        blocks_per_side = self.resampler.blocks_per_side
+        self.buffer = torch.cat((self.buffer, chunk), dim=1)
+        num_blocks = self.buffer.shape[1] // input_sr
+        if num_blocks <= 2 * blocks_per_side:
+            return chunk.new_zeros((chunk.shape[0], 0))
+        output = self.resampler.forward(self.buffer[:, :num_blocks * input_sr])
+        # only the output blocks that have all their input blocks are exact
+        output = output[:, blocks_per_side * output_sr:(num_blocks - blocks_per_side) * output_sr]
+        self.buffer = self.buffer[:, (num_blocks - 2 * blocks_per_side) * input_sr:]
+        return output
+
+    @torch.no_grad()
+    def flush(self):
+        """
+        Ends the signal and returns the last output samples, a
+        (minibatch_size, n) torch.Tensor. The resampler is ready for a
+        new signal.
+        """
+        if self.buffer is None:
+            raise RuntimeError("No signal to flush")
+        buffer = self.buffer
+        self.reset()
+        if self.resampler.resample_type == 'trivial':
+            return buffer
+        input_sr = self.resampler.input_sr
+        output_sr = self.resampler.output_sr
+        blocks_per_side = self.resampler.blocks_per_side
+        num_blocks = buffer.shape[1] // input_sr
+        tail = buffer.shape[1] - num_blocks * input_sr
+        if self.resampler.resample_type == 'general' or tail == 0:
+            # the one shot resampling drops the samples that do not fill
+            # a block
+            buffer = buffer[:, :num_blocks * input_sr]
+        else:
+            # the tail is seen by the last outputs through the convolution,
+            # but does not produce an output of its own
+            buffer = torch.nn.functional.pad(buffer, (0, input_sr - tail))
+        # the right padding of the one shot convolution
+        buffer = torch.nn.functional.pad(buffer, (0, blocks_per_side * input_sr))
+        output = self.resampler.forward(buffer)
+        return output[:, blocks_per_side * output_sr:num_blocks * output_sr]
@@ -0,0 +1,59 @@
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+
+class StageTimer:
+    """ Accumulates the time spent in each stage of the creation of the
+    dataloader items, and counters such as the number of bytes read.
+
+    Stages may be nested: the time is attributed to the outermost open stage
+    only (e.g. a read done while retrying a silent segment counts as
+    'silence_retries', not as 'decode'). A disabled timer does nothing.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.times = {}
+        self.counters = {}
+        self._open = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def stage(self, name):
+        """ Context manager timing the stage name """
+        if not self.enabled or self._open is not None:
+            return nullcontext()
+        return self._timed(name)
+
+    @contextmanager
+    def _timed(self, name):
+        self._open = name
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.times[name] = self.times.get(name, 0.0) + time.perf_counter() - start
+            self._open = None
+
+    def count(self, name, value):
+        """ Adds value to the counter name. Safe to call from threads. """
+        if self.enabled:
+            with self._lock:
+                self.counters[name] = self.counters.get(name, 0) + value
+
+    def pop(self):
+        """ Returns the accumulated times and counters and resets them """
+        with self._lock:
+            stats = {'times': self.times, 'counters': self.counters}
+            self.times = {}
+            self.counters = {}
+        return stats